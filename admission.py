@@ -0,0 +1,111 @@
+from contextlib import asynccontextmanager
+from groq import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+import asyncio
+import math
+import time
+
+
+# Provider errors that are worth retrying; once the retries are used up the request is
+# answered with a 503 instead of an error message dressed up as the answer.
+transient_errors = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+
+
+class Overloaded(Exception):
+    """
+    The request cannot be served right now; the client should retry after `retry_after` seconds.
+    """
+
+    def __init__(self, retry_after: int, reason: str = "overloaded"):
+        super().__init__(f"Service {reason}, retry after {retry_after}s")
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+def provider_retry_after(error: BaseException, default: int = 5) -> int:
+    """
+    Seconds to wait after a provider error, from its Retry-After header if it sent one.
+    """
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return max(1, math.ceil(float(value)))
+    except (TypeError, ValueError):
+        return default
+
+
+class AdmissionSlot:
+    def __init__(self, controller: "AdmissionController"):
+        self.controller = controller
+        self.started = time.monotonic()
+        self.released = False
+
+    def release(self) -> None:
+        """
+        Give the slot back; calling it again does nothing.
+        """
+        if not self.released:
+            self.released = True
+            self.controller._release(time.monotonic() - self.started)
+
+
+class AdmissionController:
+    """
+    Concurrency limiter with a bounded wait queue in front of the agent.
+
+    At most `max_concurrent` requests run at once. Up to `max_queue` more wait for a slot,
+    each for at most `queue_timeout` seconds; beyond that requests are shed right away with
+    `Overloaded`. Its `retry_after` is estimated from the average request duration and the
+    queue ahead.
+
+    Args:
+        max_concurrent (int): Requests running at the same time.
+        max_queue (int): Requests allowed to wait for a slot.
+        queue_timeout (float): Seconds a request may wait for a slot.
+    """
+
+    def __init__(self, max_concurrent: int = 8, max_queue: int = 32, queue_timeout: float = 10.0):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.average_s = 1.0  # moving average of request durations
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.average_s * (self.waiting + 1) / self.max_concurrent))
+
+    def _reject(self) -> Overloaded:
+        self.rejected += 1
+        return Overloaded(self.retry_after())
+
+    async def acquire(self) -> AdmissionSlot:
+        if self._semaphore.locked():
+            if self.waiting >= self.max_queue:
+                raise self._reject()
+            self.waiting += 1
+            try:
+                async with asyncio.timeout(self.queue_timeout):
+                    await self._semaphore.acquire()
+            except TimeoutError:
+                raise self._reject() from None
+            finally:
+                self.waiting -= 1
+        else:
+            await self._semaphore.acquire()
+        self.in_flight += 1
+        return AdmissionSlot(self)
+
+    def _release(self, elapsed: float) -> None:
+        self.in_flight -= 1
+        self.average_s = 0.8 * self.average_s + 0.2 * elapsed
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def admit(self):
+        slot = await self.acquire()
+        try:
+            yield slot
+        finally:
+            slot.release()
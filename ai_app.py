@@ -1,9 +1,123 @@
-from graphbuilder import agent
-from fastapi import FastAPI, status
+from graphbuilder import agent, init_checkpointer
+import state_functions
+from budget import Budget, BudgetTracker, budget_config, degrade_reason
+from metrics import AgentTelemetry, register_admission, register_caches, request_duration, requests_rejected, setup_tracing
+from admission import AdmissionController, Overloaded, provider_retry_after, transient_errors
+from answer_cache import AnswerCache
+from ingestion import store_version
+from streaming import ANSWER_NODES, stream_agent_events, format_sse
+from batch import read_questions, run_batch
+from fastapi import FastAPI, Request, Response, status
+from fastapi.responses import JSONResponse, StreamingResponse
+from contextlib import asynccontextmanager
+from starlette.background import BackgroundTask
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from pydantic import BaseModel, Field
-from fastapi.concurrency import run_in_threadpool
+import asyncio
+import json
+import os
+import time
+
+# Startup runs in the background: the process answers /healthz right away, /readyz and the
+# question endpoints only once the models and the vector store are loaded and warm.
+startup = {"ready": False, "failed": False, "error": None, "phases": {}}
+
+
+# Startup is retried with growing pauses; after the last failure /healthz fails, so the
+# orchestrator restarts the worker instead of leaving it unready for good.
+startup_attempts = 3
+
+
+async def warm_up() -> None:
+    started = time.perf_counter()
+    for attempt in range(1, startup_attempts + 1):
+        try:
+            # Loading the models and opening Chroma and the checkpointer block, so they run on a worker thread.
+            await asyncio.to_thread(init_checkpointer)
+            startup["phases"].update(await asyncio.to_thread(state_functions.init))
+            answer_cache.embeddings = state_functions.embeddings
+            startup["phases"]["warm_up"] = await state_functions.awarm_up()
+            break
+        except Exception as e:
+            startup["error"] = repr(e)
+            print(f"Startup attempt {attempt}/{startup_attempts} failed: {e!r}")
+            if attempt == startup_attempts:
+                startup["failed"] = True
+                return
+            await asyncio.sleep(5 * attempt)
+    startup["error"] = None
+    startup["phases"]["total"] = round(time.perf_counter() - started, 3)
+    startup["ready"] = True
+    print(f"Startup finished in {startup['phases']['total']:.3f}s: {startup['phases']}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    task = asyncio.create_task(warm_up())
+    yield
+    task.cancel()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Repeated (or near-identical) questions skip the graph; dropped whenever ingestion changes the store.
+# The embeddings for the semantic lookup are attached once they are loaded.
+answer_cache = AnswerCache(None, similarity_threshold=0.95, ttl=3600, max_entries=10_000, version_fn=store_version)
+
+# Hard ceiling on the work (and latency) a single question may cause.
+default_budget = Budget(max_llm_calls=10, max_tokens=30_000, deadline_s=30.0, max_steps=15)
+
+# Requests beyond the running and queued ones are shed with a 503 instead of piling up on the provider.
+admission = AdmissionController(max_concurrent=8, max_queue=32, queue_timeout=10.0)
+register_admission(admission)
+
+# One batch runs at a time; its questions also take slots of `admission`. Further batches get a 503.
+batch_admission = AdmissionController(max_concurrent=1, max_queue=0, queue_timeout=0.0)
+
+# Node/LLM/retriever timings go to /metrics; set OTEL_EXPORTER_OTLP_ENDPOINT to export spans as well.
+tracer = setup_tracing(app) if os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT") else None
+telemetry = AgentTelemetry(tracer)
+register_caches(lambda: {
+    "answer": answer_cache,
+    "embedding": state_functions.embeddings,
+    "web_search": state_functions.web_searcher,
+    "router": state_functions.question_router,
+    "retrieval_grader": state_functions.retrieval_grader,
+    "hallucination_grader": state_functions.hallucination_grader,
+    "answer_grader": state_functions.answer_grader,
+})
+
+
+def cacheable(answer: str) -> bool:
+    return answer not in ("No generation found", "No output was generated.") and not answer.startswith("I'm sorry, an error occurred")
+
+
+def set_speculation_headers(response: Response, speculation: dict) -> None:
+    print(f"Speculative retrieval: {speculation}")
+    response.headers["X-Speculation-Used"] = str(speculation["used"]).lower()
+    response.headers["X-Speculation-Saved-Ms"] = str(speculation["saved_ms"])
+    response.headers["X-Speculation-Wasted-Ms"] = str(speculation["wasted_ms"])
+
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    requests_rejected.labels(exc.reason).inc()
+    return JSONResponse(
+        {"detail": str(exc)},
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+def require_ready() -> None:
+    if not startup["ready"]:
+        raise Overloaded(5, "starting")
+
+
+def provider_overloaded(error: BaseException) -> Overloaded:
+    print(f"Provider still failing after retries: {error!r}")
+    return Overloaded(provider_retry_after(error), "provider overloaded")
 
-app = FastAPI()
 
 class app_input(BaseModel):
     thread_id: str = Field("1")
@@ -27,23 +141,179 @@ class app_input(BaseModel):
 
 
 @app.post("/ask2", status_code=status.HTTP_201_CREATED)
-async def ask_agent(input: app_input):
+async def ask_agent(input: app_input, response: Response):
+    require_ready()
+    started = time.perf_counter()
+    cached = await answer_cache.aget(input.question)
+    if cached is not None:
+        response.headers["X-Cache"] = "hit"
+        response.headers["X-Cache-Match"] = cached.match
+        response.headers["X-Cache-Similarity"] = f"{cached.similarity:.4f}"
+        request_duration.labels("/ask2", "cache_hit").observe(time.perf_counter() - started)
+        return cached.answer
+    response.headers["X-Cache"] = "miss"
+
     responses = []
-    config = {"configurable": {"thread_id": input.thread_id}}
+    config = {"configurable": {"thread_id": input.thread_id}, "callbacks": [telemetry]}
     query = {"question": input.question}
-    
-    def process_stream():
-        return [output for output in agent.stream(query, config)]
-    
-    outputs = await run_in_threadpool(process_stream)
-
-    for output in outputs:
-        for k, v in output.items():
-            print(f"\nFinished running: {k}")
-            responses.append(v.get("generation", "No generation found"))
-    
+    tracker = BudgetTracker(default_budget)
+    degraded = None
+
+    try:
+        async with admission.admit(), asyncio.timeout(tracker.budget.deadline_s):
+            async for output in agent.astream(query, budget_config(config, tracker)):
+                for k, v in output.items():
+                    print(f"\nFinished running: {k}")
+                    # Every node passes on the state, which may still hold the previous turn's answer.
+                    if k in ANSWER_NODES:
+                        responses.append(v.get("generation", "No generation found"))
+                    if k == "route":
+                        set_speculation_headers(response, v["speculation"])
+    except transient_errors as e:
+        raise provider_overloaded(e) from e
+    except Exception as e:
+        degraded = degrade_reason(e)
+        if degraded is None:
+            raise
+        print(f"Request degraded ({degraded}) after {tracker.as_dict()}")
+        response.headers["X-Degraded"] = degraded
+        # Fall back to the best generation produced before the budget ran out.
+        responses = [r for r in responses if r != "No generation found"]
+
+    request_duration.labels("/ask2", degraded or "ok").observe(time.perf_counter() - started)
     if responses:
         print(responses[-1])
+        if degraded is None and cacheable(responses[-1]):
+            await answer_cache.aput(input.question, responses[-1])
         return responses[-1]
     else:
-        return "No output was generated."
\ No newline at end of file
+        return "No output was generated."
+
+
+@app.post("/ask/stream")
+async def ask_agent_stream(input: app_input):
+    """
+    Stream the answer as Server-Sent Events.
+
+    `token` events carry the answer as it is generated and `node` events report graph
+    progress. The `grade` of each generation follows it, and `done` carries the final
+    answer, whether it came from the cache and, if the request ran out of budget, why
+    it was `degraded`. If the LLM provider keeps failing, an `error` event with
+    `retry_after` ends the stream.
+    """
+    require_ready()
+    config = {"configurable": {"thread_id": input.thread_id}, "callbacks": [telemetry]}
+    query = {"question": input.question}
+    started = time.perf_counter()
+    cached = await answer_cache.aget(input.question)
+
+    async def cached_events():
+        yield format_sse({"event": "token", "data": {"node": "cache", "text": cached.answer}})
+        yield format_sse({"event": "done", "data": {"generation": cached.answer, "cache": "hit", "match": cached.match}})
+        request_duration.labels("/ask/stream", "cache_hit").observe(time.perf_counter() - started)
+
+    if cached is not None:
+        return StreamingResponse(cached_events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    # Admitted (or rejected with a 503) before the stream starts; the slot is held until it ends.
+    slot = await admission.acquire()
+
+    async def events():
+        tracker = BudgetTracker(default_budget)
+        try:
+            async for event in stream_agent_events(agent, query, budget_config(config, tracker), deadline_s=tracker.budget.deadline_s):
+                if event["event"] == "done":
+                    event["data"]["cache"] = "miss"
+                    request_duration.labels("/ask/stream", event["data"].get("degraded") or "ok").observe(time.perf_counter() - started)
+                    if not event["data"].get("degraded") and cacheable(event["data"]["generation"]):
+                        await answer_cache.aput(input.question, event["data"]["generation"])
+                yield format_sse(event)
+        except transient_errors as e:
+            overloaded = provider_overloaded(e)
+            requests_rejected.labels(overloaded.reason).inc()
+            yield format_sse({"event": "error", "data": {"error": overloaded.reason, "retry_after": overloaded.retry_after}})
+        finally:
+            slot.release()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+        # Also frees the slot if the client went away before the stream started.
+        background=BackgroundTask(slot.release),
+    )
+
+
+@app.post("/ask/batch")
+async def ask_agent_batch(request: Request, concurrency: int = 4, cache: bool = True):
+    """
+    Answer a JSONL body of questions (`question` and optional `id` per line) and stream one
+    JSON result per line back as each question finishes.
+
+    Identical questions run once, embeddings and retrievals are batched, and at most
+    `concurrency` questions run through the LLM stages at a time. With `cache` the answers
+    are read from and written to the answer cache, so a batch of FAQs prewarms it.
+
+    Only one batch runs at a time (others get a `503` with `Retry-After`), and each of its
+    questions holds a slot of the request admission limit while it runs, leaving at least
+    half of the slots to interactive requests.
+    """
+    require_ready()
+    try:
+        records = read_questions((await request.body()).decode("utf-8").splitlines())
+    except ValueError as e:
+        return JSONResponse({"detail": str(e)}, status_code=status.HTTP_400_BAD_REQUEST)
+
+    slot = await batch_admission.acquire()
+
+    async def results():
+        try:
+            async for result in run_batch(
+                records,
+                concurrency=max(1, min(concurrency, admission.max_concurrent // 2)),
+                answer_cache=answer_cache if cache else None,
+                callbacks=[telemetry],
+                admission=admission,
+            ):
+                yield json.dumps(result) + "\n"
+        finally:
+            slot.release()
+
+    return StreamingResponse(
+        results(),
+        media_type="application/x-ndjson",
+        # Also frees the slot if the client went away before the stream started.
+        background=BackgroundTask(slot.release),
+    )
+
+
+@app.get("/metrics")
+def metrics():
+    """
+    Prometheus metrics: per-node, LLM call and retrieval latency histograms, LLM calls and
+    tokens, routing/grading decisions, cache hits and misses, and request latency.
+    """
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/healthz")
+def healthz(response: Response):
+    """
+    Liveness: the process is up and serving. `503` once every startup attempt failed, so the
+    worker gets restarted.
+    """
+    if startup["failed"]:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        return {"status": "startup failed", "error": startup["error"]}
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+def readyz(response: Response):
+    """
+    Readiness: 200 once the models and the vector store are loaded and warmed up, 503 before
+    (or if startup failed). Reports the seconds spent in each startup phase.
+    """
+    if not startup["ready"]:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return {"ready": startup["ready"], "error": startup["error"], "phases": startup["phases"]}
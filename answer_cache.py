@@ -0,0 +1,178 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+import re
+import threading
+import time
+import numpy as np
+
+
+def normalize_question(question: str) -> str:
+    """
+    Normalize a question for exact cache lookups: lowercase, collapse whitespace, drop trailing punctuation.
+    """
+    question = re.sub(r"\s+", " ", question.lower()).strip()
+    return question.rstrip(" ?!.")
+
+
+@dataclass
+class CachedAnswer:
+    question: str
+    answer: str
+    created: float
+    vector: Optional[np.ndarray] = None
+    match: str = "exact"
+    similarity: float = 1.0
+
+
+class AnswerCache:
+    """
+    Response cache in front of the agent.
+
+    Answers are keyed on the normalized question text. On an exact miss the question is
+    embedded and compared with the cached questions; the closest one is used if its
+    cosine similarity is at least `similarity_threshold`. Entries expire after `ttl`
+    seconds and the least recently used ones are evicted beyond `max_entries`.
+
+    `version_fn` should return the current vector store version; when it changes
+    (the ingestion pipeline updated the store) every cached answer is dropped.
+
+    Args:
+        embeddings: Embeddings used for the similarity lookup, or None for exact matches only.
+        similarity_threshold (float): Minimum cosine similarity for a semantic hit.
+        ttl (float): Seconds an answer stays valid.
+        max_entries (int): Maximum number of cached answers.
+        version_fn (Callable): Returns the vector store version.
+    """
+
+    def __init__(
+        self,
+        embeddings=None,
+        similarity_threshold: float = 0.95,
+        ttl: float = 3600.0,
+        max_entries: int = 10_000,
+        version_fn: Optional[Callable[[], str]] = None,
+    ):
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version_fn = version_fn
+        self._entries: "OrderedDict[str, CachedAnswer]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Stacked vectors of the cached questions, rebuilt lazily after entries change.
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_keys: List[str] = []
+        self._version = version_fn() if version_fn else None
+        self.hits = 0
+        self.misses = 0
+
+    def _check_version(self) -> None:
+        if self.version_fn is None:
+            return
+        version = self.version_fn()
+        if version != self._version:
+            self._version = version
+            self.clear()
+
+    def _embed(self, question: str) -> Optional[np.ndarray]:
+        if self.embeddings is None:
+            return None
+        return self._normalize_vector(self.embeddings.embed_query(question))
+
+    async def _aembed(self, question: str) -> Optional[np.ndarray]:
+        if self.embeddings is None:
+            return None
+        return self._normalize_vector(await self.embeddings.aembed_query(question))
+
+    def _expire(self, now: float) -> None:
+        expired = [key for key, entry in self._entries.items() if now - entry.created > self.ttl]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+
+    def _similarity_index(self):
+        if self._matrix is None:
+            keys = [key for key, entry in self._entries.items() if entry.vector is not None]
+            self._matrix_keys = keys
+            self._matrix = np.stack([self._entries[key].vector for key in keys]) if keys else np.empty((0, 0), dtype=np.float32)
+        return self._matrix, self._matrix_keys
+
+    def _normalize_vector(self, vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _exact(self, question: str):
+        self._check_version()
+        key = normalize_question(question)
+        with self._lock:
+            self._expire(time.time())
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return CachedAnswer(entry.question, entry.answer, entry.created, entry.vector), None, None
+            matrix, keys = self._similarity_index()
+        return None, matrix, keys
+
+    def get(self, question: str) -> Optional[CachedAnswer]:
+        """
+        Look up an answer for `question`, exact match first, then by embedding similarity.
+
+        Returns:
+            Optional[CachedAnswer]: The cached answer with `match` set to "exact" or "semantic", or None.
+        """
+        hit, matrix, keys = self._exact(question)
+        if hit is not None:
+            return hit
+        return self._semantic(self._embed(question), matrix, keys)
+
+    async def aget(self, question: str) -> Optional[CachedAnswer]:
+        """
+        Async version of `get`; the question is embedded without blocking the event loop.
+        """
+        hit, matrix, keys = self._exact(question)
+        if hit is not None:
+            return hit
+        return self._semantic(await self._aembed(question), matrix, keys)
+
+    def _semantic(self, vector, matrix, keys) -> Optional[CachedAnswer]:
+        if vector is not None and keys:
+            similarities = matrix @ vector
+            best = int(np.argmax(similarities))
+            with self._lock:
+                entry = self._entries.get(keys[best])
+            if entry is not None and similarities[best] >= self.similarity_threshold:
+                with self._lock:
+                    self.hits += 1
+                return CachedAnswer(
+                    entry.question, entry.answer, entry.created, entry.vector,
+                    match="semantic", similarity=float(similarities[best]),
+                )
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, question: str, answer: str) -> None:
+        self._store(question, answer, self._embed(question))
+
+    async def aput(self, question: str, answer: str) -> None:
+        self._store(question, answer, await self._aembed(question))
+
+    def _store(self, question: str, answer: str, vector: Optional[np.ndarray]) -> None:
+        key = normalize_question(question)
+        entry = CachedAnswer(question, answer, time.time(), vector)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
@@ -0,0 +1,259 @@
+from collections import OrderedDict
+from typing import AsyncIterator, Iterable, List, Optional
+from graphbuilder import batch_agent
+import state_functions
+from budget import Budget, BudgetTracker, budget_config, degrade_reason
+from admission import Overloaded, transient_errors
+from answer_cache import normalize_question
+from streaming import ANSWER_NODES
+import asyncio
+import json
+import os
+import time
+
+
+# Same ceiling per question as the API.
+batch_budget = Budget(max_llm_calls=10, max_tokens=30_000, deadline_s=30.0, max_steps=15)
+
+
+def read_questions(lines: Iterable[str]) -> List[dict]:
+    """
+    Parse JSONL questions: one object per line with a `question` (or `body`) and an optional
+    `id` (or `request_id`); lines without an id are numbered.
+
+    Args:
+        lines (Iterable[str]): Lines of the input file.
+
+    Returns:
+        List[dict]: Records with `id` and `question`.
+    """
+    records = []
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError as e:
+            raise ValueError(f"Line {number} is not valid JSON: {e}") from None
+        if not isinstance(item, dict):
+            raise ValueError(f"Line {number} is not a JSON object")
+        question = item.get("question") or item.get("body")
+        if not question:
+            raise ValueError(f"Line {number} has no question")
+        records.append({"id": str(item.get("id") or item.get("request_id") or number), "question": question})
+    return records
+
+
+def completed_ids(path: str) -> set:
+    """
+    Ids already answered in a (possibly interrupted) output file; failed ones are tried again.
+
+    A last line cut off by the interruption is removed, so new results can be appended.
+    """
+    if not os.path.exists(path):
+        return set()
+    with open(path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            f.truncate(end)
+    done = set()
+    for line in data[:end].splitlines():
+        try:
+            result = json.loads(line)
+        except ValueError:
+            continue
+        if result.get("error") is None:
+            done.add(result["id"])
+    return done
+
+
+async def prefetch(questions: List[str], concurrency: int) -> List[List]:
+    """
+    Embed a chunk of questions in full batches, then retrieve their documents.
+
+    The embeddings land in the query LRU cache, so the dense search of each retrieval
+    does not wait for the model.
+    """
+    await state_functions.embeddings.aembed_queries(questions)
+    return await state_functions.retriever.abatch(questions, config={"max_concurrency": concurrency})
+
+
+async def answer(question: str, documents: Optional[List], callbacks: Optional[List] = None) -> dict:
+    """
+    Run the agent graph on one question, starting from the prefetched documents.
+
+    The graph runs without a checkpointer: a batch question leaves no conversation behind.
+
+    Returns:
+        dict: The `answer`, why it was `degraded` (if it was) and the provider `error` (if any).
+    """
+    generations = []
+    config = {"callbacks": callbacks or []}
+    query = {"question": question} if documents is None else {"question": question, "prefetched": documents}
+    tracker = BudgetTracker(batch_budget)
+    degraded = None
+    try:
+        async with asyncio.timeout(tracker.budget.deadline_s):
+            async for output in batch_agent.astream(query, budget_config(config, tracker)):
+                for k, v in output.items():
+                    if k in ANSWER_NODES and v.get("generation"):
+                        generations.append(v["generation"])
+    except transient_errors as e:
+        return {"answer": None, "degraded": None, "error": repr(e)}
+    except Exception as e:
+        degraded = degrade_reason(e)
+        if degraded is None:
+            return {"answer": None, "degraded": None, "error": repr(e)}
+    return {"answer": generations[-1] if generations else "No output was generated.", "degraded": degraded, "error": None}
+
+
+async def run_batch(
+    records: List[dict],
+    concurrency: int = 4,
+    chunk_size: int = 64,
+    skip_ids: Optional[set] = None,
+    answer_cache=None,
+    callbacks: Optional[List] = None,
+    admission=None,
+) -> AsyncIterator[dict]:
+    """
+    Answer many questions, yielding one result per input record as soon as it is ready.
+
+    Identical questions (after normalization) run once and their answer is reported for
+    every record asking it. Questions are processed in chunks of `chunk_size`: the
+    embeddings and retrievals of a chunk are done together, and the LLM stages of at most
+    `concurrency` questions run at a time. The next chunk is prefetched while the last
+    questions of the previous one are still running.
+
+    With an `answer_cache`, cached answers are returned without running the graph and new
+    answers are stored, which prewarms the cache for the API. With an `admission`
+    controller every question holds one of its slots while it runs, so batch questions count
+    against the same concurrency limit as interactive requests; a rejected question waits
+    for the suggested `retry_after` and asks again.
+
+    Args:
+        records (List[dict]): Records with `id` and `question`, see `read_questions`.
+        concurrency (int): Questions whose graph runs at the same time.
+        chunk_size (int): Questions embedded and retrieved together.
+        skip_ids (set): Ids answered before (resume), left out.
+        answer_cache (AnswerCache): Cache to read from and write to, or None.
+        callbacks (List): Callback handlers for every graph run.
+        admission (AdmissionController): Limit shared with the API, or None.
+
+    Yields:
+        dict: `id`, `question`, `answer`, `degraded`, `error`, `cache` and `elapsed_s`.
+    """
+    groups: "OrderedDict[str, dict]" = OrderedDict()
+    for record in records:
+        if skip_ids and record["id"] in skip_ids:
+            continue
+        group = groups.setdefault(normalize_question(record["question"]), {"question": record["question"], "ids": []})
+        group["ids"].append(record["id"])
+    print(f"Batch: {sum(len(g['ids']) for g in groups.values())} questions, {len(groups)} unique")
+
+    results: asyncio.Queue = asyncio.Queue()
+    semaphore = asyncio.Semaphore(concurrency)
+    running = set()
+
+    async def admitted():
+        while True:
+            try:
+                return await admission.acquire()
+            except Overloaded as e:
+                await asyncio.sleep(e.retry_after)
+
+    async def run_one(group: dict, documents: Optional[List]) -> None:
+        started = time.perf_counter()
+        slot = None
+        try:
+            if admission is not None:
+                slot = await admitted()
+            result = await answer(group["question"], documents, callbacks)
+            result["cache"] = "miss"
+            if answer_cache is not None and result["error"] is None and result["degraded"] is None:
+                await answer_cache.aput(group["question"], result["answer"])
+        except Exception as e:
+            result = {"answer": None, "degraded": None, "error": repr(e), "cache": "miss"}
+        finally:
+            if slot is not None:
+                slot.release()
+            semaphore.release()
+        result["elapsed_s"] = round(time.perf_counter() - started, 3)
+        await results.put((group, result))
+
+    async def produce() -> None:
+        pending = list(groups.values())
+        for start in range(0, len(pending), chunk_size):
+            chunk = []
+            for group in pending[start:start + chunk_size]:
+                cached = await answer_cache.aget(group["question"]) if answer_cache is not None else None
+                if cached is not None:
+                    await results.put((group, {"answer": cached.answer, "degraded": None, "error": None, "cache": "hit", "elapsed_s": 0.0}))
+                else:
+                    chunk.append(group)
+            if not chunk:
+                continue
+            try:
+                prefetched = await prefetch([group["question"] for group in chunk], concurrency * 2)
+            except Exception as e:
+                # Without prefetched documents the graph retrieves on its own.
+                print(f"Batch prefetch failed: {e!r}")
+                prefetched = [None] * len(chunk)
+            for group, documents in zip(chunk, prefetched):
+                await semaphore.acquire()
+                task = asyncio.create_task(run_one(group, documents))
+                running.add(task)
+                task.add_done_callback(running.discard)
+
+    producer = asyncio.create_task(produce())
+    remaining = len(groups)
+    try:
+        while remaining:
+            if producer.done():
+                # Everything is scheduled (an exception in the producer ends the batch); just wait for results.
+                producer.result()
+                group, result = await results.get()
+            else:
+                get = asyncio.ensure_future(results.get())
+                await asyncio.wait({get, producer}, return_when=asyncio.FIRST_COMPLETED)
+                if not get.done():
+                    get.cancel()
+                    continue
+                group, result = get.result()
+            remaining -= 1
+            for record_id in group["ids"]:
+                yield {"id": record_id, "question": group["question"], **result}
+    finally:
+        producer.cancel()
+        for task in running:
+            task.cancel()
+
+
+async def main(args) -> None:
+    with open(args.input, "r", encoding="utf-8") as f:
+        records = read_questions(f)
+    done = completed_ids(args.output)
+    if done:
+        print(f"Resuming: {len(done)} questions already answered in {args.output}")
+
+    state_functions.init()
+    started = time.perf_counter()
+    answered = 0
+    with open(args.output, "a", encoding="utf-8") as out:
+        async for result in run_batch(records, concurrency=args.concurrency, chunk_size=args.chunk_size, skip_ids=done):
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+            answered += 1
+    print(f"Batch finished: {answered} answers in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of questions with the agent.")
+    parser.add_argument("input", help="JSONL with a `question` (or `body`) and an optional `id` per line")
+    parser.add_argument("-o", "--output", default="answers.jsonl", help="JSONL results; rerun with the same file to resume")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--chunk-size", type=int, default=64)
+    asyncio.run(main(parser.parse_args()))
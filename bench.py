@@ -0,0 +1,441 @@
+"""
+Offline benchmarks for the agent graph and the FastAPI app.
+
+Groq, Nomic, Tavily and the website are replaced by deterministic local stand-ins with
+configurable latency, so runs are repeatable and can be compared over time:
+
+    python bench.py --suite nodes graph load --output bench.json
+
+`nodes` times every node function on its own, `graph` the whole graph per routing path
+and `load` drives `/ask2` (or `/ask/stream`) of `ai_app` with concurrent requests.
+"""
+from collections import Counter
+from typing import Any, Dict, List, Optional
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.vectorstores import InMemoryVectorStore
+from langchain.schema import Document
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+import httpx
+import numpy as np
+
+
+repo_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Routing paths through the graph. The stand-in LLM picks the path from the marker in the question.
+PATHS = ("direct", "rag", "websearch")
+DIRECT_MARKER = "bench-direct"
+WEBSEARCH_MARKER = "bench-websearch"
+
+TOPICS = [
+    "salary advance", "payroll integration", "employee onboarding", "credit line", "repayment schedule",
+    "interest rates", "employer dashboard", "data security", "customer support", "eligibility criteria",
+]
+
+
+def question_for(path: str, i: int) -> str:
+    topic = TOPICS[i % len(TOPICS)]
+    if path == "direct":
+        return f"What makes a good manager, in general terms? ({DIRECT_MARKER} {i})"
+    if path == "websearch":
+        return f"What did the news say about SalarySe {topic} this week? ({WEBSEARCH_MARKER} {i})"
+    return f"How does the SalarySe {topic} work for employees? (bench-rag {i})"
+
+
+def words_for(seed: str, n: int) -> List[str]:
+    vocabulary = " ".join(TOPICS).split() + ["SalarySe", "employees", "we", "offer", "our", "the", "and", "with"]
+    start = zlib.crc32(seed.encode("utf-8"))
+    return [vocabulary[(start + i * 7) % len(vocabulary)] for i in range(n)]
+
+
+class StubChatModel(BaseChatModel):
+    """
+    Deterministic chat model answering the prompts of `state_functions`.
+
+    The router answers `direct_answer` for questions marked `bench-direct` and `rag`
+    otherwise; the retrieval grader rejects every chunk for questions marked
+    `bench-websearch`; the other graders always pass. Everything else gets a text answer
+    of `answer_tokens` words. A call takes `latency_s` to the first token plus one
+    `1 / tokens_per_s` per token.
+    """
+
+    latency_s: float = 0.05
+    tokens_per_s: float = 200.0
+    answer_tokens: int = 60
+    model_name: str = "bench-stub"
+
+    @property
+    def _llm_type(self) -> str:
+        return "bench-stub"
+
+    def _respond(self, messages: List[BaseMessage]) -> List[str]:
+        prompt = messages[-1].content if messages else ""
+        if "'datasource'" in prompt:
+            datasource = "direct_answer" if DIRECT_MARKER in prompt else "rag"
+            return [json.dumps({"datasource": datasource})]
+        if "relevance of a retrieved document" in prompt:
+            return [json.dumps({"score": "no" if WEBSEARCH_MARKER in prompt else "yes"})]
+        if "'score'" in prompt:
+            return [json.dumps({"score": "yes"})]
+        return [f"{word} " for word in words_for(prompt, self.answer_tokens)]
+
+    def _delay(self, tokens: List[str]) -> float:
+        return self.latency_s + len(tokens) / self.tokens_per_s
+
+    def _result(self, messages: List[BaseMessage], tokens: List[str]) -> ChatResult:
+        text = "".join(tokens).strip()
+        prompt_tokens = sum(len(str(message.content).split()) for message in messages)
+        usage = {"input_tokens": prompt_tokens, "output_tokens": len(tokens), "total_tokens": prompt_tokens + len(tokens)}
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text, usage_metadata=usage))])
+
+    def _generate(self, messages, stop=None, run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        tokens = self._respond(messages)
+        time.sleep(self._delay(tokens))
+        return self._result(messages, tokens)
+
+    async def _agenerate(self, messages, stop=None, run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        tokens = self._respond(messages)
+        await asyncio.sleep(self._delay(tokens))
+        return self._result(messages, tokens)
+
+    def _stream(self, messages, stop=None, run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any):
+        time.sleep(self.latency_s)
+        for token in self._respond(messages):
+            time.sleep(1 / self.tokens_per_s)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any):
+        await asyncio.sleep(self.latency_s)
+        for token in self._respond(messages):
+            await asyncio.sleep(1 / self.tokens_per_s)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
+class StubEmbeddings(Embeddings):
+    """
+    Deterministic bag-of-words embeddings: every word is hashed into one of `size` buckets.
+    Each call takes `latency_s`, however many texts it embeds.
+    """
+
+    def __init__(self, size: int = 256, latency_s: float = 0.01):
+        self.size = size
+        self.latency_s = latency_s
+
+    def _vector(self, text: str) -> List[float]:
+        vector = np.zeros(self.size, dtype=np.float32)
+        for word in text.lower().split():
+            vector[zlib.crc32(word.encode("utf-8")) % self.size] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency_s)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        await asyncio.sleep(self.latency_s)
+        return [self._vector(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+
+class StubSearch:
+    """
+    Stand-in for `TavilySearchResults`: `max_results` made-up results after `latency_s`.
+    """
+
+    def __init__(self, max_results: int = 3, latency_s: float = 0.3):
+        self.max_results = max_results
+        self.latency_s = latency_s
+
+    def _results(self, query: str) -> List[dict]:
+        return [
+            {"url": f"https://example.com/{zlib.crc32(query.encode('utf-8'))}/{i}", "content": " ".join(words_for(f"{query}{i}", 80))}
+            for i in range(self.max_results)
+        ]
+
+    def invoke(self, query: str) -> List[dict]:
+        time.sleep(self.latency_s)
+        return self._results(query)
+
+    async def ainvoke(self, query: str) -> List[dict]:
+        await asyncio.sleep(self.latency_s)
+        return self._results(query)
+
+
+def corpus(size: int) -> List[Document]:
+    return [
+        Document(
+            page_content=f"SalarySe {TOPICS[i % len(TOPICS)]}: " + " ".join(words_for(f"chunk{i}", 150)),
+            metadata={"source": f"https://www.salaryse.com/page/{i // 5}"},
+            id=f"chunk-{i}",
+        )
+        for i in range(size)
+    ]
+
+
+def summarize(latencies: List[float]) -> dict:
+    if not latencies:
+        return {"n": 0}
+    ms = np.array(latencies) * 1000
+    return {
+        "n": len(latencies),
+        "mean_ms": round(float(ms.mean()), 2),
+        "p50_ms": round(float(np.percentile(ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(ms, 95)), 2),
+        "p99_ms": round(float(np.percentile(ms, 99)), 2),
+        "min_ms": round(float(ms.min()), 2),
+        "max_ms": round(float(ms.max()), 2),
+    }
+
+
+def setup(args) -> dict:
+    """
+    Import the app inside a scratch working directory and put the stand-ins in place of
+    what `state_functions.init()` would create (which is never called).
+
+    `db_dir` is taken from the working directory on import, so every cache, index and
+    checkpoint of the run lives in the scratch directory.
+    """
+    workdir = tempfile.mkdtemp(prefix="ai-webscraper-bench-")
+    os.chdir(workdir)
+
+    import state_functions
+    import ai_app
+    from answer_cache import AnswerCache
+    from bm25 import BM25Index, HybridRetriever
+    from disk_cache import DiskCache
+    from embedding_service import BatchingEmbeddings
+    from web_search_cache import CachedWebSearch
+
+    embeddings = BatchingEmbeddings(StubEmbeddings(latency_s=args.embed_latency))
+    documents = corpus(args.corpus_size)
+    store = InMemoryVectorStore(embeddings)
+    store.add_documents(documents, ids=[doc.id for doc in documents])
+    index = BM25Index()
+    for doc in documents:
+        index.add(doc.id, doc.page_content, doc.metadata)
+
+    state_functions.retriever = HybridRetriever(dense=store.as_retriever(search_kwargs={"k": 4}), index=index, k=4, k_dense=4, k_sparse=4)
+    state_functions.web_searcher = CachedWebSearch(
+        StubSearch(latency_s=args.search_latency),
+        DiskCache(os.path.join(state_functions.db_dir, "bench_search_cache.sqlite")),
+    )
+    stub_llm = StubChatModel(latency_s=args.llm_latency, tokens_per_s=args.llm_tokens_per_s, answer_tokens=args.answer_tokens)
+    state_functions.build_chains({node: stub_llm for node in state_functions.node_models})
+    state_functions.embeddings = embeddings
+    # Questions differ per request, so only exact matches would hit; the graph runs for every request.
+    ai_app.answer_cache = AnswerCache(None, ttl=3600, max_entries=10_000)
+    # The in-process transport sends no lifespan events, so the background startup never runs.
+    ai_app.init_checkpointer()
+    ai_app.startup["ready"] = True
+
+    return {"workdir": workdir, "state_functions": state_functions, "ai_app": ai_app}
+
+
+async def bench_nodes(sf, iterations: int) -> dict:
+    """
+    Time every node function on its own, with a fresh question per iteration.
+    """
+    async def state_for(path: str, i: int) -> dict:
+        question = question_for(path, i)
+        documents = await sf.retriever.ainvoke(question)
+        return {"question": question, "documents": documents, "generation": " ".join(words_for(question, 60))}
+
+    cases = {
+        "route_question": ("rag", sf.aroute_question),
+        "route_and_retrieve": ("rag", sf.aroute_and_retrieve),
+        "retrieve": ("rag", sf.aretrieve),
+        "grade_documents": ("rag", sf.agrade_documents),
+        "websearch": ("websearch", sf.aweb_search),
+        "generate": ("rag", sf.agenerate),
+        "generate_direct": ("direct", sf.agenerate_direct),
+        "hallucination_check": ("rag", sf.ahallucination_check),
+    }
+    results = {}
+    for name, (path, func) in cases.items():
+        latencies = []
+        for i in range(iterations + 1):
+            state = await state_for(path, 1_000_000 + len(results) * 10_000 + i)
+            started = time.perf_counter()
+            await func(state)
+            if i:  # the first call is a warm-up
+                latencies.append(time.perf_counter() - started)
+        results[name] = summarize(latencies)
+        print(f"node {name}: {results[name]}")
+
+    latencies = []
+    for i in range(iterations):
+        state = await state_for("rag", i)
+        started = time.perf_counter()
+        sf.pack_context(state["question"], state["documents"], token_budget=sf.context_token_budget)
+        latencies.append(time.perf_counter() - started)
+    results["pack_context"] = summarize(latencies)
+    return results
+
+
+async def bench_graph(agent, iterations: int) -> dict:
+    """
+    Run the whole graph `iterations` times per routing path and record the nodes it went through.
+    """
+    results = {}
+    for path in PATHS:
+        latencies = []
+        routes = Counter()
+        for i in range(iterations):
+            config = {"configurable": {"thread_id": f"bench-graph-{path}-{i}"}}
+            nodes = []
+            started = time.perf_counter()
+            async for output in agent.astream({"question": question_for(path, 2_000_000 + i)}, config):
+                nodes.extend(output)
+            latencies.append(time.perf_counter() - started)
+            routes[" > ".join(nodes)] += 1
+        results[path] = {**summarize(latencies), "routes": dict(routes)}
+        print(f"graph {path}: {results[path]}")
+    return results
+
+
+async def bench_load(app, concurrency: int, requests: int, endpoint: str) -> dict:
+    """
+    Send `requests` questions (all routing paths, round robin) with `concurrency` in flight
+    through the ASGI app and report latency percentiles and throughput. For the streaming
+    endpoint the time to the first answer token is reported as well.
+    """
+    latencies, first_tokens = [], []
+    statuses = Counter()
+    errors = Counter()
+    counter = iter(range(requests))
+
+    async def one(client: httpx.AsyncClient, i: int) -> None:
+        body = {"thread_id": f"bench-load-{i}", "question": question_for(PATHS[i % len(PATHS)], 3_000_000 + i)}
+        started = time.perf_counter()
+        if endpoint == "/ask/stream":
+            first_token = None
+            async with client.stream("POST", endpoint, json=body) as response:
+                async for line in response.aiter_lines():
+                    if line == "event: token" and first_token is None:
+                        first_token = time.perf_counter() - started
+                statuses[response.status_code] += 1
+            if first_token is not None:
+                first_tokens.append(first_token)
+        else:
+            response = await client.post(endpoint, json=body)
+            statuses[response.status_code] += 1
+            if response.headers.get("X-Degraded"):
+                errors[f"degraded:{response.headers['X-Degraded']}"] += 1
+        latencies.append(time.perf_counter() - started)
+
+    async def worker(client: httpx.AsyncClient) -> None:
+        for i in counter:
+            try:
+                await one(client, i)
+            except Exception as e:
+                errors[type(e).__name__] += 1
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    result = {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": requests,
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else math.nan,
+        "latency": summarize(latencies),
+        "status": {str(code): count for code, count in statuses.items()},
+        "errors": dict(errors),
+    }
+    if endpoint == "/ask/stream":
+        result["first_token"] = summarize(first_tokens)
+    print(f"load {endpoint} x{concurrency}: {result}")
+    return result
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=repo_dir, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    env = setup(args)
+    sf, ai_app = env["state_functions"], env["ai_app"]
+    report: Dict[str, Any] = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "speculative_retrieval": sf.speculative_retrieval,
+            "args": {key: value for key, value in vars(args).items() if key != "output"},
+        }
+    }
+    try:
+        if "nodes" in args.suite:
+            report["nodes"] = await bench_nodes(sf, args.iterations)
+        if "graph" in args.suite:
+            report["graph"] = await bench_graph(ai_app.agent, args.iterations)
+        if "load" in args.suite:
+            report["load"] = [await bench_load(ai_app.app, c, args.requests, args.endpoint) for c in args.concurrency]
+    finally:
+        os.chdir(repo_dir)
+        shutil.rmtree(env["workdir"], ignore_errors=True)
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the agent graph and the FastAPI app.")
+    parser.add_argument("--suite", nargs="+", choices=["nodes", "graph", "load"], default=["nodes", "graph", "load"])
+    parser.add_argument("--iterations", type=int, default=20, help="Runs per node and per routing path.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="Requests in flight; one load run per value.")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per load run.")
+    parser.add_argument("--endpoint", choices=["/ask2", "/ask/stream"], default="/ask2")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Seconds to the first token of every LLM call.")
+    parser.add_argument("--llm-tokens-per-s", type=float, default=200.0)
+    parser.add_argument("--answer-tokens", type=int, default=60, help="Tokens of every generated answer.")
+    parser.add_argument("--embed-latency", type=float, default=0.01, help="Seconds per embedding call.")
+    parser.add_argument("--search-latency", type=float, default=0.3, help="Seconds per web search.")
+    parser.add_argument("--corpus-size", type=int, default=500, help="Chunks in the stand-in vector store.")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout.")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.output:
+        args.output = os.path.abspath(args.output)
+    report = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}")
+    else:
+        json.dump(report, sys.stdout, indent=2)
@@ -0,0 +1,180 @@
+from collections import Counter, defaultdict
+from typing import Callable, Dict, List, Optional, Tuple
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+from langchain.schema import Document
+from pydantic import PrivateAttr
+from chunking import chunk_id
+import json
+import math
+import os
+import re
+
+
+def tokenize(text: str) -> List[str]:
+    return re.findall(r"\w+", text.lower())
+
+
+class BM25Index:
+    """
+    In-process inverted index scoring chunks with Okapi BM25.
+
+    It is kept in sync with the vector store by the ingestion stage (`add`/`remove` per
+    chunk id) and persisted as JSON next to the Chroma directory. Term frequencies are
+    stored per chunk, so loading rebuilds the postings without re-tokenizing the corpus.
+
+    Args:
+        k1 (float): Term frequency saturation.
+        b (float): Document length normalization.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs: Dict[str, dict] = {}
+        self.postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def add(self, key: str, text: str, metadata: Optional[dict] = None) -> None:
+        if key in self.docs:
+            self.remove(key)
+        tokens = tokenize(text)
+        tf = dict(Counter(tokens))
+        self.docs[key] = {"text": text, "metadata": metadata or {}, "tf": tf, "length": len(tokens)}
+        self._index(key, tf, len(tokens))
+
+    def _index(self, key: str, tf: Dict[str, int], length: int) -> None:
+        for term, count in tf.items():
+            self.postings[term][key] = count
+        self.total_length += length
+
+    def remove(self, key: str) -> None:
+        doc = self.docs.pop(key, None)
+        if doc is None:
+            return
+        for term in doc["tf"]:
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(key, None)
+                if not postings:
+                    del self.postings[term]
+        self.total_length -= doc["length"]
+
+    def clear(self) -> None:
+        self.docs.clear()
+        self.postings.clear()
+        self.total_length = 0
+
+    def search(self, query: str, k: int = 4) -> List[Tuple[str, float]]:
+        """
+        Return the ids and BM25 scores of the `k` best matching chunks.
+        """
+        if not self.docs:
+            return []
+        n = len(self.docs)
+        avg_length = self.total_length / n or 1.0
+        scores: Dict[str, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for key, tf in postings.items():
+                length = self.docs[key]["length"]
+                scores[key] += idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / avg_length))
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def document(self, key: str) -> Document:
+        doc = self.docs[key]
+        return Document(page_content=doc["text"], metadata=doc["metadata"], id=key)
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"k1": self.k1, "b": self.b, "docs": self.docs}, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        index = cls()
+        if not os.path.exists(path):
+            return index
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        index.k1, index.b = data["k1"], data["b"]
+        index.docs = data["docs"]
+        for key, doc in index.docs.items():
+            index._index(key, doc["tf"], doc["length"])
+        return index
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], rrf_k: int = 60) -> List[str]:
+    """
+    Fuse several rankings of ids: each id scores sum(1 / (rrf_k + rank)) over the rankings it appears in.
+    """
+    scores: Dict[str, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] += 1.0 / (rrf_k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retriever fusing dense vector search with BM25 by reciprocal rank fusion.
+
+    The dense retriever returns `k_dense` results and BM25 `k_sparse`; the fused list is cut
+    to `k`. Exact terms such as product names are found by BM25 even when the embedding
+    misses them.
+
+    If `version_fn` is given, the index is reloaded from `index_path` whenever the
+    returned store version changes (i.e. after an ingestion run).
+    """
+
+    dense: BaseRetriever
+    index: BM25Index
+    k: int = 4
+    k_dense: int = 4
+    k_sparse: int = 4
+    rrf_k: int = 60
+    index_path: Optional[str] = None
+    version_fn: Optional[Callable[[], str]] = None
+    _version: Optional[str] = PrivateAttr(default=None)
+
+    def _refresh_index(self) -> None:
+        if self.version_fn is None or self.index_path is None:
+            return
+        version = self.version_fn()
+        if self._version is None:
+            self._version = version
+        elif version != self._version:
+            self._version = version
+            self.index = BM25Index.load(self.index_path)
+
+    def _fuse(self, dense_docs: List[Document], query: str) -> List[Document]:
+        by_id: Dict[str, Document] = {}
+        dense_ranking = []
+        for doc in dense_docs:
+            key = doc.id or chunk_id(doc.metadata.get("source", ""), doc.page_content)
+            by_id.setdefault(key, doc)
+            dense_ranking.append(key)
+        sparse_ranking = []
+        for key, _ in self.index.search(query, self.k_sparse):
+            if key not in by_id:
+                by_id[key] = self.index.document(key)
+            sparse_ranking.append(key)
+        return [by_id[key] for key in reciprocal_rank_fusion([dense_ranking, sparse_ranking], self.rrf_k)[: self.k]]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        self._refresh_index()
+        dense_docs = self.dense.invoke(query, config={"callbacks": run_manager.get_child()})
+        return self._fuse(dense_docs, query)
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        self._refresh_index()
+        dense_docs = await self.dense.ainvoke(query, config={"callbacks": run_manager.get_child()})
+        return self._fuse(dense_docs, query)
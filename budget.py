@@ -0,0 +1,130 @@
+from dataclasses import dataclass
+from typing import Any, Optional
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langgraph.errors import GraphRecursionError
+import time
+
+
+@dataclass
+class Budget:
+    """
+    Limits for a single request, enforced across every node of the graph.
+
+    Args:
+        max_llm_calls (int): LLM calls allowed (generation, routing and grading together).
+        max_tokens (int): Prompt + completion tokens allowed.
+        deadline_s (float): Wall-clock seconds the request may take.
+        max_steps (int): Graph steps allowed, passed to LangGraph as `recursion_limit`.
+    """
+
+    max_llm_calls: int = 10
+    max_tokens: int = 30_000
+    deadline_s: float = 30.0
+    max_steps: int = 15
+
+
+class BudgetExceeded(Exception):
+    def __init__(self, reason: str):
+        super().__init__(f"Request budget exhausted: {reason}")
+        self.reason = reason
+
+
+class BudgetTracker(BaseCallbackHandler):
+    """
+    Callback handler that counts LLM calls and tokens of one request and aborts it once its `Budget` is spent.
+
+    It raises `BudgetExceeded` from the callbacks, which runs inside whichever node is
+    currently working, so the graph stops at the next LLM call, token or node after the
+    budget ran out.
+    """
+
+    raise_error = True
+    run_inline = True
+
+    def __init__(self, budget: Budget):
+        self.budget = budget
+        self.started = time.monotonic()
+        self.llm_calls = 0
+        self.tokens = 0
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    @property
+    def remaining_s(self) -> float:
+        return max(0.0, self.budget.deadline_s - self.elapsed)
+
+    def check(self) -> None:
+        if self.elapsed > self.budget.deadline_s:
+            raise BudgetExceeded("deadline")
+        if self.tokens >= self.budget.max_tokens:
+            raise BudgetExceeded("tokens")
+
+    def _start_llm_call(self) -> None:
+        self.check()
+        if self.llm_calls >= self.budget.max_llm_calls:
+            raise BudgetExceeded("llm_calls")
+        self.llm_calls += 1
+
+    def on_llm_start(self, serialized, prompts, **kwargs: Any) -> None:
+        self._start_llm_call()
+
+    def on_chat_model_start(self, serialized, messages, **kwargs: Any) -> None:
+        self._start_llm_call()
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        if self.elapsed > self.budget.deadline_s:
+            raise BudgetExceeded("deadline")
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        self.tokens += count_tokens(response)
+
+    def on_chain_start(self, serialized, inputs, **kwargs: Any) -> None:
+        self.check()
+
+    def as_dict(self) -> dict:
+        return {"llm_calls": self.llm_calls, "tokens": self.tokens, "elapsed_s": round(self.elapsed, 3)}
+
+
+def count_tokens(response: LLMResult) -> int:
+    """
+    Total tokens of an LLM response, from the provider's usage data or estimated from the text.
+    """
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if usage.get("total_tokens"):
+        return usage["total_tokens"]
+    total = 0
+    for generations in response.generations:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if metadata:
+                total += metadata.get("total_tokens", 0)
+            else:
+                total += len(generation.text) // 4
+    return total
+
+
+def degrade_reason(error: BaseException) -> Optional[str]:
+    """
+    Name of the exhausted budget if `error` means the request ran out of budget, else None.
+    """
+    if isinstance(error, BudgetExceeded):
+        return error.reason
+    if isinstance(error, GraphRecursionError):
+        return "steps"
+    if isinstance(error, TimeoutError):
+        return "deadline"
+    return None
+
+
+def budget_config(config: dict, tracker: BudgetTracker) -> dict:
+    """
+    Add the tracker and the step limit to a graph run config.
+    """
+    return {
+        **config,
+        "callbacks": [*config.get("callbacks", []), tracker],
+        "recursion_limit": tracker.budget.max_steps,
+    }
@@ -0,0 +1,177 @@
+from concurrent.futures import ProcessPoolExecutor, Future
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Iterable, Iterator, List, Optional, Tuple
+from langchain.schema import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from bs4 import BeautifulSoup
+import asyncio
+import hashlib
+import os
+import time
+import tiktoken
+
+
+ENCODING_NAME = "gpt2"  # what RecursiveCharacterTextSplitter.from_tiktoken_encoder uses by default
+
+# Per-worker state, created once by `_init_worker` in every pool process.
+_splitter: Optional[RecursiveCharacterTextSplitter] = None
+_encoding = None
+
+
+def content_hash(text: str) -> str:
+    """
+    Hash a piece of text so unchanged pages and chunks can be recognised between runs.
+
+    Args:
+        text (str): Page or chunk content.
+
+    Returns:
+        str: Hex sha256 digest of the text.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_id(source: str, text: str) -> str:
+    """
+    Build a stable Chroma id for a chunk from its source url and content.
+
+    Args:
+        source (str): The url the chunk was split from.
+        text (str): The chunk content.
+
+    Returns:
+        str: Id that only changes when the chunk content (or its page) changes.
+    """
+    return content_hash(f"{source}\0{text}")
+
+
+def html_to_document(url: str, html: str) -> Document:
+    """
+    Turn a fetched html page into a Document the same way WebBaseLoader does.
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    metadata = {"source": url}
+    if soup.title and soup.title.string:
+        metadata["title"] = soup.title.string.strip()
+    if soup.html and soup.html.get("lang"):
+        metadata["language"] = soup.html.get("lang")
+    return Document(page_content=soup.get_text(), metadata=metadata)
+
+
+def _init_worker(chunk_size: int, chunk_overlap: int, encoding_name: str) -> None:
+    global _splitter, _encoding
+    _encoding = tiktoken.get_encoding(encoding_name)
+    _splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        encoding_name=encoding_name, chunk_size=chunk_size, chunk_overlap=chunk_overlap
+    )
+
+
+def _chunk_page(url: str, content: str, is_html: bool, known_hash: Optional[str]) -> "ChunkedPage":
+    page = html_to_document(url, content) if is_html else Document(page_content=content, metadata={"source": url})
+    page_hash = content_hash(page.page_content)
+    if page_hash == known_hash:
+        return ChunkedPage(page=page, page_hash=page_hash, chunks=None, tokens=0)
+    chunks = _splitter.split_documents([page])
+    tokens = len(_encoding.encode_ordinary(page.page_content))
+    return ChunkedPage(page=page, page_hash=page_hash, chunks=chunks, tokens=tokens)
+
+
+@dataclass
+class ChunkedPage:
+    page: Document
+    page_hash: str
+    chunks: Optional[List[Document]]  # None when the page hash matched `known_hash`
+    tokens: int
+
+
+@dataclass
+class ChunkingStats:
+    docs: int = 0
+    chunks: int = 0
+    tokens: int = 0
+    started: float = field(default_factory=time.perf_counter)
+
+    def record(self, result: ChunkedPage) -> None:
+        self.docs += 1
+        self.chunks += len(result.chunks or [])
+        self.tokens += result.tokens
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    @property
+    def docs_per_s(self) -> float:
+        return self.docs / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def tokens_per_s(self) -> float:
+        return self.tokens / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "docs": self.docs, "chunks": self.chunks, "tokens": self.tokens,
+            "elapsed_s": round(self.elapsed, 3),
+            "docs_per_s": round(self.docs_per_s, 2), "tokens_per_s": round(self.tokens_per_s, 2),
+        }
+
+
+class ChunkingPipeline:
+    """
+    Fans HTML cleanup and tiktoken chunking out to a process pool.
+
+    Every worker builds its tiktoken encoder and splitter once. Results are yielded in
+    the order pages were submitted, with at most `window` pages in flight, so memory
+    stays flat however large the input is. `stats` keeps docs/s and tokens/s.
+
+    Args:
+        workers (int): Number of worker processes, defaults to the cpu count.
+        chunk_size (int): Chunk size in tokens.
+        chunk_overlap (int): Overlap between chunks in tokens.
+        window (int): Max pages submitted but not yet yielded, defaults to 4 per worker.
+    """
+
+    def __init__(self, workers: Optional[int] = None, chunk_size: int = 1000, chunk_overlap: int = 100, window: Optional[int] = None):
+        self.workers = workers or os.cpu_count() or 1
+        self.window = window or self.workers * 4
+        self.stats = ChunkingStats()
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_worker,
+            initargs=(chunk_size, chunk_overlap, ENCODING_NAME),
+        )
+
+    def submit(self, url: str, content: str, is_html: bool = True, known_hash: Optional[str] = None) -> Future:
+        return self._pool.submit(_chunk_page, url, content, is_html, known_hash)
+
+    async def achunk(self, url: str, content: str, is_html: bool = True, known_hash: Optional[str] = None) -> ChunkedPage:
+        result = await asyncio.wrap_future(self.submit(url, content, is_html, known_hash))
+        self.stats.record(result)
+        return result
+
+    def map(self, pages: Iterable[Tuple[str, str]], is_html: bool = True) -> Iterator[ChunkedPage]:
+        """
+        Chunk `(url, content)` pairs, yielding results in input order.
+        """
+        pending: Deque[Future] = deque()
+        for url, content in pages:
+            pending.append(self.submit(url, content, is_html))
+            if len(pending) >= self.window:
+                yield self._collect(pending.popleft())
+        while pending:
+            yield self._collect(pending.popleft())
+
+    def _collect(self, future: Future) -> ChunkedPage:
+        result = future.result()
+        self.stats.record(result)
+        return result
+
+    def close(self) -> None:
+        self._pool.shutdown(cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,120 @@
+from collections import Counter
+from typing import List, Optional
+from langchain.schema import Document
+from chunking import content_hash
+from functools import lru_cache
+import math
+import re
+import tiktoken
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    # Loaded on first use, so importing the app does not load (or download) the encoding.
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str) -> int:
+    return len(_encoding().encode_ordinary(text))
+
+
+def _words(text: str) -> List[str]:
+    return re.findall(r"\w+", text.lower())
+
+
+def _shingles(words: List[str], size: int = 5) -> set:
+    if len(words) < size:
+        return {tuple(words)}
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def _cosine(a: Counter, b: Counter) -> float:
+    if not a or not b:
+        return 0.0
+    dot = sum(count * b.get(term, 0) for term, count in a.items())
+    norm = math.sqrt(sum(c * c for c in a.values())) * math.sqrt(sum(c * c for c in b.values()))
+    return dot / norm if norm else 0.0
+
+
+def dedupe_documents(documents: List[Document], near_duplicate_threshold: float = 0.8) -> List[Document]:
+    """
+    Drop exact duplicates and near-duplicates (word 5-gram Jaccard similarity above the threshold), keeping the first occurrence.
+    """
+    kept: List[Document] = []
+    seen_hashes = set()
+    kept_shingles: List[set] = []
+    for doc in documents:
+        digest = content_hash(doc.page_content.strip())
+        if digest in seen_hashes:
+            continue
+        shingles = _shingles(_words(doc.page_content))
+        if any(len(shingles & other) / len(shingles | other) >= near_duplicate_threshold for other in kept_shingles):
+            continue
+        seen_hashes.add(digest)
+        kept_shingles.append(shingles)
+        kept.append(doc)
+    return kept
+
+
+def pack_context(
+    question: str,
+    documents: List[Document],
+    token_budget: int = 3000,
+    lambda_mult: float = 0.7,
+    near_duplicate_threshold: float = 0.8,
+) -> List[Document]:
+    """
+    Choose the passages that go into the prompt.
+
+    Duplicates and near-duplicates are dropped. Then passages are picked by maximal
+    marginal relevance (relevance to the question against similarity to what was already
+    picked, weighted by `lambda_mult`) as long as they fit in `token_budget` tokens.
+    Similarity is term-frequency cosine, which needs no extra embedding calls.
+
+    Args:
+        question (str): The user question.
+        documents (List[Document]): Candidate passages, best first.
+        token_budget (int): Maximum tokens of all selected passages together.
+        lambda_mult (float): 1 ranks by relevance only, 0 by diversity only.
+        near_duplicate_threshold (float): Jaccard similarity above which a passage counts as a duplicate.
+
+    Returns:
+        List[Document]: The selected passages, in the order they were picked.
+    """
+    candidates = dedupe_documents(documents, near_duplicate_threshold)
+    query_vector = Counter(_words(question))
+    vectors = [Counter(_words(doc.page_content)) for doc in candidates]
+    relevance = [_cosine(query_vector, vector) for vector in vectors]
+    tokens = [count_tokens(doc.page_content) for doc in candidates]
+
+    selected: List[int] = []
+    remaining = set(range(len(candidates)))
+    budget = token_budget
+    while remaining:
+        best: Optional[int] = None
+        best_score = -math.inf
+        for i in remaining:
+            if tokens[i] > budget:
+                continue
+            redundancy = max((_cosine(vectors[i], vectors[j]) for j in selected), default=0.0)
+            score = lambda_mult * relevance[i] - (1 - lambda_mult) * redundancy
+            if score > best_score:
+                best, best_score = i, score
+        if best is None:
+            break
+        selected.append(best)
+        remaining.discard(best)
+        budget -= tokens[best]
+
+    if not selected and candidates:
+        # Every passage is larger than the budget on its own: keep the most relevant one, truncated.
+        best = max(range(len(candidates)), key=lambda i: relevance[i])
+        doc = candidates[best]
+        text = _encoding().decode(_encoding().encode_ordinary(doc.page_content)[:token_budget])
+        return [Document(page_content=text, metadata=doc.metadata)]
+
+    return [candidates[i] for i in selected]
+
+
+def format_context(documents: List[Document]) -> str:
+    return "\n\n".join(doc.page_content for doc in documents)
@@ -0,0 +1,266 @@
+from dataclasses import dataclass, field
+from html.parser import HTMLParser
+from typing import AsyncIterator, Dict, Iterable, List, Optional
+from urllib.parse import urljoin, urlsplit, urlunsplit, parse_qsl, urlencode
+import asyncio
+import httpx
+
+
+SKIPPED_EXTENSIONS = (
+    ".png", ".jpg", ".jpeg", ".gif", ".svg", ".webp", ".ico", ".css", ".js", ".pdf",
+    ".zip", ".gz", ".mp3", ".mp4", ".woff", ".woff2", ".ttf", ".xml", ".json",
+)
+
+
+def normalize_url(url: str, base: Optional[str] = None) -> Optional[str]:
+    """
+    Canonicalise a url so the same page is only fetched once.
+
+    Resolves it against `base`, drops the fragment and default ports, lowercases the
+    scheme and host, and sorts the query string.
+
+    Args:
+        url (str): Absolute or relative url.
+        base (str): Page the url was found on.
+
+    Returns:
+        Optional[str]: The normalized url, or None if it is not an http(s) page link.
+    """
+    if base:
+        url = urljoin(base, url)
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    if scheme not in ("http", "https") or not parts.hostname:
+        return None
+    host = parts.hostname.lower()
+    if parts.port and not ((scheme == "http" and parts.port == 80) or (scheme == "https" and parts.port == 443)):
+        host = f"{host}:{parts.port}"
+    path = parts.path or "/"
+    if path.lower().endswith(SKIPPED_EXTENSIONS):
+        return None
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, path, query, ""))
+
+
+class _LinkParser(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.links: List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "a":
+            href = dict(attrs).get("href")
+            if href:
+                self.links.append(href)
+
+
+def extract_links(html: str, base: str) -> List[str]:
+    """
+    Return the normalized, de-duplicated outgoing page links of an html document.
+    """
+    parser = _LinkParser()
+    parser.feed(html)
+    links = []
+    for href in parser.links:
+        link = normalize_url(href, base)
+        if link and link not in links:
+            links.append(link)
+    return links
+
+
+@dataclass
+class CrawlResult:
+    url: str
+    depth: int
+    status: int
+    html: str = ""
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    links: List[str] = field(default_factory=list)
+    requested_url: Optional[str] = None  # differs from `url` after a redirect
+
+    @property
+    def not_modified(self) -> bool:
+        return self.status == 304
+
+
+class Crawler:
+    """
+    Asynchronous site crawler with bounded concurrency.
+
+    All requests share one pooled `httpx.AsyncClient`. At most `per_host_concurrency`
+    requests are in flight per host, urls are normalized and fetched once, and the
+    crawl stops at `max_depth` links from the start urls or `max_pages` pages. Pages
+    larger than `max_bytes` are skipped.
+
+    `known` maps urls to what the last crawl saw (`etag`, `last_modified`, `links`, and
+    the urls that `redirected_from` to them). Those validators are sent as
+    `If-None-Match` / `If-Modified-Since`, so unchanged pages come back as cheap 304s,
+    and their remembered links keep the crawl going.
+
+    Pages are reported under the url they were last stored as (the redirect target); a
+    redirect target is fetched once, however many urls lead to it, and one outside
+    `allowed_hosts` is skipped.
+    Urls answering 404/410 are collected in `gone`; those that failed (errors, other
+    statuses) in `failed` and those skipped (not html, too large) in `skipped`. A crawl
+    that failed somewhere or hit `max_pages` is not `complete`.
+
+    Pass `client` to crawl through a custom transport, e.g. against a local test server.
+    """
+
+    def __init__(
+        self,
+        start_urls: Iterable[str],
+        max_depth: int = 3,
+        max_pages: int = 5000,
+        max_bytes: int = 5_000_000,
+        concurrency: int = 16,
+        per_host_concurrency: int = 4,
+        allowed_hosts: Optional[Iterable[str]] = None,
+        known: Optional[Dict[str, dict]] = None,
+        timeout: float = 20.0,
+        client: Optional[httpx.AsyncClient] = None,
+    ):
+        self.start_urls = [u for u in (normalize_url(u) for u in start_urls) if u]
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.max_bytes = max_bytes
+        self.concurrency = concurrency
+        self.per_host_concurrency = per_host_concurrency
+        self.allowed_hosts = set(allowed_hosts) if allowed_hosts else {urlsplit(u).netloc for u in self.start_urls}
+        self.known = known or {}
+        self.timeout = timeout
+        self._client = client
+        self._host_limits: Dict[str, asyncio.Semaphore] = {}
+        self._seen = set()
+        self._aliases = {alias: url for url, page in self.known.items() for alias in page.get("redirected_from", [])}
+        self.gone = set()
+        self.failed = set()
+        self.skipped = set()
+        self.truncated = False
+
+    @property
+    def complete(self) -> bool:
+        return not self.failed and not self.truncated
+
+    def key(self, url: str) -> str:
+        """
+        Url under which the page at `url` was stored by the last crawl (its redirect target, if any).
+        """
+        return self._aliases.get(url, url)
+
+    def _new_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            timeout=self.timeout,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+            headers={"User-Agent": "ai-webscraper-crawler/1.0"},
+        )
+
+    def _enqueue(self, queue: asyncio.Queue, url: str, depth: int) -> None:
+        if url in self._seen or urlsplit(url).netloc not in self.allowed_hosts:
+            return
+        if len(self._seen) >= self.max_pages:
+            self.truncated = True
+            return
+        self._seen.add(url)
+        queue.put_nowait((url, depth))
+
+    async def _fetch(self, client: httpx.AsyncClient, url: str, depth: int) -> Optional[CrawlResult]:
+        headers = {}
+        key = self.key(url)
+        previous = self.known.get(key, {})
+        if previous.get("etag"):
+            headers["If-None-Match"] = previous["etag"]
+        if previous.get("last_modified"):
+            headers["If-Modified-Since"] = previous["last_modified"]
+
+        host = urlsplit(url).netloc
+        limit = self._host_limits.setdefault(host, asyncio.Semaphore(self.per_host_concurrency))
+        async with limit:
+            async with client.stream("GET", url, headers=headers) as response:
+                if response.status_code == 304:
+                    return CrawlResult(
+                        url=key, depth=depth, status=304,
+                        etag=previous.get("etag"), last_modified=previous.get("last_modified"),
+                        links=list(previous.get("links", [])), requested_url=url,
+                    )
+                if response.status_code in (404, 410):
+                    self.gone.add(key)
+                    return None
+                if response.status_code != 200:
+                    print(f"Failed to fetch {url}: HTTP {response.status_code}")
+                    self.failed.add(key)
+                    return None
+                final_url = normalize_url(str(response.url)) or url
+                if final_url != url:
+                    if urlsplit(final_url).netloc not in self.allowed_hosts:
+                        # Redirected off the site: not a page of ours.
+                        self.skipped.add(key)
+                        return None
+                    if final_url in self._seen:
+                        # The target is fetched under its own url.
+                        return None
+                    self._seen.add(final_url)
+                if "html" not in response.headers.get("content-type", "html"):
+                    self.skipped.add(key)
+                    return None
+                if int(response.headers.get("content-length", 0)) > self.max_bytes:
+                    self.skipped.add(key)
+                    return None
+                body = bytearray()
+                async for chunk in response.aiter_bytes():
+                    body.extend(chunk)
+                    if len(body) > self.max_bytes:
+                        self.skipped.add(key)
+                        return None
+                html = body.decode(response.encoding or "utf-8", errors="replace")
+
+        return CrawlResult(
+            url=final_url, depth=depth, status=200, html=html,
+            etag=response.headers.get("etag"), last_modified=response.headers.get("last-modified"),
+            links=extract_links(html, final_url), requested_url=url,
+        )
+
+    async def _worker(self, client: httpx.AsyncClient, queue: asyncio.Queue, results: asyncio.Queue) -> None:
+        while True:
+            url, depth = await queue.get()
+            try:
+                result = await self._fetch(client, url, depth)
+                if result is not None:
+                    if depth < self.max_depth:
+                        for link in result.links:
+                            self._enqueue(queue, link, depth + 1)
+                    await results.put(result)
+            except Exception as e:
+                # One bad page (network error, bad header, unknown charset) must not stop this worker.
+                print(f"Failed to fetch {url}: {e!r}")
+                self.failed.add(self.key(url))
+            finally:
+                queue.task_done()
+
+    async def crawl(self) -> AsyncIterator[CrawlResult]:
+        """
+        Crawl from the start urls, yielding each page as soon as it has been fetched.
+        """
+        client = self._client or self._new_client()
+        queue: asyncio.Queue = asyncio.Queue()
+        results: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        for url in self.start_urls:
+            self._enqueue(queue, url, 0)
+
+        async def finish():
+            await queue.join()
+            await results.put(None)
+
+        tasks = [asyncio.create_task(self._worker(client, queue, results)) for _ in range(self.concurrency)]
+        tasks.append(asyncio.create_task(finish()))
+        try:
+            while (result := await results.get()) is not None:
+                yield result
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if self._client is None:
+                await client.aclose()
@@ -0,0 +1,143 @@
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import List, Optional
+from langchain_core.embeddings import Embeddings
+from langchain_nomic.embeddings import NomicEmbeddings
+import asyncio
+import queue
+import threading
+import time
+
+
+class BatchingEmbeddings(Embeddings):
+    """
+    Embedding front-end that micro-batches concurrent query embeddings.
+
+    Queries from all threads (and event loops) are queued for one background thread,
+    which embeds up to `max_batch_size` of them in a single forward pass, waiting at most
+    `max_wait` seconds for a batch to fill. The last `cache_size` query vectors are kept
+    in an LRU cache, so repeated questions never reach the model. Document embeddings
+    are sent to the model in batches of `document_batch_size`.
+
+    Args:
+        embeddings (Embeddings): The model doing the actual work, e.g. NomicEmbeddings.
+        max_batch_size (int): Most queries embedded in one call.
+        max_wait (float): Seconds the first query of a batch waits for others to join.
+        cache_size (int): Number of query vectors kept in the LRU cache.
+        document_batch_size (int): Documents embedded per call during ingestion.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        max_batch_size: int = 32,
+        max_wait: float = 0.005,
+        cache_size: int = 4096,
+        document_batch_size: int = 64,
+    ):
+        self.embeddings = embeddings
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.cache_size = cache_size
+        self.document_batch_size = document_batch_size
+        self._cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._worker.start()
+
+    def _embed_queries(self, texts: List[str]) -> List[List[float]]:
+        # Nomic needs the search_query task type for queries, which embed_documents would not set.
+        if isinstance(self.embeddings, NomicEmbeddings):
+            return self.embeddings.embed(texts, task_type="search_query")
+        return [self.embeddings.embed_query(text) for text in texts]
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self._run_batch()
+            except Exception as e:
+                # One bad batch must not stop the thread every query waits on.
+                print(f"Embedding batch failed: {e!r}")
+
+    def _run_batch(self) -> None:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        # Drop queries whose caller was cancelled (e.g. through `aembed_query`); the others
+        # can no longer be cancelled, so setting their result below cannot fail.
+        batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        # Identical questions in the same batch are embedded once.
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            vectors = dict(zip(texts, self._embed_queries(texts)))
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for text, future in batch:
+            self._remember(text, vectors[text])
+            future.set_result(vectors[text])
+
+    def _cached(self, text: str) -> Optional[List[float]]:
+        with self._cache_lock:
+            vector = self._cache.get(text)
+            if vector is not None:
+                self._cache.move_to_end(text)
+            return vector
+
+    def _remember(self, text: str, vector: List[float]) -> None:
+        with self._cache_lock:
+            self._cache[text] = vector
+            self._cache.move_to_end(text)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def submit_query(self, text: str) -> Future:
+        future: Future = Future()
+        vector = self._cached(text)
+        if vector is not None:
+            self.hits += 1
+            future.set_result(vector)
+        else:
+            self.misses += 1
+            self._queue.put((text, future))
+        return future
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.submit_query(text).result()
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await asyncio.wrap_future(self.submit_query(text))
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed many queries at once; they are queued together, so they fill whole batches.
+        """
+        futures = [self.submit_query(text) for text in texts]
+        return [future.result() for future in futures]
+
+    async def aembed_queries(self, texts: List[str]) -> List[List[float]]:
+        return list(await asyncio.gather(*(asyncio.wrap_future(self.submit_query(text)) for text in texts)))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors: List[List[float]] = []
+        for start in range(0, len(texts), self.document_batch_size):
+            vectors.extend(self.embeddings.embed_documents(texts[start:start + self.document_batch_size]))
+        return vectors
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.to_thread(self.embed_documents, texts)
@@ -1,27 +1,50 @@
 from langgraph.graph import END, StateGraph, START
-from langgraph.checkpoint.memory import MemorySaver
-from pprint import pprint
+from checkpointer import BoundedSqliteSaver
+from langgraph.utils.runnable import RunnableCallable
+from ingestion import db_dir
 from state_functions import *
+import os
 
 
+def node(func, afunc, name=None):
+    """
+    Wrap a node/edge function together with its async version, so the graph runs
+    natively under both `agent.invoke`/`stream` and `agent.ainvoke`/`astream`.
+    Like a plain function node, the wrapper itself is not traced.
+    """
+    return RunnableCallable(func, afunc, name=name or func.__name__, trace=False)
+
 
 workflow = StateGraph(GraphState)
 
-workflow.add_node("websearch", web_search)
-workflow.add_node("retrieve", retrieve)
-workflow.add_node("grade_documents", grade_documents)
-workflow.add_node("generate", generate)
-workflow.add_node("generate_direct", generate_direct)
+workflow.add_node("websearch", node(web_search, aweb_search, "websearch"))
+workflow.add_node("retrieve", node(retrieve, aretrieve))
+workflow.add_node("grade_documents", node(grade_documents, agrade_documents))
+workflow.add_node("generate", node(generate, agenerate))
+workflow.add_node("generate_direct", node(generate_direct, agenerate_direct))
 
 # workflow.add_edge(START,"retrieve")
-workflow.add_conditional_edges(
-    START,
-    route_question,
-    {
-        "direct_answer": "generate_direct",
-        "vectorstore": "retrieve",
-    },
-)
+if speculative_retrieval:
+    # Retrieval starts together with the routing call; "route" hands its documents straight to grading.
+    workflow.add_node("route", node(route_and_retrieve, aroute_and_retrieve))
+    workflow.add_edge(START, "route")
+    workflow.add_conditional_edges(
+        "route",
+        decide_datasource,
+        {
+            "direct_answer": "generate_direct",
+            "vectorstore": "grade_documents",
+        },
+    )
+else:
+    workflow.add_conditional_edges(
+        START,
+        node(route_question, aroute_question),
+        {
+            "direct_answer": "generate_direct",
+            "vectorstore": "retrieve",
+        },
+    )
 workflow.add_edge("retrieve", "grade_documents")
 workflow.add_conditional_edges(
     "grade_documents",
@@ -35,7 +58,7 @@ workflow.add_edge("websearch", "generate")
 workflow.add_edge("generate", END)
 workflow.add_conditional_edges(
     "generate",
-    hallucination_check,
+    node(hallucination_check, ahallucination_check),
     {
         "not supported": "generate",
         "useful": END,
@@ -44,6 +67,33 @@ workflow.add_conditional_edges(
 )
 workflow.add_edge("generate_direct", END)
 
-inmemory = MemorySaver()
+agent = workflow.compile()
+
+# One-off questions (batch runs) keep no conversation state.
+batch_agent = workflow.compile()
+
+# Attached to `agent` by `init_checkpointer()` at startup, so importing this module opens nothing.
+checkpointer = None
+
+
+def init_checkpointer() -> BoundedSqliteSaver:
+    """
+    Open the conversation checkpointer, start its compaction and attach it to `agent`.
+
+    Conversation state lives on disk (bounded per thread, idle threads expire) instead of
+    growing in memory. Only the first call does the work.
 
-agent = workflow.compile(checkpointer=inmemory)
+    Returns:
+        BoundedSqliteSaver: The checkpointer.
+    """
+    global checkpointer
+    if checkpointer is None:
+        checkpointer = BoundedSqliteSaver(
+            os.path.join(db_dir, "checkpoints.sqlite"),
+            max_checkpoints_per_thread=20,
+            thread_ttl=7 * 24 * 3600,
+            max_db_bytes=512 * 1024 * 1024,
+        )
+        checkpointer.start_compaction(interval=300)
+        agent.checkpointer = checkpointer
+    return checkpointer
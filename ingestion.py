@@ -0,0 +1,323 @@
+from langchain_community.document_loaders import WebBaseLoader
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain.schema import Document
+from dotenv import load_dotenv, find_dotenv
+from typing import Deque, Dict, Iterable, List, Optional
+from collections import deque
+from chunking import ChunkingPipeline, chunk_id, content_hash
+from bm25 import BM25Index
+from crawler import Crawler
+import asyncio
+import json
+import os
+import uuid
+
+
+load_dotenv(find_dotenv())
+
+
+db_dir = os.path.join(os.getcwd(), "db")
+persistent_directory = os.path.join(db_dir, "chroma_db_with_metadata2")
+manifest_path = os.path.join(db_dir, "ingest_manifest.json")
+store_version_path = os.path.join(db_dir, "store_version")
+bm25_path = os.path.join(db_dir, "bm25_index.json")
+
+urls = ["https://www.salaryse.com/"]
+
+
+class Manifest:
+    """
+    Persisted record of what is currently in the vector store.
+
+    `pages` maps every ingested url to the hash of its page content and the ids
+    of the chunks it produced, so a rerun can tell which pages changed and which
+    chunks have to be embedded or deleted.
+    """
+
+    def __init__(self, path: str = manifest_path):
+        self.path = path
+        self.pages: Dict[str, dict] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.pages = json.load(f).get("pages", {})
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"pages": self.pages}, f)
+        os.replace(tmp_path, self.path)
+
+
+def store_version() -> str:
+    """
+    Return the current vector store version, which changes whenever an ingestion run modifies the store.
+
+    Caches derived from the store (e.g. the answer cache) compare it to know when to invalidate.
+    """
+    try:
+        with open(store_version_path, "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return ""
+
+
+def bump_store_version() -> str:
+    version = uuid.uuid4().hex
+    os.makedirs(db_dir, exist_ok=True)
+    tmp_path = f"{store_version_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp_path, store_version_path)
+    return version
+
+
+def default_text_splitter() -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter.from_tiktoken_encoder(chunk_size=1000, chunk_overlap=100)
+
+
+def load_pages(urls: Iterable[str]) -> Iterable[Document]:
+    """
+    Fetch every url with WebBaseLoader, yielding one Document per page.
+    """
+    for url in urls:
+        for doc in WebBaseLoader(url).load():
+            doc.metadata.setdefault("source", url)
+            yield doc
+
+
+class Ingestor:
+    """
+    Applies pages to the vector store one at a time, doing work only for what changed.
+
+    Pages whose content hash matches the manifest are skipped without splitting or
+    embedding. Changed pages are re-split; only chunks with new ids are embedded
+    and upserted, and chunks that no longer exist are deleted. `finish` prunes pages
+    that were in the manifest but not seen in this run and saves the manifest.
+
+    The BM25 index is updated alongside the vector store and saved by `finish`.
+
+    Args:
+        db (Chroma): The vector store to update.
+        text_splitter: Splitter used for changed pages.
+        manifest (Manifest): Manifest to diff against; loaded from disk if omitted.
+        write_batch_size (int): Chunks buffered before they are embedded and written.
+        index_path (str): Where the BM25 index is persisted.
+    """
+
+    def __init__(self, db, text_splitter=None, manifest: Manifest = None, write_batch_size: int = 256, index_path: str = bm25_path):
+        self.db = db
+        self.text_splitter = text_splitter or default_text_splitter()
+        self.manifest = manifest or Manifest()
+        self.write_batch_size = write_batch_size
+        self.index_path = index_path
+        self.bm25 = BM25Index.load(index_path)
+        self.seen = set()
+        self._pending_ids: List[str] = []
+        self._pending_chunks: List[Document] = []
+        self.stats = {"pages_unchanged": 0, "pages_updated": 0, "pages_removed": 0, "chunks_added": 0, "chunks_deleted": 0}
+
+        if not self.manifest.exists():
+            # A store built before the manifest existed has random chunk ids we cannot diff against.
+            stale_ids = db.get(include=[])["ids"]
+            if stale_ids:
+                db.delete(ids=stale_ids)
+                self.stats["chunks_deleted"] += len(stale_ids)
+            self.bm25.clear()
+        elif not os.path.exists(index_path):
+            # Store ingested before the BM25 index existed: backfill it from Chroma.
+            existing = db.get(include=["documents", "metadatas"])
+            for i, text, metadata in zip(existing["ids"], existing["documents"], existing["metadatas"]):
+                self.bm25.add(i, text, metadata)
+
+    def mark_unchanged(self, source: str, **page_info) -> None:
+        """
+        Record that `source` is still live without having its content, e.g. after a 304.
+        """
+        self.seen.add(source)
+        if source in self.manifest.pages:
+            self.manifest.pages[source].update(page_info)
+            self.stats["pages_unchanged"] += 1
+
+    def keep(self, sources: Iterable[str]) -> None:
+        """
+        Keep `sources` as they are, e.g. pages that could not be fetched in this run.
+        """
+        self.seen.update(sources)
+
+    def add_page(self, page: Document, chunks: Optional[List[Document]] = None, page_hash: Optional[str] = None, **page_info) -> None:
+        """
+        Sync one page into the store.
+
+        `chunks` and `page_hash` can be passed when the page was already split elsewhere
+        (e.g. by the `ChunkingPipeline`); otherwise the page is split here if it changed.
+        Extra keyword arguments (validators, links) are kept in its manifest entry.
+        """
+        source = page.metadata.get("source", "")
+        self.seen.add(source)
+        page_hash = page_hash or content_hash(page.page_content)
+        entry = self.manifest.pages.get(source)
+        if entry and entry["hash"] == page_hash:
+            entry.update(page_info)
+            self.stats["pages_unchanged"] += 1
+            return
+
+        if chunks is None:
+            chunks = self.text_splitter.split_documents([page])
+        old_ids = set(entry["chunks"]) if entry else set()
+        new_chunks: Dict[str, Document] = {}
+        for chunk in chunks:
+            new_chunks.setdefault(chunk_id(source, chunk.page_content), chunk)
+
+        added = [i for i in new_chunks if i not in old_ids]
+        removed = [i for i in old_ids if i not in new_chunks]
+        if added:
+            self._pending_ids.extend(added)
+            self._pending_chunks.extend(new_chunks[i] for i in added)
+            if len(self._pending_ids) >= self.write_batch_size:
+                self.flush()
+        if removed:
+            self.db.delete(ids=removed)
+            for i in removed:
+                self.bm25.remove(i)
+
+        self.manifest.pages[source] = {"hash": page_hash, "chunks": list(new_chunks), **page_info}
+        self.stats["pages_updated"] += 1
+        self.stats["chunks_added"] += len(added)
+        self.stats["chunks_deleted"] += len(removed)
+
+    def flush(self) -> None:
+        """
+        Embed and upsert the buffered chunks of all pages added since the last flush in one go.
+        """
+        if self._pending_ids:
+            self.db.add_documents(self._pending_chunks, ids=self._pending_ids)
+            for i, chunk in zip(self._pending_ids, self._pending_chunks):
+                self.bm25.add(i, chunk.page_content, chunk.metadata)
+            self._pending_ids, self._pending_chunks = [], []
+
+    def finish(self, prune: bool = True) -> dict:
+        self.flush()
+        if prune:
+            for source in [s for s in self.manifest.pages if s not in self.seen]:
+                removed = self.manifest.pages.pop(source)["chunks"]
+                if removed:
+                    self.db.delete(ids=removed)
+                    for i in removed:
+                        self.bm25.remove(i)
+                self.stats["pages_removed"] += 1
+                self.stats["chunks_deleted"] += len(removed)
+
+        self.manifest.save()
+        self.bm25.save(self.index_path)
+        if self.stats["chunks_added"] or self.stats["chunks_deleted"]:
+            bump_store_version()
+        return self.stats
+
+
+def sync_pages(pages: Iterable[Document], db, text_splitter=None, manifest: Manifest = None, prune: bool = True) -> dict:
+    """
+    Bring the vector store in line with `pages`.
+
+    Args:
+        pages (Iterable[Document]): Page documents with a `source` url in their metadata.
+        db (Chroma): The vector store to update.
+        text_splitter: Splitter used for changed pages.
+        manifest (Manifest): Manifest to diff against; loaded from disk if omitted.
+        prune (bool): Delete chunks of pages that were not part of this run.
+
+    Returns:
+        dict: Counts of pages and chunks that were unchanged, updated, added and deleted.
+    """
+    ingestor = Ingestor(db, text_splitter=text_splitter, manifest=manifest)
+    for page in pages:
+        ingestor.add_page(page)
+    return ingestor.finish(prune=prune)
+
+
+def ingest(urls: Iterable[str], db, text_splitter=None, manifest: Manifest = None) -> dict:
+    """
+    Fetch `urls` and incrementally sync them into `db`.
+    """
+    return sync_pages(load_pages(urls), db, text_splitter=text_splitter, manifest=manifest)
+
+
+async def crawl_and_ingest(
+    start_urls: Iterable[str], db, manifest: Manifest = None, workers: Optional[int] = None, index_path: str = bm25_path, **crawler_kwargs
+) -> dict:
+    """
+    Crawl whole sites and stream every fetched page straight into the splitter and Chroma.
+
+    Validators and links from the manifest are handed to the crawler, so pages that
+    answer 304 are neither downloaded nor re-split. HTML cleanup and chunking run in a
+    `ChunkingPipeline` process pool and store writes in a worker thread, both while the
+    crawl keeps fetching. Pages are written in the order they were fetched.
+
+    Args:
+        start_urls (Iterable[str]): Urls to start crawling from.
+        db (Chroma): The vector store to update.
+        manifest (Manifest): Manifest to diff against; loaded from disk if omitted.
+        workers (int): Chunking processes, defaults to the cpu count.
+        index_path (str): Where the BM25 index is persisted.
+        **crawler_kwargs: Passed on to `Crawler` (depth, page and size limits, concurrency, client).
+
+    Returns:
+        dict: Counts of pages and chunks that were unchanged, updated, added and deleted,
+        plus the chunking throughput.
+    """
+    ingestor = Ingestor(db, manifest=manifest, index_path=index_path)
+    crawler = Crawler(start_urls, known=ingestor.manifest.pages, **crawler_kwargs)
+    pending: Deque[tuple] = deque()
+
+    async def write_oldest():
+        task, page_info = pending.popleft()
+        result = await task
+        await asyncio.to_thread(
+            ingestor.add_page, result.page, chunks=result.chunks, page_hash=result.page_hash, **page_info
+        )
+
+    with ChunkingPipeline(workers=workers) as pipeline:
+        async for result in crawler.crawl():
+            aliases = set(ingestor.manifest.pages.get(result.url, {}).get("redirected_from", []))
+            if result.requested_url and result.requested_url != result.url:
+                aliases.add(result.requested_url)
+            page_info = {"etag": result.etag, "last_modified": result.last_modified, "links": result.links, "redirected_from": sorted(aliases)}
+            if result.not_modified:
+                ingestor.mark_unchanged(result.url, **page_info)
+                continue
+            known_hash = ingestor.manifest.pages.get(result.url, {}).get("hash")
+            task = asyncio.ensure_future(pipeline.achunk(result.url, result.html, known_hash=known_hash))
+            pending.append((task, page_info))
+            if len(pending) >= pipeline.window:
+                await write_oldest()
+        while pending:
+            await write_oldest()
+        chunking_stats = pipeline.stats.as_dict()
+
+    # Only pages answering 404/410, or no longer linked from a complete crawl, are removed.
+    ingestor.keep(crawler.failed | crawler.skipped)
+    if not crawler.complete:
+        print(f"Incomplete crawl ({len(crawler.failed)} failed, truncated: {crawler.truncated}); keeping pages not visited")
+        ingestor.keep(source for source in ingestor.manifest.pages if source not in crawler.gone)
+    stats = ingestor.finish()
+    print(f"Chunking: {chunking_stats['docs_per_s']} docs/s, {chunking_stats['tokens_per_s']} tokens/s")
+    return {**stats, "chunking": chunking_stats}
+
+
+if __name__ == "__main__":
+    from langchain_chroma import Chroma
+    from langchain_nomic.embeddings import NomicEmbeddings
+    from embedding_service import BatchingEmbeddings
+
+    embeddings = BatchingEmbeddings(NomicEmbeddings(model="nomic-embed-text-v1.5", inference_mode="local"))
+    db = Chroma(persist_directory=persistent_directory, embedding_function=embeddings)
+    version = store_version()
+    print(asyncio.run(crawl_and_ingest(urls, db)))
+
+    # Keep the memory-mapped export in step with the store when the API serves from it.
+    if os.environ.get("RETRIEVAL_ENGINE", "chroma").lower() == "mmap" and store_version() != version:
+        from mmap_index import export_index
+        export_index(db, dtype=os.environ.get("MMAP_INDEX_DTYPE", "float16"), nlist=int(os.environ.get("MMAP_INDEX_NLIST", "0")))
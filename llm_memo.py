@@ -0,0 +1,74 @@
+from langchain_core.prompts import PromptTemplate
+from langchain_core.output_parsers import JsonOutputParser
+from disk_cache import DiskCache
+from typing import Iterable
+import asyncio
+import hashlib
+import json
+
+
+def model_name(llm) -> str:
+    llm = getattr(llm, "bound", llm)  # unwrap `with_retry` / `with_config` bindings
+    return getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__
+
+
+class MemoizedClassifier:
+    """
+    A `prompt | llm | JsonOutputParser()` chain whose results are memoized on disk.
+
+    The router and graders are treated as pure functions of their inputs, so a decision is
+    keyed by the model, the prompt template and a hash of the inputs. A repeated decision is
+    a local SQLite lookup instead of an LLM round-trip.
+
+    Only well-formed decisions are stored: a dict whose `output_key` holds one of `allowed`
+    (case-insensitive). Anything else is returned as is and asked again next time.
+
+    Args:
+        prompt (PromptTemplate): Prompt of the classifier.
+        llm: Chat model answering with JSON.
+        cache (DiskCache): Where decisions are stored; its `ttl` bounds their age.
+        output_key (str): Key of the decision in the JSON answer.
+        allowed (Iterable[str]): Values the decision may take.
+    """
+
+    def __init__(self, prompt: PromptTemplate, llm, cache: DiskCache, output_key: str = "score", allowed: Iterable[str] = ("yes", "no")):
+        self.prompt = prompt
+        self.llm = llm
+        self.cache = cache
+        self.output_key = output_key
+        self.allowed = {value.lower() for value in allowed}
+        self.chain = prompt | llm | JsonOutputParser()
+        self._prefix = f"{model_name(llm)}\0{prompt.template}\0"
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, inputs: dict) -> str:
+        return hashlib.sha256((self._prefix + json.dumps(inputs, sort_keys=True, default=str)).encode("utf-8")).hexdigest()
+
+    def valid(self, result) -> bool:
+        return isinstance(result, dict) and str(result.get(self.output_key, "")).lower() in self.allowed
+
+    def invoke(self, inputs: dict, config=None) -> dict:
+        key = self.key(inputs)
+        result = self.cache.get(key)
+        if result is None:
+            self.misses += 1
+            result = self.chain.invoke(inputs, config)
+            if self.valid(result):
+                self.cache.set(key, result)
+        else:
+            self.hits += 1
+        return result
+
+    async def ainvoke(self, inputs: dict, config=None) -> dict:
+        key = self.key(inputs)
+        # SQLite calls block; keep them off the event loop.
+        result = await asyncio.to_thread(self.cache.get, key)
+        if result is None:
+            self.misses += 1
+            result = await self.chain.ainvoke(inputs, config)
+            if self.valid(result):
+                await asyncio.to_thread(self.cache.set, key, result)
+        else:
+            self.hits += 1
+        return result
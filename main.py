@@ -1,9 +1,15 @@
 import requests
 import pyttsx3
 import gradio as gr
+from concurrent.futures import Future
+from requests.adapters import HTTPAdapter
 from pyngrok import ngrok
 from dotenv import load_dotenv, find_dotenv
+import hashlib
+import json
 import os
+import queue
+import threading
 
 load_dotenv(find_dotenv())
 ngrok_auth_token = os.environ.get("ngrok_auth_token")
@@ -11,51 +17,207 @@ ngrok.set_auth_token(ngrok_auth_token)
 public_url = ngrok.connect(7860)
 print(f"Public URL: {public_url}")
 
+backend_url = os.environ.get("BACKEND_URL", "http://localhost:8000")
+
+# One keep-alive connection pool to the backend for every click, instead of a new connection each time.
+session = requests.Session()
+session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=16))
+session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=16))
+
+# (connect, read) seconds; the read timeout applies between streamed events, not to the whole answer.
+request_timeout = (3.05, 60)
+
+
+def sse_events(response):
+    """
+    Parse a Server-Sent Events response into (event, data) pairs.
+    """
+    event, data = None, []
+    for line in response.iter_lines(decode_unicode=True):
+        if line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+        elif not line and event is not None:
+            yield event, json.loads("\n".join(data))
+            event, data = None, []
+
+
 def get_response(question):
-    url = "http://localhost:8000/ask"
+    """
+    Stream the answer from `/ask/stream`, yielding the text shown so far after every token.
+
+    When the graph starts a new generation (the previous one was rejected by the grader),
+    the partial text starts over; the final answer comes with the `done` event.
+    """
     payload = {"question": question, "thread_id": "1"}
-    response = requests.post(url, json=payload)
-    if response.status_code == 201:
-        return response.json()
-    else:
-        return "Error: Unable to reach the backend."
+    try:
+        with session.post(f"{backend_url}/ask/stream", json=payload, stream=True, timeout=request_timeout) as response:
+            if response.status_code == 503:
+                yield f"The assistant is busy, please try again in {response.headers.get('Retry-After', 'a few')} seconds."
+                return
+            response.raise_for_status()
+            text = ""
+            for event, data in sse_events(response):
+                if event == "node" and data["status"] == "start" and data["node"] in ("generate", "generate_direct"):
+                    text = ""
+                elif event == "token":
+                    text += data["text"]
+                    yield text
+                elif event == "done":
+                    yield data["generation"]
+                elif event == "error":
+                    yield f"The assistant is busy, please try again in {data['retry_after']} seconds."
+    except requests.RequestException as e:
+        print(f"Backend request failed: {e!r}")
+        yield "Error: Unable to reach the backend."
 
 
 def chatbot_interface(question):
-    return get_response(question)
+    yield from get_response(question)
+
+
+class AudioCache:
+    """
+    Directory of synthesized audio files named by the hash of their text and voice.
+
+    A file's modification time is its last use; beyond `max_entries` files or `max_bytes`
+    the least recently used ones are deleted.
+
+    Args:
+        directory (str): Where the audio files are kept.
+        max_entries (int): Most files kept.
+        max_bytes (int): Most bytes kept.
+    """
+
+    def __init__(self, directory: str, max_entries: int = 500, max_bytes: int = 200 * 1024 * 1024):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+    def path(self, text: str, voice: str) -> str:
+        key = hashlib.sha256(f"{voice}\n{text}".encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{key}.wav")
+
+    def get(self, text: str, voice: str):
+        path = self.path(text, voice)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def evict(self) -> None:
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".wav"):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        while entries and (len(entries) > self.max_entries or total > self.max_bytes):
+            _, size, name = entries.pop(0)
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+
+
+class SpeechSynthesizer:
+    """
+    Text-to-speech with one pyttsx3 engine, owned by a worker thread.
+
+    pyttsx3 engines are not thread-safe and slow to create, so every request is queued for
+    the same engine. Audio is written to the `AudioCache`; a text already synthesized is
+    served from it without touching the engine.
+
+    Args:
+        cache (AudioCache): Where the audio files go.
+    """
+
+    def __init__(self, cache: AudioCache):
+        self.cache = cache
+        self.voice = ""
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._ready = threading.Event()
+        self._error = None
+        self._worker = threading.Thread(target=self._run, name="tts", daemon=True)
+        self._worker.start()
+
+    def _run(self) -> None:
+        try:
+            engine = pyttsx3.init()
+            voices = engine.getProperty('voices')
+            if len(voices) > 1:
+                engine.setProperty('voice', voices[1].id)
+            self.voice = engine.getProperty('voice') or ""
+        except Exception as e:
+            self._error = e
+            return
+        finally:
+            self._ready.set()
+        while True:
+            text, future = self._queue.get()
+            try:
+                # The same text may have been queued twice before the first one finished.
+                path = self.cache.get(text, self.voice)
+                if path is None:
+                    path = self.cache.path(text, self.voice)
+                    tmp_path = f"{path}.tmp.wav"
+                    engine.save_to_file(text, tmp_path)
+                    engine.runAndWait()
+                    os.replace(tmp_path, path)
+                    self.cache.evict()
+                future.set_result(path)
+            except Exception as e:
+                future.set_exception(e)
+
+    def synthesize(self, text: str) -> str:
+        """
+        Path of an audio file speaking `text`.
+        """
+        self._ready.wait()
+        if self._error is not None:
+            raise RuntimeError(f"Text-to-speech is unavailable: {self._error!r}")
+        path = self.cache.get(text, self.voice)
+        if path is not None:
+            return path
+        future: Future = Future()
+        self._queue.put((text, future))
+        return future.result()
+
+
+synthesizer = SpeechSynthesizer(AudioCache(os.path.join("db", "tts_cache")))
 
 
 def play_response_tts(ai_response):
-    engine = pyttsx3.init()
-    voices = engine.getProperty('voices')
-    engine.setProperty('voice', voices[1].id)  
-    engine.say(ai_response)
-    engine.runAndWait()
+    if not ai_response or not ai_response.strip():
+        return None
+    return synthesizer.synthesize(ai_response)
 
 
 def chatbot_and_tts(question):
-    response = chatbot_interface(question)
-    return response  
+    yield from chatbot_interface(question)
 
 chatbot = gr.Chatbot()
 with gr.Blocks() as iface:
     gr.Markdown("## SalarySe AI Chatbot")
     gr.Markdown("Ask questions about SalarySe and click the button to hear the response.")
-    
-    
+
+
     with gr.Row():
         with gr.Column():
             input_box = gr.Textbox(label="Your Question", placeholder="Tell me about SalarySe", elem_id="input-box")
             input_btn = gr.Button("Submit")
-        
+
         with gr.Column():
             output_box = gr.Textbox(label="Chatbot Response", elem_id="output-box")
             listen_btn = gr.Button("Listen")
-    
-    
+            audio_out = gr.Audio(type="filepath", autoplay=True, interactive=False, label="Response Audio")
+
+
     input_btn.click(chatbot_and_tts, inputs=input_box, outputs=output_box)
-    listen_btn.click(play_response_tts, inputs=output_box, outputs=[])
+    listen_btn.click(play_response_tts, inputs=output_box, outputs=audio_out)
 
 
+iface.queue(default_concurrency_limit=16)
 iface.launch(server_port=7860)
-
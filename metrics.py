@@ -0,0 +1,240 @@
+from typing import Any, Callable, Dict, Optional, Tuple
+from uuid import UUID
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily
+import functools
+import inspect
+import time
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+node_duration = Histogram("agent_node_duration_seconds", "Time spent in a graph node.", ["node"], buckets=LATENCY_BUCKETS)
+node_errors = Counter("agent_node_errors_total", "Graph node runs that raised.", ["node", "error"])
+llm_duration = Histogram("agent_llm_duration_seconds", "Duration of a single LLM call.", ["node", "model"], buckets=LATENCY_BUCKETS)
+llm_calls = Counter("agent_llm_calls_total", "LLM calls made.", ["node", "model"])
+llm_errors = Counter("agent_llm_errors_total", "LLM calls that failed.", ["node", "model"])
+llm_tokens = Counter("agent_llm_tokens_total", "Tokens used by LLM calls.", ["node", "model", "kind"])
+retrieval_duration = Histogram("agent_retrieval_duration_seconds", "Duration of a retriever call.", ["node", "retriever"], buckets=LATENCY_BUCKETS)
+decisions = Counter("agent_decisions_total", "Routing and grading decisions.", ["decision_point", "decision"])
+request_duration = Histogram("agent_request_duration_seconds", "End-to-end latency of a question.", ["endpoint", "outcome"], buckets=LATENCY_BUCKETS)
+model_fallbacks = Counter("agent_model_fallbacks_total", "Model backend calls that failed over to the next backend.", ["model", "reason"])
+requests_rejected = Counter("agent_requests_rejected_total", "Requests answered with 503.", ["reason"])
+
+
+def count_decision(decision_point: str, decision: str) -> None:
+    """
+    Count the outcome of a routing/grading decision; error messages are counted as "error".
+    """
+    decisions.labels(decision_point, "error" if decision.startswith("error") else decision).inc()
+
+
+def counts_decisions(decision_point: str):
+    """
+    Decorator counting the decisions returned by a (sync or async) routing/grading function.
+    """
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                decision = await func(*args, **kwargs)
+                count_decision(decision_point, decision)
+                return decision
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            decision = func(*args, **kwargs)
+            count_decision(decision_point, decision)
+            return decision
+        return wrapper
+    return decorator
+
+
+def token_usage(response: LLMResult) -> Tuple[int, int]:
+    """
+    Prompt and completion tokens of an LLM response, from the provider's usage data.
+    """
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if usage.get("total_tokens"):
+        return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+    prompt = completion = 0
+    for generations in response.generations:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+            prompt += metadata.get("input_tokens", 0)
+            completion += metadata.get("output_tokens", 0)
+    return prompt, completion
+
+
+class AgentTelemetry(BaseCallbackHandler):
+    """
+    Callback handler recording graph node, LLM and retriever timings as Prometheus metrics.
+
+    Node runs are the chain runs named like the `langgraph_node` in their metadata; LLM
+    calls and retrievals are labelled with the node they ran in. With a `tracer`, every
+    node, LLM call and retrieval also becomes an OpenTelemetry span, nested under the
+    span of the enclosing node (or the current span, e.g. the FastAPI request).
+
+    One instance is shared by all requests.
+
+    Args:
+        tracer: OpenTelemetry tracer, or None for metrics only.
+    """
+
+    run_inline = True
+
+    def __init__(self, tracer=None):
+        self.tracer = tracer
+        # run_id -> (kind, labels, started, span)
+        self._runs: Dict[UUID, Tuple[str, dict, float, Any]] = {}
+        # run_id -> parent run_id of the untimed chain runs, to find the parent span of nested runs.
+        self._parents: Dict[UUID, Optional[UUID]] = {}
+
+    def _parent_span(self, parent_run_id: Optional[UUID]):
+        while parent_run_id is not None:
+            run = self._runs.get(parent_run_id)
+            if run is not None:
+                return run[3]
+            parent_run_id = self._parents.get(parent_run_id)
+        return None
+
+    def _start(self, run_id: UUID, parent_run_id: Optional[UUID], kind: str, labels: dict) -> None:
+        span = None
+        if self.tracer is not None:
+            from opentelemetry import trace
+
+            parent = self._parent_span(parent_run_id)
+            context = trace.set_span_in_context(parent) if parent is not None else None
+            name = labels.get("model") or labels.get("retriever") or labels["node"]
+            span = self.tracer.start_span(f"{kind} {name}", context=context, attributes={f"agent.{k}": v for k, v in labels.items()})
+        self._runs[run_id] = (kind, labels, time.perf_counter(), span)
+
+    def _end(self, run_id: UUID, error: Optional[BaseException] = None, attributes: Optional[dict] = None):
+        run = self._runs.pop(run_id, None)
+        self._parents.pop(run_id, None)
+        if run is None:
+            return None
+        kind, labels, started, span = run
+        elapsed = time.perf_counter() - started
+        if kind == "node":
+            node_duration.labels(labels["node"]).observe(elapsed)
+            if error is not None:
+                node_errors.labels(labels["node"], type(error).__name__).inc()
+        elif kind == "llm":
+            llm_duration.labels(labels["node"], labels["model"]).observe(elapsed)
+            llm_calls.labels(labels["node"], labels["model"]).inc()
+            if error is not None:
+                llm_errors.labels(labels["node"], labels["model"]).inc()
+        elif kind == "retriever":
+            retrieval_duration.labels(labels["node"], labels["retriever"]).observe(elapsed)
+        if span is not None:
+            if attributes:
+                span.set_attributes(attributes)
+            if error is not None:
+                from opentelemetry.trace import Status, StatusCode
+
+                span.record_exception(error)
+                span.set_status(Status(StatusCode.ERROR, type(error).__name__))
+            span.end()
+        return labels
+
+    def on_chain_start(self, serialized, inputs, *, run_id: UUID, parent_run_id: Optional[UUID] = None, metadata: Optional[dict] = None, **kwargs: Any) -> None:
+        node = (metadata or {}).get("langgraph_node")
+        if node is not None and kwargs.get("name") == node:
+            self._start(run_id, parent_run_id, "node", {"node": node})
+        elif self.tracer is not None:
+            self._parents[run_id] = parent_run_id
+
+    def on_chain_end(self, outputs, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, error)
+
+    def _start_llm(self, run_id: UUID, parent_run_id: Optional[UUID], metadata: Optional[dict]) -> None:
+        metadata = metadata or {}
+        labels = {"node": metadata.get("langgraph_node", "none"), "model": metadata.get("ls_model_name", "unknown")}
+        self._start(run_id, parent_run_id, "llm", labels)
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, parent_run_id: Optional[UUID] = None, metadata: Optional[dict] = None, **kwargs: Any) -> None:
+        self._start_llm(run_id, parent_run_id, metadata)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, parent_run_id: Optional[UUID] = None, metadata: Optional[dict] = None, **kwargs: Any) -> None:
+        self._start_llm(run_id, parent_run_id, metadata)
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        prompt, completion = token_usage(response)
+        labels = self._end(run_id, attributes={"agent.prompt_tokens": prompt, "agent.completion_tokens": completion})
+        if labels is not None:
+            llm_tokens.labels(labels["node"], labels["model"], "prompt").inc(prompt)
+            llm_tokens.labels(labels["node"], labels["model"], "completion").inc(completion)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, error)
+
+    def on_retriever_start(self, serialized, query, *, run_id: UUID, parent_run_id: Optional[UUID] = None, metadata: Optional[dict] = None, **kwargs: Any) -> None:
+        labels = {"node": (metadata or {}).get("langgraph_node", "none"), "retriever": kwargs.get("name") or "retriever"}
+        self._start(run_id, parent_run_id, "retriever", labels)
+
+    def on_retriever_end(self, documents, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, attributes={"agent.documents": len(documents)})
+
+    def on_retriever_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, error)
+
+
+class CacheCollector:
+    """
+    Prometheus collector exposing the `hits`/`misses` counters of the caches as `agent_cache_lookups_total`.
+
+    Args:
+        caches_fn (Callable): Returns the caches by name; called on every scrape, so caches
+            that are rebuilt at runtime are picked up.
+    """
+
+    def __init__(self, caches_fn: Callable[[], Dict[str, Any]]):
+        self.caches_fn = caches_fn
+
+    def collect(self):
+        family = CounterMetricFamily("agent_cache_lookups", "Cache lookups by cache and result.", labels=["cache", "result"])
+        for name, cache in self.caches_fn().items():
+            if cache is None:  # not created yet
+                continue
+            family.add_metric([name, "hit"], cache.hits)
+            family.add_metric([name, "miss"], cache.misses)
+        yield family
+
+
+def register_caches(caches_fn: Callable[[], Dict[str, Any]]) -> None:
+    REGISTRY.register(CacheCollector(caches_fn))
+
+
+def register_admission(controller) -> None:
+    Gauge("agent_requests_in_flight", "Requests running in the agent.").set_function(lambda: controller.in_flight)
+    Gauge("agent_requests_queued", "Requests waiting for an admission slot.").set_function(lambda: controller.waiting)
+
+
+def setup_tracing(app=None, service_name: str = "ai-webscraper"):
+    """
+    Export OpenTelemetry spans over OTLP (configured by the standard `OTEL_EXPORTER_OTLP_*`
+    environment variables) and instrument the FastAPI `app` if given.
+
+    Returns:
+        The tracer to pass to `AgentTelemetry`.
+    """
+    from opentelemetry import trace
+    from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+    from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+    if app is not None:
+        FastAPIInstrumentor.instrument_app(app, excluded_urls="metrics")
+    return trace.get_tracer("ai_webscraper.agent")
@@ -0,0 +1,297 @@
+from typing import Any, List, Optional, Tuple
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+from langchain.schema import Document
+from pydantic import PrivateAttr
+from ingestion import db_dir, store_version
+import asyncio
+import json
+import mmap
+import os
+import shutil
+import threading
+import time
+import uuid
+import numpy as np
+
+
+index_root = os.path.join(db_dir, "mmap_index")
+
+
+def current_version(root: str = index_root) -> Optional[str]:
+    """
+    Name of the directory holding the newest export, or None if nothing was exported yet.
+    """
+    try:
+        with open(os.path.join(root, "CURRENT"), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def spherical_kmeans(vectors: np.ndarray, nlist: int, iterations: int = 10, sample_size: int = 64, seed: int = 0) -> np.ndarray:
+    """
+    Centroids of `nlist` clusters of unit vectors, trained on a sample of `sample_size` vectors per cluster.
+    """
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(len(vectors), min(len(vectors), nlist * sample_size), replace=False)]
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        counts = np.bincount(assignment, minlength=nlist)
+        # Empty clusters keep their old centroid.
+        centroids = np.where(counts[:, None] > 0, sums, centroids)
+        centroids = _normalize(centroids)
+    return centroids
+
+
+def export_index(db, root: str = index_root, dtype: str = "float16", nlist: int = 0, page_size: int = 5000, keep: int = 2) -> str:
+    """
+    Export the embeddings and chunks of a Chroma store into a memory-mappable index.
+
+    Vectors are L2-normalized and stored as a `.npy` matrix of `dtype` ("float16", or "int8"
+    with one float32 scale per row); chunk ids, texts and metadata go to a JSON-lines
+    sidecar with a row -> byte offset table. With `nlist` > 0 the rows are clustered by
+    spherical k-means and stored list by list (IVF), so a query only scans the lists of its
+    nearest centroids.
+
+    The export is written to a new directory and published by rewriting `CURRENT`, so
+    readers switch over on their next query; only the newest `keep` exports are kept.
+
+    Args:
+        db (Chroma): The vector store to export.
+        root (str): Directory holding the exports.
+        dtype (str): "float16" or "int8".
+        nlist (int): Number of IVF lists, 0 for a flat index.
+        page_size (int): Chunks read from Chroma per request.
+        keep (int): Exports kept on disk (workers may still map the previous one).
+
+    Returns:
+        str: Path of the new export.
+    """
+    if dtype not in ("float16", "int8"):
+        raise ValueError(f"Unsupported dtype {dtype!r}")
+
+    ids, texts, metadatas, vectors = [], [], [], []
+    offset = 0
+    while True:
+        page = db.get(limit=page_size, offset=offset, include=["embeddings", "documents", "metadatas"])
+        if not page["ids"]:
+            break
+        ids.extend(page["ids"])
+        texts.extend(page["documents"])
+        metadatas.extend(page["metadatas"])
+        vectors.append(np.asarray(page["embeddings"], dtype=np.float32))
+        offset += len(page["ids"])
+    if not ids:
+        raise ValueError("The vector store is empty, nothing to export")
+    matrix = _normalize(np.concatenate(vectors))
+
+    list_offsets = None
+    centroids = None
+    if nlist > 0:
+        nlist = min(nlist, len(ids))
+        centroids = spherical_kmeans(matrix, nlist)
+        assignment = np.concatenate([np.argmax(matrix[i:i + 65536] @ centroids.T, axis=1) for i in range(0, len(matrix), 65536)])
+        order = np.argsort(assignment, kind="stable")
+        matrix = matrix[order]
+        ids, texts, metadatas = [ids[i] for i in order], [texts[i] for i in order], [metadatas[i] for i in order]
+        list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=nlist))]).astype(np.int64)
+
+    version = f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    path = os.path.join(root, version)
+    os.makedirs(path)
+
+    if dtype == "int8":
+        scales = np.abs(matrix).max(axis=1) / 127
+        scales[scales == 0] = 1
+        stored = np.lib.format.open_memmap(os.path.join(path, "vectors.npy"), mode="w+", dtype=np.int8, shape=matrix.shape)
+        stored[:] = np.round(matrix / scales[:, None]).astype(np.int8)
+        np.save(os.path.join(path, "scales.npy"), scales.astype(np.float32))
+    else:
+        stored = np.lib.format.open_memmap(os.path.join(path, "vectors.npy"), mode="w+", dtype=np.float16, shape=matrix.shape)
+        stored[:] = matrix.astype(np.float16)
+    stored.flush()
+    del stored
+
+    offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+    with open(os.path.join(path, "chunks.jsonl"), "wb") as f:
+        for i, (chunk_id, text, metadata) in enumerate(zip(ids, texts, metadatas)):
+            line = json.dumps({"id": chunk_id, "text": text, "metadata": metadata or {}}).encode("utf-8") + b"\n"
+            f.write(line)
+            offsets[i + 1] = offsets[i] + len(line)
+    np.save(os.path.join(path, "offsets.npy"), offsets)
+    if centroids is not None:
+        np.save(os.path.join(path, "centroids.npy"), centroids.astype(np.float32))
+        np.save(os.path.join(path, "list_offsets.npy"), list_offsets)
+
+    with open(os.path.join(path, "index.json"), "w", encoding="utf-8") as f:
+        json.dump({"dtype": dtype, "count": len(ids), "dim": matrix.shape[1], "nlist": nlist, "store_version": store_version()}, f)
+
+    tmp_path = os.path.join(root, "CURRENT.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp_path, os.path.join(root, "CURRENT"))
+
+    # Old exports can go even while mapped: the pages stay valid until the last reader unmaps them.
+    exports = sorted(name for name in os.listdir(root) if os.path.isdir(os.path.join(root, name)))
+    for name in exports[:-keep]:
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+    print(f"Exported {len(ids)} chunks ({dtype}, nlist={nlist}) to {path}")
+    return path
+
+
+class MmapIndex:
+    """
+    Read-only vector index over an export of `export_index`, memory-mapped from disk.
+
+    Every process opening the same export shares one copy of it in the OS page cache.
+    Scores are cosine similarities computed with blocked NumPy matrix products, for a
+    batch of queries at once.
+
+    Args:
+        path (str): Directory of the export.
+        block_rows (int): Rows multiplied at a time, bounding the temporary float32 copy.
+    """
+
+    def __init__(self, path: str, block_rows: int = 65536):
+        self.path = path
+        self.block_rows = block_rows
+        with open(os.path.join(path, "index.json"), "r", encoding="utf-8") as f:
+            self.info = json.load(f)
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.scales = np.load(os.path.join(path, "scales.npy"), mmap_mode="r") if self.info["dtype"] == "int8" else None
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        self.centroids = None
+        self.list_offsets = None
+        if self.info["nlist"]:
+            self.centroids = np.load(os.path.join(path, "centroids.npy"))
+            self.list_offsets = np.load(os.path.join(path, "list_offsets.npy"))
+        with open(os.path.join(path, "chunks.jsonl"), "rb") as f:
+            self.chunks = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self) -> int:
+        return self.info["count"]
+
+    def _scores(self, queries: np.ndarray, start: int, stop: int) -> np.ndarray:
+        scores = queries @ np.asarray(self.vectors[start:stop], dtype=np.float32).T
+        if self.scales is not None:
+            scores *= self.scales[start:stop]
+        return scores
+
+    def _scan(self, queries: np.ndarray, ranges: List[Tuple[int, int]], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        for start, stop in ranges:
+            for block_start in range(start, stop, self.block_rows):
+                block_stop = min(stop, block_start + self.block_rows)
+                scores = np.concatenate([best_scores, self._scores(queries, block_start, block_stop)], axis=1)
+                rows = np.concatenate([best_rows, np.broadcast_to(np.arange(block_start, block_stop), (len(queries), block_stop - block_start))], axis=1)
+                best_scores, best_rows = self._top_k_rows(scores, rows, k)
+        return best_scores, best_rows
+
+    @staticmethod
+    def _top_k_rows(scores: np.ndarray, rows: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        k = min(k, scores.shape[1])
+        best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        return np.take_along_axis(scores, best, axis=1), np.take_along_axis(rows, best, axis=1)
+
+    def search_batch(self, queries, k: int = 4, nprobe: int = 8) -> List[List[Tuple[int, float]]]:
+        """
+        Return, for every query vector, the rows and scores of its `k` nearest chunks, best first.
+
+        With IVF lists, each query scans only the `nprobe` lists of its nearest centroids.
+        """
+        queries = _normalize(np.atleast_2d(queries))
+        if len(self) == 0:
+            return [[] for _ in queries]
+        if self.centroids is None:
+            best_scores, best_rows = self._scan(queries, [(0, len(self))], k)
+        else:
+            nearest_lists = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :nprobe]
+            results = [
+                self._scan(query[None, :], [(int(self.list_offsets[l]), int(self.list_offsets[l + 1])) for l in lists], k)
+                for query, lists in zip(queries, nearest_lists)
+            ]
+            width = max(scores.shape[1] for scores, _ in results)
+            best_scores = np.full((len(queries), width), -np.inf, dtype=np.float32)
+            best_rows = np.zeros((len(queries), width), dtype=np.int64)
+            for i, (scores, rows) in enumerate(results):
+                best_scores[i, :scores.shape[1]], best_rows[i, :rows.shape[1]] = scores[0], rows[0]
+        order = np.argsort(-best_scores, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        return [
+            [(int(row), float(score)) for row, score in zip(rows, scores) if np.isfinite(score)]
+            for rows, scores in zip(best_rows, best_scores)
+        ]
+
+    def document(self, row: int) -> Document:
+        record = json.loads(self.chunks[int(self.offsets[row]):int(self.offsets[row + 1])])
+        return Document(page_content=record["text"], metadata=record["metadata"], id=record["id"])
+
+
+class MmapRetriever(BaseRetriever):
+    """
+    Dense retriever answering from the newest `MmapIndex` export under `root`.
+
+    A drop-in for `db.as_retriever()`: the question is embedded with `embeddings` and the
+    `k` most similar chunks come back as Documents with their chunk ids. A new export
+    (published by `export_index`) is picked up on the next query.
+    """
+
+    root: str = index_root
+    embeddings: Any
+    k: int = 4
+    nprobe: int = 8
+    _index: Optional[MmapIndex] = PrivateAttr(default=None)
+    _version: Optional[str] = PrivateAttr(default=None)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    def index(self) -> MmapIndex:
+        version = current_version(self.root)
+        if version is None:
+            raise FileNotFoundError(f"No exported index under {self.root}; run `python mmap_index.py`")
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._index = MmapIndex(os.path.join(self.root, version))
+                    self._version = version
+        return self._index
+
+    def search_vectors(self, vectors, k: Optional[int] = None) -> List[List[Document]]:
+        """
+        Nearest chunks for a batch of already embedded questions, in one pass over the index.
+        """
+        index = self.index()
+        return [[index.document(row) for row, _ in hits] for hits in index.search_batch(vectors, k or self.k, self.nprobe)]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self.search_vectors([self.embeddings.embed_query(query)])[0]
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        vector = await self.embeddings.aembed_query(query)
+        # The matrix products release the GIL; keep them off the event loop.
+        return (await asyncio.to_thread(self.search_vectors, [vector]))[0]
+
+
+if __name__ == "__main__":
+    import argparse
+    from langchain_chroma import Chroma
+    from ingestion import persistent_directory
+
+    parser = argparse.ArgumentParser(description="Export the Chroma store into a memory-mapped index.")
+    parser.add_argument("--dtype", choices=["float16", "int8"], default="float16")
+    parser.add_argument("--nlist", type=int, default=0, help="IVF lists; worth it from about 100k chunks (e.g. sqrt of the count).")
+    args = parser.parse_args()
+
+    # Only stored embeddings are read, so no embedding model is needed.
+    export_index(Chroma(persist_directory=persistent_directory), dtype=args.dtype, nlist=args.nlist)
@@ -0,0 +1,197 @@
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_groq import ChatGroq
+from langchain_ollama import ChatOllama
+from budget import BudgetExceeded
+from metrics import model_fallbacks
+from llm_memo import model_name
+import asyncio
+import time
+
+
+def chat_model(spec: str, temperature: float = 0.7, json_mode: bool = False, rate_limiters: Optional[Dict[str, Any]] = None):
+    """
+    Build a chat model from a "provider:model" spec, e.g. "groq:llama3-70b-8192" or "ollama:llama3.2:3b".
+
+    Args:
+        spec (str): Provider and model name.
+        temperature (float): Sampling temperature.
+        json_mode (bool): Constrain a local model to JSON output (used for the classifiers).
+        rate_limiters (dict): Token bucket per provider name, passed to the model as `rate_limiter`.
+
+    Returns:
+        The chat model.
+    """
+    provider, _, name = spec.partition(":")
+    rate_limiter = (rate_limiters or {}).get(provider)
+    if provider == "groq":
+        return ChatGroq(model=name, temperature=temperature, rate_limiter=rate_limiter)
+    if provider == "ollama":
+        return ChatOllama(model=name, temperature=temperature, format="json" if json_mode else "", rate_limiter=rate_limiter)
+    raise ValueError(f"Unknown model provider {provider!r} in {spec!r}")
+
+
+@dataclass
+class Backend:
+    model: Any
+    name: str
+    average_s: Optional[float] = None  # moving average of call durations
+    failures: int = 0
+    open_until: float = 0.0
+
+
+class LatencyAwareFallback(Runnable):
+    """
+    Runs a chat model call on the first healthy of several backends, in preference order.
+
+    A backend that fails or does not answer within `timeout_s` (on the async path; sync calls
+    rely on the client's own timeout) is skipped for the next one. After
+    `failure_threshold` failures in a row its circuit opens and it is not tried for
+    `cooldown_s` seconds. Backends whose average latency is above `slow_s` are tried after
+    the fast ones. Exceeding the request budget is never treated as a backend failure.
+
+    The wrapper adds no run of its own to the callbacks, so metrics and the budget see the
+    call of the backend that actually answered.
+
+    Args:
+        models (List): Chat models, most preferred first.
+        timeout_s (float): Seconds a backend may take for an answer (or its first streamed chunk).
+        slow_s (float): Average latency above which a backend is demoted.
+        failure_threshold (int): Failures in a row that open the circuit.
+        cooldown_s (float): Seconds an open circuit stays open.
+    """
+
+    def __init__(self, models: List, timeout_s: float = 20.0, slow_s: float = 8.0, failure_threshold: int = 3, cooldown_s: float = 30.0):
+        self.backends = [Backend(model, model_name(model)) for model in models]
+        self.timeout_s = timeout_s
+        self.slow_s = slow_s
+        self.failure_threshold = failure_threshold
+        self.cooldown_s = cooldown_s
+
+    @property
+    def model_name(self) -> str:
+        return ",".join(backend.name for backend in self.backends)
+
+    def _order(self) -> List[Backend]:
+        now = time.monotonic()
+        closed = [backend for backend in self.backends if backend.open_until <= now] or self.backends
+        # Stable sort: slow backends move behind the fast ones, otherwise the configured order holds.
+        return sorted(closed, key=lambda backend: backend.average_s is not None and backend.average_s > self.slow_s)
+
+    def _record(self, backend: Backend, elapsed: float) -> None:
+        backend.average_s = elapsed if backend.average_s is None else 0.8 * backend.average_s + 0.2 * elapsed
+
+    def _succeeded(self, backend: Backend, elapsed: float) -> None:
+        self._record(backend, elapsed)
+        backend.failures = 0
+
+    def _failed(self, backend: Backend, error: BaseException, elapsed: float) -> None:
+        reason = "timeout" if isinstance(error, TimeoutError) else "error"
+        self._record(backend, elapsed)
+        backend.failures += 1
+        model_fallbacks.labels(backend.name, reason).inc()
+        if backend.failures >= self.failure_threshold:
+            backend.open_until = time.monotonic() + self.cooldown_s
+            print(f"Model {backend.name} failed {backend.failures} times in a row ({error!r}); skipping it for {self.cooldown_s}s")
+
+    def invoke(self, input, config: Optional[RunnableConfig] = None, **kwargs: Any):
+        error: Optional[BaseException] = None
+        for backend in self._order():
+            started = time.monotonic()
+            try:
+                result = backend.model.invoke(input, config, **kwargs)
+            except BudgetExceeded:
+                raise
+            except Exception as e:
+                self._failed(backend, e, time.monotonic() - started)
+                error = e
+                continue
+            self._succeeded(backend, time.monotonic() - started)
+            return result
+        raise error
+
+    async def ainvoke(self, input, config: Optional[RunnableConfig] = None, **kwargs: Any):
+        error: Optional[BaseException] = None
+        for backend in self._order():
+            started = time.monotonic()
+            try:
+                async with asyncio.timeout(self.timeout_s):
+                    result = await backend.model.ainvoke(input, config, **kwargs)
+            except BudgetExceeded:
+                raise
+            except Exception as e:
+                self._failed(backend, e, time.monotonic() - started)
+                error = e
+                continue
+            self._succeeded(backend, time.monotonic() - started)
+            return result
+        raise error
+
+    def stream(self, input, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Iterator:
+        error: Optional[BaseException] = None
+        for backend in self._order():
+            started = time.monotonic()
+            chunks = backend.model.stream(input, config, **kwargs)
+            try:
+                first = next(chunks)
+            except StopIteration:
+                self._succeeded(backend, time.monotonic() - started)
+                return
+            except BudgetExceeded:
+                raise
+            except Exception as e:
+                self._failed(backend, e, time.monotonic() - started)
+                error = e
+                continue
+            # Once the answer started streaming it cannot move to another backend.
+            yield first
+            yield from chunks
+            self._succeeded(backend, time.monotonic() - started)
+            return
+        raise error
+
+    async def astream(self, input, config: Optional[RunnableConfig] = None, **kwargs: Any) -> AsyncIterator:
+        error: Optional[BaseException] = None
+        for backend in self._order():
+            started = time.monotonic()
+            chunks = backend.model.astream(input, config, **kwargs)
+            try:
+                async with asyncio.timeout(self.timeout_s):
+                    first = await anext(chunks)
+            except StopAsyncIteration:
+                self._succeeded(backend, time.monotonic() - started)
+                return
+            except BudgetExceeded:
+                raise
+            except Exception as e:
+                await chunks.aclose()
+                self._failed(backend, e, time.monotonic() - started)
+                error = e
+                continue
+            yield first
+            async for chunk in chunks:
+                yield chunk
+            self._succeeded(backend, time.monotonic() - started)
+            return
+        raise error
+
+
+def tiered_model(specs: str, temperature: float = 0.7, json_mode: bool = False, rate_limiters: Optional[Dict[str, Any]] = None, **fallback_kwargs):
+    """
+    Chat model for a comma-separated list of specs: the model itself for one spec, a
+    `LatencyAwareFallback` over all of them for several.
+    """
+    models = [chat_model(spec.strip(), temperature, json_mode, rate_limiters) for spec in specs.split(",") if spec.strip()]
+    if len(models) == 1:
+        return models[0]
+    return LatencyAwareFallback(models, **fallback_kwargs)
+
+
+def backend_models(model) -> List:
+    """
+    The chat models behind a node's model: the backends of a fallback, or the model itself.
+    """
+    if isinstance(model, LatencyAwareFallback):
+        return [backend.model for backend in model.backends]
+    return [model]
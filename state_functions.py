@@ -1,57 +1,334 @@
-from langchain_community.document_loaders import WebBaseLoader, RecursiveUrlLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_chroma import Chroma
 from langchain_nomic.embeddings import NomicEmbeddings
 from langchain_ollama import ChatOllama
-from langchain_groq import ChatGroq
 from langchain_core.prompts import PromptTemplate
-from langchain_core.output_parsers import JsonOutputParser, StrOutputParser
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.rate_limiters import InMemoryRateLimiter
 from dotenv import load_dotenv, find_dotenv
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import os
+import threading
+import time
 from typing import TypedDict, List
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
 from langchain_community.tools import TavilySearchResults
 from langchain.schema import Document
+from embedding_service import BatchingEmbeddings
+from ingestion import db_dir, persistent_directory, bm25_path, urls, Manifest, ingest, store_version
+from bm25 import BM25Index, HybridRetriever
+from web_search_cache import CachedWebSearch
+from context import pack_context, format_context
+from disk_cache import DiskCache
+from llm_memo import MemoizedClassifier, model_name
+from streaming import ANSWER_TAG
+from budget import BudgetExceeded
+from metrics import counts_decisions
+from admission import transient_errors
+from model_routing import backend_models, tiered_model
+from mmap_index import MmapRetriever, current_version
 
 
 load_dotenv(find_dotenv())
 
 
-# llm = ChatOllama(model="llama2:7b", temperature=0.7)
-llm = ChatGroq(model="llama3-70b-8192", temperature=0.7)
-# llm = ChatOllama(model="gemma2:27b", temperature=0.7)
+# Token buckets per provider: bursts are spread out to the provider quota instead of coming back as 429s.
+groq_rate_limiter = InMemoryRateLimiter(
+    requests_per_second=float(os.environ.get("GROQ_REQUESTS_PER_S", "0.5")), check_every_n_seconds=0.05, max_bucket_size=5
+)
+tavily_rate_limiter = InMemoryRateLimiter(
+    requests_per_second=float(os.environ.get("TAVILY_REQUESTS_PER_S", "2")), check_every_n_seconds=0.05, max_bucket_size=5
+)
+
+# Model per node as "provider:model"; with several, comma-separated, the later ones take over
+# when the earlier ones are slow or down. The yes/no classifiers run on a small local model,
+# the answers on the 70B model. Each entry can be overridden by env, e.g. MODEL_GENERATE=ollama:gemma2:27b.
+node_models = {
+    "route": os.environ.get("MODEL_ROUTE", "ollama:llama3.2:3b,groq:llama3-8b-8192"),
+    "grade_documents": os.environ.get("MODEL_GRADE_DOCUMENTS", "ollama:llama3.2:3b,groq:llama3-8b-8192"),
+    "hallucination_check": os.environ.get("MODEL_HALLUCINATION_CHECK", "ollama:llama3.2:3b,groq:llama3-8b-8192"),
+    "generate": os.environ.get("MODEL_GENERATE", "groq:llama3-70b-8192,groq:llama3-8b-8192"),
+    "generate_direct": os.environ.get("MODEL_GENERATE_DIRECT", "groq:llama3-70b-8192,groq:llama3-8b-8192"),
+}
+classifier_nodes = {"route", "grade_documents", "hallucination_check"}
 
 class GraphState(TypedDict):
     datasource: str
     question: str
     generation: str
     web_search: str
-    documents: List[str]
+    documents: List[Document]
+    speculation: dict
+    prefetched: List[Document]
+
+
+# Created by `init()`, so importing this module stays cheap; the nodes look them up when they run.
+embeddings = None
+db = None
+retriever = None
+web_searcher = None
+models = {}
+startup_timings = {}
+_init_lock = threading.Lock()
+
+# Start the vector store retrieval together with the routing LLM call instead of after it.
+speculative_retrieval = os.environ.get("SPECULATIVE_RETRIEVAL", "true").lower() == "true"
+speculation_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="speculative-retrieval")
+
+# "mmap" serves the dense search from the memory-mapped export of the collection (`python mmap_index.py`),
+# shared by all workers through the page cache, instead of a Chroma/HNSW copy per process.
+retrieval_engine = os.environ.get("RETRIEVAL_ENGINE", "chroma").lower()
+
+# Most tokens of retrieved/searched context that go into the generation prompt.
+context_token_budget = 3000
+
+# Raised through the nodes instead of being turned into an answer: the request ran out of
+# budget, or the provider is still failing after the retries (the API answers 503).
+abort_errors = (BudgetExceeded, *transient_errors)
+
+# Retrieved chunks are graded one by one; stop once this many passed.
+grading_concurrency = 4
+relevant_docs_needed = 3
+
+
+rag_prompt = PromptTemplate(
+    template="""<|begin_of_text|><|start_header_id|>system<|end_header_id|>
+    You are an AI assistant representing SalarySe, specializing in answering questions about our company, products, and services from our perspective. 
+    Speak as if you are part of the company, using "we" to represent SalarySe. 
+    Provide clear and concise answers with a maximum of 10 lines. 
+    If the information is not available or unclear, respond with "I'm sorry, I don't have that information." 
+    Tailor responses to maintain a professional and informative tone.
+    
+    Question: {question}
+    Context: {context}
+    Answer:
+    <|eot_id|><|start_header_id|>assistant<|end_header_id|>""",
+    input_variables=["question", "context"]
+)
+
+direct_prompt = PromptTemplate(
+    template="""<|begin_of_text|><|start_header_id|>system<|end_header_id|>
+    You are an AI assistant representing SalarySe, specializing in answering questions about our company, products, and services from our perspective. 
+    Speak as if you are part of the company, using "we" to represent SalarySe. 
+    Provide clear and concise answers with a maximum of 10 lines. 
+    Tailor responses to maintain a professional and informative tone.
+    
+    Question: {question}
+    Answer:
+    <|eot_id|><|start_header_id|>assistant<|end_header_id|>""",
+    input_variables=["question", "context"]
+)
+
+retrieval_grader_prompt = PromptTemplate(
+    template="""<|begin_of_text|><|start_header_id|>system<|end_header_id|>
+    You are a grader assessing relevance of a retrieved document to a user question. 
+    If the document contains keywords related to the user question, grade it as relevant. 
+    It does not need to be a stringent test. The goal is to filter out erroneous retrievals.
+    Give a binary score 'yes' or 'no' to indicate whether the document is relevant to the question.
+    Provide the binary score as a JSON with a single key 'score' and no preamble or explanation.
+    user
+    Here is the retrieved document: \n\n {context} \n\n
+    Here is the user question: {question} \n <|eot_id|><|start_header_id|>assistant<|end_header_id|>""",
+    input_variables=["question", "context"]
+)
+
+hallucination_prompt = PromptTemplate(
+    template="""<|begin_of_text|><|start_header_id|>system<|end_header_id|>
+    You are a grader assessing whether an answer is grounded in / supported by our context document. 
+    Give a binary 'yes' or 'no' score to indicate whether the answer is grounded in / supported by our context document. 
+    Provide the binary score as a JSON with a single key 'score' and no preamble or explanation. user
+    Here is the context document:
+    \n ------- \n
+    {documents}
+    \n ------- \n
+    Here is the answer: {generation} 
+    <|eot_id|><|start_header_id|>assistant<|end_header_id|>""",
+    input_variables=["generation", "documents"]
+)
+
+answer_prompt = PromptTemplate(
+    template="""<|begin_of_text|><|start_header_id|>system<|end_header_id|>
+    You are a grader assessing whether an answer addresses / resolves a question. 
+    Give a binary 'yes' or 'no' score to indicate if the answer resolves the question.
+    Provide the binary score as a JSON with a single key 'score' and no preamble or explanation. user
+    The answer is: {generation}
+    The question is: {question}
+    <|eot_id|><|start_header_id|>assistant<|end_header_id|>""",
+    input_variables=["generation", "question"]
+)
+
+router_prompt = PromptTemplate(
+    template="""<|begin_of_text|><|start_header_id|>system<|end_header_id|>
+    You are an expert assistant in determining whether to directly answer a user question with the LLM's knowledge 
+    or use RAG (Retrieval Augmented Generation) for a more context-based response. 
+    Use RAG for questions on specific factual data, document-based knowledge, or retrieval-heavy topics. 
+    For open-ended, opinion-based, or general knowledge questions, answer directly with the LLM. 
+    If you don't know the question reroute to RAG.
+    Return a JSON with a single key 'datasource' and no preamble or explanation. 
+    Options are 'rag' or 'direct_answer'. Question to route: {question} 
+    <|eot_id|><|start_header_id|>assistant<|end_header_id|>""",
+    input_variables=["question"],
+)
+
+
+# Chains are built once at startup by `build_chains`. The router and graders are pure functions
+# of their inputs, so their decisions are memoized on disk for a week (opened with the chains).
+classifier_cache = None
+rag_chain = None
+direct_chain = None
+retrieval_grader = None
+hallucination_grader = None
+answer_grader = None
+question_router = None
+
+
+def build_models() -> dict:
+    """
+    Chat model of every node in `node_models`; the classifiers answer deterministically in JSON.
+    """
+    return {
+        node: tiered_model(
+            specs,
+            temperature=0 if node in classifier_nodes else 0.7,
+            json_mode=node in classifier_nodes,
+            rate_limiters={"groq": groq_rate_limiter},
+        )
+        for node, specs in node_models.items()
+    }
+
+
+def build_chains(models: dict) -> None:
+    """
+    (Re)build the generation chains, graders and router on the models of their nodes.
+
+    The nodes look the chains up as module globals when they run, so calling this again
+    swaps the models under an already compiled graph (e.g. local stand-ins in `bench.py`).
+
+    Args:
+        models (dict): Chat model per node name of `node_models`.
+    """
+    global classifier_cache, rag_chain, direct_chain, retrieval_grader, hallucination_grader, answer_grader, question_router
+
+    if classifier_cache is None:
+        classifier_cache = DiskCache(os.path.join(db_dir, "llm_cache.sqlite"), max_entries=100_000, ttl=7 * 24 * 3600)
+
+    def resilient(node: str):
+        # 429s and other transient provider errors are retried with jittered exponential backoff.
+        return models[node].with_retry(retry_if_exception_type=transient_errors, wait_exponential_jitter=True, stop_after_attempt=4)
 
+    # Tagged so the streaming endpoint only forwards answer tokens, not grader output.
+    rag_chain = (rag_prompt | resilient("generate") | StrOutputParser()).with_config(tags=[ANSWER_TAG])
+    direct_chain = (direct_prompt | resilient("generate_direct") | StrOutputParser()).with_config(tags=[ANSWER_TAG])
+    retrieval_grader = MemoizedClassifier(retrieval_grader_prompt, resilient("grade_documents"), classifier_cache)
+    hallucination_grader = MemoizedClassifier(hallucination_prompt, resilient("hallucination_check"), classifier_cache)
+    answer_grader = MemoizedClassifier(answer_prompt, resilient("hallucination_check"), classifier_cache)
+    question_router = MemoizedClassifier(router_prompt, resilient("route"), classifier_cache, output_key="datasource", allowed=("rag", "direct_answer"))
 
-db_dir = os.path.join(os.getcwd(), "db")
-persistent_directory = os.path.join(db_dir, "chroma_db_with_metadata2")
 
-urls = ["https://www.salaryse.com/"]
+def _timed(phase: str, func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    startup_timings[phase] = round(time.perf_counter() - started, 3)
+    print(f"Startup phase {phase}: {startup_timings[phase]:.3f}s")
+    return result
 
 
-docs = [WebBaseLoader(url).load() for url in urls]
-docs_list = [doc for sublist in docs for doc in sublist]
+def init(seed: bool = True) -> dict:
+    """
+    Create the embedding model, vector store, retriever, search client and LLM chains.
 
+    Safe to call more than once and from several threads; only the first call does the work.
 
-text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(chunk_size=1000, chunk_overlap=100)
-doc_splits = text_splitter.split_documents(docs_list)
+    Args:
+        seed (bool): Run the ingestion if the vector store has never been built.
 
+    Returns:
+        dict: Seconds spent in each startup phase.
+    """
+    global embeddings, db, retriever, web_searcher, models
+
+    with _init_lock:
+        if retriever is not None:
+            return startup_timings
+
+        # Concurrent questions share one forward pass; repeated questions come from the LRU cache.
+        embeddings = _timed(
+            "embeddings", lambda: BatchingEmbeddings(NomicEmbeddings(model="nomic-embed-text-v1.5", inference_mode="local"))
+        )
+        if retrieval_engine == "mmap" and current_version() is not None:
+            dense = MmapRetriever(embeddings=embeddings, k=4)
+        else:
+            if retrieval_engine == "mmap":
+                print("RETRIEVAL_ENGINE=mmap but no index was exported yet; using Chroma")
+            db = _timed("vectorstore", lambda: Chroma(persist_directory=persistent_directory, embedding_function=embeddings))
+
+            # Refreshing the store is a separate stage (`python ingestion.py`); only seed it here on first start.
+            if seed and not Manifest().exists():
+                _timed("seed_ingestion", ingest, urls, db)
+            dense = db.as_retriever(search_kwargs={"k": 4})
+
+        # One shared search client; identical searches are cached for an hour and coalesced while in flight.
+        web_searcher = CachedWebSearch(
+            TavilySearchResults(max_results=3),
+            DiskCache(os.path.join(db_dir, "web_search_cache.sqlite"), max_entries=50_000, ttl=3600),
+            rate_limiter=tavily_rate_limiter,
+        )
+        models = _timed("llm_clients", build_models)
+        build_chains(models)
+
+        # Dense search fused with the BM25 index built during ingestion (reciprocal rank fusion).
+        retriever = _timed("retriever", lambda: HybridRetriever(
+            dense=dense,
+            index=BM25Index.load(bm25_path),
+            k=4,
+            k_dense=4,
+            k_sparse=4,
+            index_path=bm25_path,
+            version_fn=store_version,
+        ))
+        return startup_timings
+
+
+async def awarm_up() -> dict:
+    """
+    Warm up everything a first question would otherwise wait for, concurrently: a forward
+    pass of the embedding model, a vector store search and a short call to every LLM backend.
+    Call `init()` first.
 
-embeddings = NomicEmbeddings(model="nomic-embed-text-v1.5", inference_mode="local")
+    Returns:
+        dict: Seconds each warm-up took, or the error it failed with.
+    """
+    async def timed(phase: str, coro):
+        started = time.perf_counter()
+        try:
+            await coro
+        except Exception as e:
+            print(f"Warm-up {phase} failed: {e!r}")
+            return phase, f"error: {e!r}"
+        elapsed = round(time.perf_counter() - started, 3)
+        print(f"Warm-up {phase}: {elapsed:.3f}s")
+        return phase, elapsed
+
+    backends = {model_name(model): model for node_model in models.values() for model in backend_models(node_model)}
+    results = await asyncio.gather(
+        timed("embedding_model", embeddings.aembed_query("SalarySe")),
+        timed("retrieval", retriever.ainvoke("SalarySe")),
+        *(timed(f"llm:{name}", model.ainvoke("Reply with the single word OK.")) for name, model in backends.items()),
+    )
+    warm_up_timings = dict(results)
+    startup_timings["warm_up"] = warm_up_timings
+    return warm_up_timings
 
 
-if not os.path.exists(persistent_directory):
-    db = Chroma.from_documents(documents=doc_splits, embedding=embeddings, persist_directory=persistent_directory)
-else:
-    db = Chroma(persist_directory=persistent_directory, embedding_function=embeddings)
+def _retrieve(state: GraphState) -> List[Document]:
+    # Batch runs retrieve the documents for all their questions up front and pass them in.
+    prefetched = state.get("prefetched")
+    return prefetched if prefetched is not None else retriever.invoke(state["question"])
 
-retriever = db.as_retriever()
+
+async def _aretrieve(state: GraphState) -> List[Document]:
+    prefetched = state.get("prefetched")
+    return prefetched if prefetched is not None else await retriever.ainvoke(state["question"])
 
 
 def retrieve(state: GraphState) -> GraphState:
@@ -65,21 +342,32 @@ def retrieve(state: GraphState) -> GraphState:
     Returns:
         GraphState: Updated state with retrieved documents.
     """
-    question = state["question"]
-    rag_docs = retriever.invoke(question)
+    rag_docs = _retrieve(state)
 
-    
-    retrieved_docs = [doc.page_content for doc in rag_docs]
+    updated_state = state.copy()
+    updated_state["documents"] = rag_docs
+    return updated_state
+
+
+async def aretrieve(state: GraphState) -> GraphState:
+    """
+    Async version of `retrieve`.
+    """
+    rag_docs = await _aretrieve(state)
 
     updated_state = state.copy()
-    updated_state["documents"] = retrieved_docs
-    return updated_state 
+    updated_state["documents"] = rag_docs
+    return updated_state
 
 
 def generate(state: GraphState) -> GraphState:
     """
     Generate an answer using RAG (Retrieve and Generate) on retrieved documents.
 
+    The documents are packed into the prompt by `pack_context` (deduplicated, picked by MMR
+    within `context_token_budget`); the packed documents replace `documents` in the state
+    so the hallucination check grades against exactly what the answer was based on.
+
     Args:
         state (GraphState): Current state containing the user query and retrieved documents.
 
@@ -87,42 +375,107 @@ def generate(state: GraphState) -> GraphState:
         GraphState: Updated state with a new key `generation` containing the generated response.
     """
     question = state["question"]
-    documents = state["documents"]
-
-    context = "\n\n".join(documents) if documents else "No relevant context available."
-
-    prompt = PromptTemplate(
-        template="""<|begin_of_text|><|start_header_id|>system<|end_header_id|>
-        You are an AI assistant representing SalarySe, specializing in answering questions about our company, products, and services from our perspective. 
-        Speak as if you are part of the company, using "we" to represent SalarySe. 
-        Provide clear and concise answers with a maximum of 10 lines. 
-        If the information is not available or unclear, respond with "I'm sorry, I don't have that information." 
-        Tailor responses to maintain a professional and informative tone.
-        
-        Question: {question}
-        Context: {context}
-        Answer:
-        <|eot_id|><|start_header_id|>assistant<|end_header_id|>""",
-        input_variables=["question", "context"]
-    )
+    documents = pack_context(question, state["documents"], token_budget=context_token_budget)
 
-    rag_chain = prompt | llm | StrOutputParser()
+    context = format_context(documents) if documents else "No relevant context available."
 
     try:
         generation = rag_chain.invoke({"context": context, "question": question})
+    except abort_errors:
+        raise
     except Exception as e:
         generation = f"I'm sorry, an error occurred while generating the response: {str(e)}"
 
     # Update the state with the generated response
     updated_state = state.copy()
     updated_state["generation"] = generation.strip()
+    updated_state["documents"] = documents
     return updated_state
 
-    
+
+async def agenerate(state: GraphState) -> GraphState:
+    """
+    Async version of `generate`.
+    """
+    documents = pack_context(state["question"], state["documents"], token_budget=context_token_budget)
+    context = format_context(documents) if documents else "No relevant context available."
+
+    try:
+        generation = await rag_chain.ainvoke({"context": context, "question": state["question"]})
+    except abort_errors:
+        raise
+    except Exception as e:
+        generation = f"I'm sorry, an error occurred while generating the response: {str(e)}"
+
+    updated_state = state.copy()
+    updated_state["generation"] = generation.strip()
+    updated_state["documents"] = documents
+    return updated_state
+
+
+async def agrade_each_document(question: str, documents: List[Document]) -> List[Document]:
+    """
+    Grade every retrieved document in its own concurrent LLM call.
+
+    At most `grading_concurrency` grader calls run at once, and grading stops as soon as
+    `relevant_docs_needed` documents passed; the rest are cancelled and dropped.
+
+    Args:
+        question (str): The user question.
+        documents (List[Document]): Retrieved documents, best first.
+
+    Returns:
+        List[Document]: The relevant documents, in retrieval order.
+    """
+    semaphore = asyncio.Semaphore(grading_concurrency)
+
+    async def grade(index: int, doc: Document):
+        async with semaphore:
+            try:
+                response = await retrieval_grader.ainvoke({"context": doc.page_content, "question": question})
+            except abort_errors:
+                raise
+            except Exception as e:
+                print(f"Grading failed, treating document as irrelevant: {e}")
+                return index, False
+        return index, str(response.get("score", "")).lower() == "yes"
+
+    tasks = [asyncio.create_task(grade(i, doc)) for i, doc in enumerate(documents)]
+    relevant = set()
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            index, is_relevant = await next_done
+            if is_relevant:
+                relevant.add(index)
+                if len(relevant) >= relevant_docs_needed:
+                    break
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    return [doc for i, doc in enumerate(documents) if i in relevant]
+
+
+def run_sync(coro):
+    """
+    Run a coroutine from synchronous code, also when this thread already runs an event loop.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+
 def grade_documents(state: dict) -> dict:
     """
     Filter out irrelevant documents based on relevance grading.
 
+    Each document is graded on its own and only the relevant ones are kept, so one bad
+    chunk no longer sends the whole question to web search.
+
     Args:
         state (dict): A dictionary containing the current state, including "documents" and "question".
 
@@ -132,44 +485,37 @@ def grade_documents(state: dict) -> dict:
     documents = state.get("documents", [])
     question = state.get("question", "")
 
-    
-    doc_contents = "\n\n".join(doc for doc in documents)
-    web_search = "No"
-
-    
-    prompt = PromptTemplate(
-        template="""<|begin_of_text|><|start_header_id|>system<|end_header_id|>
-        You are a grader assessing relevance of a retrieved document to a user question. 
-        If the document contains keywords related to the user question, grade it as relevant. 
-        It does not need to be a stringent test. The goal is to filter out erroneous retrievals.
-        Give a binary score 'yes' or 'no' to indicate whether the document is relevant to the question.
-        Provide the binary score as a JSON with a single key 'score' and no preamble or explanation.
-        user
-        Here is the retrieved document: \n\n {context} \n\n
-        Here is the user question: {question} \n <|eot_id|><|start_header_id|>assistant<|end_header_id|>""",
-        input_variables=["question", "context"]
-    )
+    filtered_docs = run_sync(agrade_each_document(question, documents))
+    web_search = "No" if filtered_docs else "Yes"
 
-    
-    retrieval_grader = prompt | llm | JsonOutputParser()
+    updated_state = state.copy()
+    updated_state.update({"documents": filtered_docs, "web_search": web_search})
+    return updated_state
 
-    
-    response = retrieval_grader.invoke({"context": doc_contents, "question": question})
-    grade = response.get("score", "").lower()
 
-    
-    filtered_docs = []
-    if grade == "yes":
-        filtered_docs.append(doc_contents)
-    else:
-        web_search = "Yes"
+async def agrade_documents(state: dict) -> dict:
+    """
+    Async version of `grade_documents`.
+    """
+    filtered_docs = await agrade_each_document(state.get("question", ""), state.get("documents", []))
 
-    
     updated_state = state.copy()
-    updated_state.update({"documents": filtered_docs, "web_search": web_search})
+    updated_state.update({"documents": filtered_docs, "web_search": "No" if filtered_docs else "Yes"})
     return updated_state
 
 
+def search_results_to_documents(search_docs) -> List[Document]:
+    """
+    One Document per web search result, keeping its url as the source.
+    """
+    if not isinstance(search_docs, list):
+        return []
+    return [
+        Document(page_content=doc["content"], metadata={"source": doc.get("url", "web_search")})
+        for doc in search_docs
+        if isinstance(doc, dict) and doc.get("content")
+    ]
+
 
 def web_search(state: dict) -> dict:
     """
@@ -184,20 +530,27 @@ def web_search(state: dict) -> dict:
     question = state.get("question")
     documents = state.get("documents", [])
 
-    tavily_search = TavilySearchResults(max_results=3)
-    search_docs = tavily_search.invoke(question)
-    
-    search_results = "\n".join([doc["content"] for doc in search_docs])
-    web_results = Document(page_content=search_results)
-   
-    documents.append(web_results)
-    doc_contents = "\n\n".join(doc.page_content for doc in documents)
+    search_docs = web_searcher.search(question)
 
     updated_state = state.copy()
-    updated_state["documents"] = doc_contents
+    updated_state["documents"] = [*documents, *search_results_to_documents(search_docs)]
     return updated_state
 
 
+async def aweb_search(state: dict) -> dict:
+    """
+    Async version of `web_search`.
+    """
+    documents = state.get("documents", [])
+
+    search_docs = await web_searcher.asearch(state.get("question"))
+
+    updated_state = state.copy()
+    updated_state["documents"] = [*documents, *search_results_to_documents(search_docs)]
+    return updated_state
+
+
+@counts_decisions("grade_documents")
 def decide_to_generate(state):
     
     """
@@ -216,6 +569,7 @@ def decide_to_generate(state):
         return "websearch"
 
 
+@counts_decisions("hallucination_check")
 def hallucination_check(state: GraphState) -> str:
     """
     Decides if the generated output is hallucinated or grounded in relevant documents.
@@ -233,37 +587,8 @@ def hallucination_check(state: GraphState) -> str:
     documents = state["documents"]
     question = state["question"]
     
-    combined_docs = "\n\n".join(documents) if documents else "No relevant documents provided."
+    combined_docs = format_context(documents) if documents else "No relevant documents provided."
     
-    hallucination_prompt = PromptTemplate(
-        template="""<|begin_of_text|><|start_header_id|>system<|end_header_id|>
-        You are a grader assessing whether an answer is grounded in / supported by our context document. 
-        Give a binary 'yes' or 'no' score to indicate whether the answer is grounded in / supported by our context document. 
-        Provide the binary score as a JSON with a single key 'score' and no preamble or explanation. user
-        Here is the context document:
-        \n ------- \n
-        {documents}
-        \n ------- \n
-        Here is the answer: {generation} 
-        <|eot_id|><|start_header_id|>assistant<|end_header_id|>""",
-        input_variables=["generation", "documents"]
-    )
-
-    
-    answer_prompt = PromptTemplate(
-        template="""<|begin_of_text|><|start_header_id|>system<|end_header_id|>
-        You are a grader assessing whether an answer addresses / resolves a question. 
-        Give a binary 'yes' or 'no' score to indicate if the answer resolves the question.
-        Provide the binary score as a JSON with a single key 'score' and no preamble or explanation. user
-        The answer is: {generation}
-        The question is: {question}
-        <|eot_id|><|start_header_id|>assistant<|end_header_id|>""",
-        input_variables=["generation", "question"]
-    )
-
-    hallucination_grader = hallucination_prompt | llm | JsonOutputParser()
-    answer_grader = answer_prompt | llm | JsonOutputParser()
-
     try:
         hallucination_response = hallucination_grader.invoke({"generation": generation, "documents": combined_docs})
         if hallucination_response["score"].lower() == "yes":
@@ -274,10 +599,36 @@ def hallucination_check(state: GraphState) -> str:
                 return "not useful"
         else:
             return "not supported"
+    except abort_errors:
+        raise
     except Exception as e:
         return f"error: {str(e)}"
 
   
+
+
+@counts_decisions("hallucination_check")
+async def ahallucination_check(state: GraphState) -> str:
+    """
+    Async version of `hallucination_check`.
+    """
+    generation = state["generation"]
+    documents = state["documents"]
+    combined_docs = format_context(documents) if documents else "No relevant documents provided."
+
+    try:
+        hallucination_response = await hallucination_grader.ainvoke({"generation": generation, "documents": combined_docs})
+        if hallucination_response["score"].lower() != "yes":
+            return "not supported"
+        answer_response = await answer_grader.ainvoke({"generation": generation, "question": state["question"]})
+        return "useful" if answer_response["score"].lower() == "yes" else "not useful"
+    except abort_errors:
+        raise
+    except Exception as e:
+        return f"error: {str(e)}"
+
+
+@counts_decisions("route")
 def route_question(state):
     """
        Decides whether to go to RAG or directly answer using the LLM
@@ -289,21 +640,6 @@ def route_question(state):
 
     question = state["question"]
 
-    prompt = PromptTemplate(
-        template="""<|begin_of_text|><|start_header_id|>system<|end_header_id|>
-        You are an expert assistant in determining whether to directly answer a user question with the LLM's knowledge 
-        or use RAG (Retrieval Augmented Generation) for a more context-based response. 
-        Use RAG for questions on specific factual data, document-based knowledge, or retrieval-heavy topics. 
-        For open-ended, opinion-based, or general knowledge questions, answer directly with the LLM. 
-        If you don't know the question reroute to RAG.
-        Return a JSON with a single key 'datasource' and no preamble or explanation. 
-        Options are 'rag' or 'direct_answer'. Question to route: {question} 
-        <|eot_id|><|start_header_id|>assistant<|end_header_id|>""",
-        input_variables=["question"],
-    )
-
-    question_router = prompt | llm | JsonOutputParser()
-
     response = question_router.invoke({"question": question})
 
     if response["datasource"] == "rag":
@@ -312,6 +648,17 @@ def route_question(state):
         return "direct_answer"
 
     
+
+
+@counts_decisions("route")
+async def aroute_question(state):
+    """
+    Async version of `route_question`.
+    """
+    response = await question_router.ainvoke({"question": state["question"]})
+    return "vectorstore" if response["datasource"] == "rag" else "direct_answer"
+
+
 def generate_direct(state: GraphState) -> GraphState:
     """
     Generate an answer directly by LLM.
@@ -325,27 +672,130 @@ def generate_direct(state: GraphState) -> GraphState:
     question = state["question"]
 
 
-    prompt = PromptTemplate(
-        template="""<|begin_of_text|><|start_header_id|>system<|end_header_id|>
-        You are an AI assistant representing SalarySe, specializing in answering questions about our company, products, and services from our perspective. 
-        Speak as if you are part of the company, using "we" to represent SalarySe. 
-        Provide clear and concise answers with a maximum of 10 lines. 
-        Tailor responses to maintain a professional and informative tone.
-        
-        Question: {question}
-        Answer:
-        <|eot_id|><|start_header_id|>assistant<|end_header_id|>""",
-        input_variables=["question", "context"]
-    )
+    try:
+        generation = direct_chain.invoke({"question": question})
+    except abort_errors:
+        raise
+    except Exception as e:
+        generation = f"I'm sorry, an error occurred while generating the response: {str(e)}"
+
+    # Update the state with the generated response
+    updated_state = state.copy()
+    updated_state["generation"] = generation.strip()
+    return updated_state
 
-    rag_chain = prompt | llm | StrOutputParser()
 
+async def agenerate_direct(state: GraphState) -> GraphState:
+    """
+    Async version of `generate_direct`.
+    """
     try:
-        generation = rag_chain.invoke({"question": question})
+        generation = await direct_chain.ainvoke({"question": state["question"]})
+    except abort_errors:
+        raise
     except Exception as e:
         generation = f"I'm sorry, an error occurred while generating the response: {str(e)}"
 
-    # Update the state with the generated response
     updated_state = state.copy()
     updated_state["generation"] = generation.strip()
-    return updated_state
\ No newline at end of file
+    return updated_state
+
+
+def speculation_metrics(datasource: str, routing_s: float, retrieval_s: float) -> dict:
+    """
+    Latency saved or work wasted by running retrieval speculatively.
+
+    When the retrieval is used, running it next to the router saves the shorter of the two
+    latencies. When the router picks `direct_answer`, whatever retrieval time was spent
+    until it was dropped is wasted.
+    """
+    used = datasource == "vectorstore"
+    return {
+        "used": used,
+        "routing_ms": round(routing_s * 1000, 1),
+        "retrieval_ms": round(retrieval_s * 1000, 1),
+        "saved_ms": round(min(routing_s, retrieval_s) * 1000, 1) if used else 0.0,
+        "wasted_ms": 0.0 if used else round(retrieval_s * 1000, 1),
+    }
+
+
+def route_and_retrieve(state: GraphState) -> GraphState:
+    """
+    Route the question while already retrieving documents for it.
+
+    The retrieval runs on a worker thread next to the routing LLM call. If the router
+    picks `direct_answer` the retrieval is cancelled (or its result dropped).
+
+    Args:
+        state (GraphState): Current state containing the user query.
+
+    Returns:
+        GraphState: Updated state with `datasource`, the retrieved `documents` when routed
+        to the vectorstore, and `speculation` metrics.
+    """
+    started = time.perf_counter()
+
+    def timed_retrieval():
+        return _retrieve(state), time.perf_counter() - started
+
+    retrieval = speculation_executor.submit(timed_retrieval)
+    datasource = route_question(state)
+    routing_s = time.perf_counter() - started
+    if datasource == "vectorstore":
+        rag_docs, retrieval_s = retrieval.result()
+    else:
+        # A retrieval that already started cannot be interrupted; its result is dropped.
+        retrieval.cancel()
+        rag_docs = []
+        finished = retrieval.done() and not retrieval.cancelled() and retrieval.exception() is None
+        retrieval_s = retrieval.result()[1] if finished else routing_s
+
+    updated_state = state.copy()
+    updated_state["datasource"] = datasource
+    updated_state["speculation"] = speculation_metrics(datasource, routing_s, retrieval_s)
+    if datasource == "vectorstore":
+        updated_state["documents"] = rag_docs
+    return updated_state
+
+
+async def aroute_and_retrieve(state: GraphState) -> GraphState:
+    """
+    Async version of `route_and_retrieve`.
+    """
+    started = time.perf_counter()
+
+    async def timed_retrieval():
+        return await _aretrieve(state), time.perf_counter() - started
+
+    retrieval = asyncio.create_task(timed_retrieval())
+    try:
+        datasource = await aroute_question(state)
+    except BaseException:
+        retrieval.cancel()
+        raise
+    routing_s = time.perf_counter() - started
+
+    updated_state = state.copy()
+    if datasource == "vectorstore":
+        rag_docs, retrieval_s = await retrieval
+        updated_state["documents"] = rag_docs
+    elif retrieval.done() and not retrieval.cancelled() and retrieval.exception() is None:
+        retrieval_s = retrieval.result()[1]
+    else:
+        retrieval.cancel()
+        retrieval_s = routing_s
+
+    updated_state["datasource"] = datasource
+    updated_state["speculation"] = speculation_metrics(datasource, routing_s, retrieval_s)
+    return updated_state
+
+
+def decide_datasource(state: GraphState) -> str:
+    """
+       Routes on the `datasource` picked by `route_and_retrieve`
+
+       Args: state (GraphState)
+
+       returns: A string to denote the routed node
+    """
+    return state["datasource"]
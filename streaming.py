@@ -0,0 +1,123 @@
+from typing import AsyncIterator, List, Optional
+from budget import degrade_reason
+import asyncio
+import json
+import re
+
+
+ANSWER_TAG = "answer"  # tags the answer-generating chains, so grader/router tokens are not streamed
+
+NODE_NAMES = {"route", "retrieve", "grade_documents", "websearch", "generate", "generate_direct"}
+ANSWER_NODES = {"generate", "generate_direct"}
+
+# The node that runs after `generate` tells which way `hallucination_check` routed.
+GRADE_BY_NEXT_NODE = {"generate": "not supported", "websearch": "not useful", None: "useful"}
+
+
+async def stream_agent_events(agent, query: dict, config: dict, deadline_s: Optional[float] = None) -> AsyncIterator[dict]:
+    """
+    Run the agent and yield its progress as it happens.
+
+    With `deadline_s`, the run is stopped once that many seconds have passed, even inside a
+    hung retrieval, search or provider call, and reported as degraded by the deadline.
+
+    Yields dicts with an `event` and `data` key:
+        - "node": a node started or finished (`node`, `status`).
+        - "token": a piece of the answer from `generate`/`generate_direct` (`node`, `text`).
+        - "grade": how `hallucination_check` judged a generation (`result`).
+        - "done": the final answer (`generation`), with speculative retrieval its `speculation`
+          metrics, and `degraded` if the request ran out of budget (the answer is then the best
+          generation produced so far).
+    """
+    generation: Optional[str] = None
+    speculation: Optional[dict] = None
+    degraded: Optional[str] = None
+    awaiting_grade = False
+    deadline = asyncio.get_running_loop().time() + deadline_s if deadline_s is not None else None
+    events = agent.astream_events(query, config, version="v2")
+
+    try:
+        while True:
+            # The timeout only wraps the wait for the next event, never a `yield` to the consumer.
+            try:
+                async with asyncio.timeout_at(deadline):
+                    event = await anext(events)
+            except StopAsyncIteration:
+                break
+            kind = event["event"]
+            name = event.get("name")
+            node = event.get("metadata", {}).get("langgraph_node")
+
+            if kind == "on_chat_model_stream" and ANSWER_TAG in event.get("tags", []):
+                text = event["data"]["chunk"].content
+                if text:
+                    yield {"event": "token", "data": {"node": node, "text": text}}
+
+            elif kind == "on_chain_start" and name in NODE_NAMES and node == name:
+                if awaiting_grade:
+                    awaiting_grade = False
+                    yield {"event": "grade", "data": {"result": GRADE_BY_NEXT_NODE.get(name, "unknown")}}
+                yield {"event": "node", "data": {"node": name, "status": "start"}}
+
+            elif kind == "on_chain_end" and name in NODE_NAMES and node == name:
+                output = event["data"].get("output")
+                # Other nodes pass on the state, which may hold the previous turn's answer.
+                if name in ANSWER_NODES and isinstance(output, dict) and output.get("generation"):
+                    generation = output["generation"]
+                if name == "route" and isinstance(output, dict):
+                    speculation = output.get("speculation")
+                awaiting_grade = name == "generate"
+                yield {"event": "node", "data": {"node": name, "status": "end"}}
+    except Exception as e:
+        degraded = degrade_reason(e)
+        if degraded is None:
+            raise
+        awaiting_grade = False
+    finally:
+        await events.aclose()
+
+    if awaiting_grade:
+        yield {"event": "grade", "data": {"result": GRADE_BY_NEXT_NODE[None]}}
+    done = {"generation": generation or "No output was generated."}
+    if speculation is not None:
+        done["speculation"] = speculation
+    if degraded is not None:
+        done["degraded"] = degraded
+    yield {"event": "done", "data": done}
+
+
+def format_sse(event: dict) -> str:
+    return f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+
+
+# End of a sentence (punctuation, closing quotes/brackets, whitespace) or a line break.
+SENTENCE_END = re.compile(r"(?<=[.!?])[\"')\]]*\s+|\n+")
+
+
+class SentenceChunker:
+    """
+    Cuts streamed answer text into complete sentences, e.g. for text-to-speech.
+
+    `push` returns the sentences completed by a piece of text; `flush` returns whatever is
+    left once the stream ended. Sentences shorter than `min_chars` are joined with the
+    next one, so abbreviations and one-word fragments are not spoken on their own.
+    """
+
+    def __init__(self, min_chars: int = 20):
+        self.min_chars = min_chars
+        self.buffer = ""
+
+    def push(self, text: str) -> List[str]:
+        self.buffer += text
+        sentences = []
+        start = 0
+        for match in SENTENCE_END.finditer(self.buffer):
+            if match.end() - start >= self.min_chars:
+                sentences.append(self.buffer[start:match.end()].strip())
+                start = match.end()
+        self.buffer = self.buffer[start:]
+        return [sentence for sentence in sentences if sentence]
+
+    def flush(self) -> Optional[str]:
+        rest, self.buffer = self.buffer.strip(), ""
+        return rest or None
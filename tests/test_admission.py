@@ -0,0 +1,123 @@
+from admission import AdmissionController, Overloaded
+import asyncio
+import pytest
+
+
+def test_requests_wait_in_the_queue_for_a_free_slot():
+    admission = AdmissionController(max_concurrent=1, max_queue=2, queue_timeout=1.0)
+
+    async def run():
+        first = await admission.acquire()
+        waiter = asyncio.create_task(admission.acquire())
+        await asyncio.sleep(0.01)
+        assert (admission.in_flight, admission.waiting) == (1, 1)
+        first.release()
+        second = await waiter
+        assert (admission.in_flight, admission.waiting) == (1, 0)
+        second.release()
+
+    asyncio.run(run())
+    assert admission.in_flight == 0
+    assert admission.rejected == 0
+
+
+def test_full_queue_sheds_right_away_with_retry_after():
+    admission = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=1.0)
+    admission.average_s = 4.0
+
+    async def run():
+        await admission.acquire()
+        waiter = asyncio.create_task(admission.acquire())
+        await asyncio.sleep(0.01)
+        with pytest.raises(Overloaded) as rejected:
+            await asyncio.wait_for(admission.acquire(), timeout=0.1)
+        waiter.cancel()
+        return rejected.value
+
+    rejected = asyncio.run(run())
+    assert rejected.retry_after == 8  # 4s average, one waiting ahead plus this request, one slot
+    assert admission.rejected == 1
+
+
+def test_queue_timeout_sheds_with_retry_after():
+    admission = AdmissionController(max_concurrent=1, max_queue=4, queue_timeout=0.05)
+
+    async def run():
+        await admission.acquire()
+        with pytest.raises(Overloaded) as rejected:
+            await admission.acquire()
+        return rejected.value
+
+    rejected = asyncio.run(run())
+    assert rejected.retry_after >= 1
+    assert admission.waiting == 0
+    assert admission.rejected == 1
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    admission = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=1.0)
+
+    async def run():
+        first = await admission.acquire()
+        waiter = asyncio.create_task(admission.acquire())
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert admission.waiting == 0
+        first.release()
+        # The queue has room again and the slot is free.
+        (await asyncio.wait_for(admission.acquire(), timeout=0.1)).release()
+
+    asyncio.run(run())
+    assert admission.in_flight == 0
+
+
+def test_slot_is_released_when_a_stream_is_cancelled():
+    admission = AdmissionController(max_concurrent=1, max_queue=0, queue_timeout=0.0)
+
+    async def run():
+        # Same shape as `/ask/stream`: admitted first, released when the event stream ends.
+        slot = await admission.acquire()
+
+        async def events():
+            try:
+                while True:
+                    yield "token"
+                    await asyncio.sleep(0.01)
+            finally:
+                slot.release()
+
+        async def consume():
+            async for _ in events():
+                pass
+
+        client = asyncio.create_task(consume())
+        await asyncio.sleep(0.05)
+        client.cancel()  # the client went away mid-stream
+        await asyncio.gather(client, return_exceptions=True)
+        slot.release()  # the response's background task releases it again; nothing happens
+        assert admission.in_flight == 0
+        (await admission.acquire()).release()
+
+    asyncio.run(run())
+    assert admission.in_flight == 0
+    assert admission.rejected == 0
+
+
+def test_admit_releases_the_slot_on_cancellation():
+    admission = AdmissionController(max_concurrent=1, max_queue=0, queue_timeout=0.0)
+
+    async def handler():
+        async with admission.admit():
+            await asyncio.sleep(10)
+
+    async def run():
+        request = asyncio.create_task(handler())
+        await asyncio.sleep(0.01)
+        assert admission.in_flight == 1
+        request.cancel()
+        await asyncio.gather(request, return_exceptions=True)
+        (await admission.acquire()).release()
+
+    asyncio.run(run())
+    assert admission.in_flight == 0
@@ -0,0 +1,93 @@
+from typing import List, TypedDict
+from langchain_core.language_models import FakeListChatModel
+from langgraph.errors import GraphRecursionError
+from langgraph.graph import END, StateGraph
+from budget import Budget, BudgetExceeded, BudgetTracker, budget_config, degrade_reason
+from streaming import stream_agent_events
+import asyncio
+import pytest
+
+
+class State(TypedDict, total=False):
+    question: str
+    generation: str
+    grades: List[str]
+
+
+def loop_graph(model):
+    """
+    Generate an answer, grade it with another LLM call, and start over: it only ends when the budget does.
+    """
+
+    def generate(state: State) -> dict:
+        return {"generation": model.invoke(state["question"]).content}
+
+    def grade_documents(state: State) -> dict:
+        return {"grades": [*state.get("grades", []), model.invoke(state["generation"]).content]}
+
+    workflow = StateGraph(State)
+    workflow.add_node("generate", generate)
+    workflow.add_node("grade_documents", grade_documents)
+    workflow.set_entry_point("generate")
+    workflow.add_edge("generate", "grade_documents")
+    workflow.add_conditional_edges("grade_documents", lambda state: "generate" if len(state["grades"]) < 100 else END)
+    return workflow.compile()
+
+
+def run(budget: Budget, responses: List[str]):
+    tracker = BudgetTracker(budget)
+    graph = loop_graph(FakeListChatModel(responses=responses))
+    with pytest.raises(Exception) as error:
+        graph.invoke({"question": "What is SalarySe?"}, budget_config({}, tracker))
+    return tracker, error.value
+
+
+def test_llm_call_limit_stops_at_the_next_call():
+    tracker, error = run(Budget(max_llm_calls=3, max_tokens=1_000_000, max_steps=100), ["An answer.", "no"])
+
+    assert isinstance(error, BudgetExceeded)
+    assert degrade_reason(error) == "llm_calls"
+    assert tracker.llm_calls == 3
+
+
+def test_token_limit_stops_at_the_next_node():
+    # 80 characters count as 20 tokens without usage data from the provider.
+    tracker, error = run(Budget(max_llm_calls=100, max_tokens=10, max_steps=100), ["x" * 80])
+
+    assert degrade_reason(error) == "tokens"
+    assert tracker.tokens == 20
+    assert tracker.llm_calls == 1  # `grade_documents` was stopped before its call
+
+
+def test_step_limit_stops_the_graph():
+    tracker, error = run(Budget(max_llm_calls=100, max_tokens=1_000_000, max_steps=4), ["An answer.", "no"])
+
+    assert isinstance(error, GraphRecursionError)
+    assert degrade_reason(error) == "steps"
+
+
+def test_stream_returns_the_best_generation_so_far_when_degraded():
+    tracker = BudgetTracker(Budget(max_llm_calls=3, max_tokens=1_000_000, max_steps=100))
+    graph = loop_graph(FakeListChatModel(responses=["First answer.", "no", "Second answer.", "no"]))
+
+    async def collect():
+        return [event async for event in stream_agent_events(graph, {"question": "What is SalarySe?"}, budget_config({}, tracker))]
+
+    done = asyncio.run(collect())[-1]
+
+    # The second `generate` finished before its grading call ran out of budget.
+    assert done == {"event": "done", "data": {"generation": "Second answer.", "degraded": "llm_calls"}}
+
+
+def test_stream_deadline_is_reported_as_degraded():
+    tracker = BudgetTracker(Budget(max_llm_calls=100, max_tokens=1_000_000, max_steps=100))
+    # Streamed a character every 20ms: the first answer takes 0.2s, the second is cut off.
+    graph = loop_graph(FakeListChatModel(responses=["An answer.", "no"], sleep=0.02))
+
+    async def collect():
+        return [event async for event in stream_agent_events(graph, {"question": "What is SalarySe?"}, budget_config({}, tracker), deadline_s=0.32)]
+
+    done = asyncio.run(collect())[-1]
+
+    assert done["data"]["degraded"] == "deadline"
+    assert done["data"]["generation"] == "An answer."
@@ -0,0 +1,91 @@
+from langgraph.checkpoint.base import empty_checkpoint
+from checkpointer import BoundedSqliteSaver
+import asyncio
+import time
+
+
+def thread(thread_id: str, checkpoint_id: str = None) -> dict:
+    configurable = {"thread_id": thread_id, "checkpoint_ns": ""}
+    if checkpoint_id:
+        configurable["checkpoint_id"] = checkpoint_id
+    return {"configurable": configurable}
+
+
+def put(saver: BoundedSqliteSaver, config: dict, checkpoint_id: str, step: int = 0, **channel_values) -> dict:
+    checkpoint = {**empty_checkpoint(), "id": checkpoint_id, "channel_values": channel_values}
+    return saver.put(config, checkpoint, {"source": "loop", "step": step, "writes": None, "parents": {}}, {})
+
+
+def test_put_then_get_tuple_round_trip_with_pending_writes(tmp_path):
+    saver = BoundedSqliteSaver(str(tmp_path / "checkpoints.sqlite"))
+
+    first = put(saver, thread("t"), "0001", question="What is SalarySe?")
+    second = put(saver, first, "0002", step=1, question="What is SalarySe?", generation="A salary app.")
+    saver.put_writes(second, [("generation", "A salary app."), ("documents", ["doc"])], task_id="task-1")
+
+    latest = saver.get_tuple(thread("t"))
+
+    assert latest.config == thread("t", "0002")
+    assert latest.parent_config == thread("t", "0001")
+    assert latest.checkpoint["channel_values"] == {"question": "What is SalarySe?", "generation": "A salary app."}
+    assert latest.metadata["step"] == 1
+    assert latest.pending_writes == [("task-1", "generation", "A salary app."), ("task-1", "documents", ["doc"])]
+    assert saver.get_tuple(thread("t", "0001")).checkpoint["channel_values"] == {"question": "What is SalarySe?"}
+    assert saver.get_tuple(thread("other")) is None
+    assert asyncio.run(saver.aget_tuple(thread("t"))).config == latest.config
+
+
+def test_list_is_newest_first_with_before_and_limit(tmp_path):
+    saver = BoundedSqliteSaver(str(tmp_path / "checkpoints.sqlite"))
+    config = thread("t")
+    for step in range(5):
+        config = put(saver, config, f"000{step}", step=step)
+
+    def ids(**kwargs):
+        return [c.config["configurable"]["checkpoint_id"] for c in saver.list(thread("t"), **kwargs)]
+
+    assert ids() == ["0004", "0003", "0002", "0001", "0000"]
+    assert ids(before=thread("t", "0003"), limit=2) == ["0002", "0001"]
+    assert ids(filter={"step": 1}, limit=1) == ["0001"]
+    assert ids(limit=0) == []
+
+
+def test_only_the_newest_checkpoints_of_a_thread_are_kept(tmp_path):
+    saver = BoundedSqliteSaver(str(tmp_path / "checkpoints.sqlite"), max_checkpoints_per_thread=3)
+    config = thread("t")
+    for step in range(6):
+        config = put(saver, config, f"000{step}", step=step)
+        saver.put_writes(config, [("generation", f"answer {step}")], task_id="task")
+    put(saver, thread("other"), "0000")
+
+    assert [c.config["configurable"]["checkpoint_id"] for c in saver.list(thread("t"))] == ["0005", "0004", "0003"]
+    assert saver._conn.execute("SELECT COUNT(*) FROM writes WHERE thread_id = 't'").fetchone()[0] == 3
+    assert saver.get_tuple(thread("other")) is not None
+
+
+def test_idle_threads_expire(tmp_path):
+    saver = BoundedSqliteSaver(str(tmp_path / "checkpoints.sqlite"), thread_ttl=0.1)
+    put(saver, thread("idle"), "0000")
+    time.sleep(0.2)
+    put(saver, thread("active"), "0000")
+
+    stats = saver.compact()
+
+    assert stats["expired_threads"] == 1
+    assert saver.get_tuple(thread("idle")) is None
+    assert saver.get_tuple(thread("active")) is not None
+
+
+def test_compaction_drops_least_recently_used_threads_down_to_max_db_bytes(tmp_path):
+    saver = BoundedSqliteSaver(str(tmp_path / "checkpoints.sqlite"), max_db_bytes=256 * 1024)
+    for i in range(40):
+        put(saver, thread(f"t{i}"), "0000", history="x" * 20_000)
+    saver.get_tuple(thread("t0"))  # used again, now the most recent
+
+    stats = saver.compact()
+
+    assert stats["evicted_threads"] > 0
+    assert stats["db_bytes"] <= saver.max_db_bytes
+    assert saver.get_tuple(thread("t0")) is not None
+    assert saver.get_tuple(thread("t1")) is None
+    assert saver.get_tuple(thread("t39")) is not None
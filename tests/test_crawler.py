@@ -0,0 +1,251 @@
+from typing import Callable, Dict, List
+from langchain.schema import Document
+from chunking import ChunkedPage, ChunkingStats, content_hash, html_to_document
+from crawler import Crawler
+import ingestion
+import asyncio
+import httpx
+
+
+SITE = "https://example.com"
+
+
+def page(*links: str, **headers) -> Callable:
+    html = "<html><body>" + "".join(f'<a href="{link}">{link}</a>' for link in links) + "</body></html>"
+    return lambda request: httpx.Response(200, html=html, headers=headers)
+
+
+def status(code: int) -> Callable:
+    return lambda request: httpx.Response(code)
+
+
+def redirect(location: str) -> Callable:
+    return lambda request: httpx.Response(301, headers={"location": location})
+
+
+class Site:
+    """
+    Local stand-in for a web site: urls map to handlers, and every request is recorded.
+    """
+
+    def __init__(self, pages: Dict[str, Callable]):
+        self.pages = pages
+        self.requests: List[httpx.Request] = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        handler = self.pages.get(str(request.url))
+        return handler(request) if handler else httpx.Response(404)
+
+    def requested(self, url: str) -> int:
+        return sum(1 for request in self.requests if str(request.url) == url)
+
+
+def crawl(site: Site, start: str = f"{SITE}/", **kwargs):
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(site), follow_redirects=True) as client:
+            crawler = Crawler([start], client=client, concurrency=2, **kwargs)
+            return crawler, [result async for result in crawler.crawl()]
+
+    return asyncio.run(run())
+
+
+def test_unchanged_page_answers_304_and_its_links_are_followed():
+    def home(request):
+        if request.headers.get("if-none-match") == '"v1"':
+            return httpx.Response(304)
+        return page()(request)
+
+    site = Site({f"{SITE}/": home, f"{SITE}/a": page()})
+    known = {f"{SITE}/": {"etag": '"v1"', "last_modified": "Mon, 01 Jan 2024 00:00:00 GMT", "links": [f"{SITE}/a"]}}
+
+    crawler, results = crawl(site, known=known)
+
+    home_result = next(r for r in results if r.url == f"{SITE}/")
+    assert home_result.not_modified
+    assert home_result.etag == '"v1"'
+    assert site.requests[0].headers["if-modified-since"] == "Mon, 01 Jan 2024 00:00:00 GMT"
+    assert f"{SITE}/a" in {r.url for r in results}
+
+
+def test_redirect_is_reported_under_the_target_once():
+    site = Site({
+        f"{SITE}/": page("/old", "/new"),
+        f"{SITE}/old": redirect(f"{SITE}/new"),
+        f"{SITE}/new": page("/new"),
+    })
+
+    crawler, results = crawl(site)
+
+    assert sorted(r.url for r in results) == [f"{SITE}/", f"{SITE}/new"]
+
+
+def test_redirect_target_is_not_fetched_again_when_linked_later():
+    site = Site({
+        f"{SITE}/old": redirect(f"{SITE}/new"),
+        f"{SITE}/new": page("/new"),
+    })
+
+    crawler, results = crawl(site, start=f"{SITE}/old")
+
+    assert [(r.url, r.requested_url) for r in results] == [(f"{SITE}/new", f"{SITE}/old")]
+    assert site.requested(f"{SITE}/new") == 1
+
+
+def test_known_redirect_sends_the_targets_validators():
+    def new(request):
+        if request.headers.get("if-none-match") == '"v2"':
+            return httpx.Response(304)
+        return page()(request)
+
+    site = Site({f"{SITE}/old": redirect(f"{SITE}/new"), f"{SITE}/new": new})
+    known = {f"{SITE}/new": {"etag": '"v2"', "redirected_from": [f"{SITE}/old"]}}
+
+    crawler, results = crawl(site, start=f"{SITE}/old", known=known)
+
+    assert [(r.url, r.not_modified) for r in results] == [(f"{SITE}/new", True)]
+
+
+def test_redirect_off_the_site_is_skipped():
+    site = Site({
+        f"{SITE}/": page("/away"),
+        f"{SITE}/away": redirect("https://other.example/landing"),
+        "https://other.example/landing": page("/more"),
+    })
+
+    crawler, results = crawl(site)
+
+    assert [r.url for r in results] == [f"{SITE}/"]
+    assert crawler.skipped == {f"{SITE}/away"}
+    assert crawler.complete
+
+
+def test_gone_and_failed_pages_are_told_apart():
+    site = Site({
+        f"{SITE}/": page("/missing", "/removed", "/broken"),
+        f"{SITE}/missing": status(404),
+        f"{SITE}/removed": status(410),
+        f"{SITE}/broken": status(500),
+    })
+
+    crawler, results = crawl(site)
+
+    assert crawler.gone == {f"{SITE}/missing", f"{SITE}/removed"}
+    assert crawler.failed == {f"{SITE}/broken"}
+    assert not crawler.complete
+
+
+def test_depth_limit():
+    site = Site({f"{SITE}/": page("/1"), f"{SITE}/1": page("/2"), f"{SITE}/2": page("/3"), f"{SITE}/3": page()})
+
+    crawler, results = crawl(site, max_depth=1)
+
+    assert sorted(r.url for r in results) == [f"{SITE}/", f"{SITE}/1"]
+    assert site.requested(f"{SITE}/2") == 0
+    assert crawler.complete
+
+
+def test_page_limit_makes_the_crawl_incomplete():
+    site = Site({f"{SITE}/": page("/a", "/b", "/c"), f"{SITE}/a": page(), f"{SITE}/b": page(), f"{SITE}/c": page()})
+
+    crawler, results = crawl(site, max_pages=2)
+
+    assert len(results) == 2
+    assert crawler.truncated
+    assert not crawler.complete
+
+
+class FakePipeline:
+    """
+    In-process stand-in for the `ChunkingPipeline`: one chunk per page, no tokenizer download.
+    """
+
+    def __init__(self, workers=None):
+        self.window = 4
+        self.stats = ChunkingStats()
+
+    async def achunk(self, url: str, content: str, known_hash=None) -> ChunkedPage:
+        document = html_to_document(url, content)
+        page_hash = content_hash(document.page_content)
+        chunks = None if page_hash == known_hash else [Document(page_content=document.page_content, metadata=document.metadata)]
+        result = ChunkedPage(page=document, page_hash=page_hash, chunks=chunks, tokens=0)
+        self.stats.record(result)
+        return result
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+class FakeStore:
+    """
+    Local stand-in for Chroma, keeping chunks in a dict.
+    """
+
+    def __init__(self):
+        self.chunks: Dict[str, Document] = {}
+
+    def get(self, include=None) -> dict:
+        return {"ids": list(self.chunks)}
+
+    def add_documents(self, documents: List[Document], ids: List[str]) -> None:
+        self.chunks.update(zip(ids, documents))
+
+    def delete(self, ids: List[str]) -> None:
+        for i in ids:
+            self.chunks.pop(i, None)
+
+
+def ingest_twice(tmp_path, monkeypatch, first: Site, second: Site, **crawler_kwargs) -> ingestion.Manifest:
+    """
+    Ingest the `first` version of the site, then crawl the `second` one on top of it.
+    """
+    monkeypatch.setattr(ingestion, "ChunkingPipeline", FakePipeline)
+    monkeypatch.setattr(ingestion, "default_text_splitter", lambda: None)  # pages come chunked
+    monkeypatch.setattr(ingestion, "db_dir", str(tmp_path))
+    monkeypatch.setattr(ingestion, "store_version_path", str(tmp_path / "store_version"))
+    store = FakeStore()
+    manifest_path = str(tmp_path / "manifest.json")
+
+    async def run(site: Site, **kwargs):
+        async with httpx.AsyncClient(transport=httpx.MockTransport(site), follow_redirects=True) as client:
+            await ingestion.crawl_and_ingest(
+                [f"{SITE}/"], store, manifest=ingestion.Manifest(manifest_path),
+                index_path=str(tmp_path / "bm25.json"), client=client, concurrency=2, **kwargs
+            )
+
+    asyncio.run(run(first))
+    asyncio.run(run(second, **crawler_kwargs))
+    return ingestion.Manifest(manifest_path)
+
+
+def full_site() -> Site:
+    return Site({f"{SITE}/": page("/a", "/b", "/c"), f"{SITE}/a": page(), f"{SITE}/b": page("/b"), f"{SITE}/c": page("/c")})
+
+
+def test_only_gone_pages_are_pruned_after_an_incomplete_crawl(tmp_path, monkeypatch):
+    second = Site({
+        f"{SITE}/": page("/a", "/b"),  # /c is no longer linked, but the crawl is incomplete
+        f"{SITE}/a": status(404),
+        f"{SITE}/b": status(500),
+    })
+
+    manifest = ingest_twice(tmp_path, monkeypatch, full_site(), second)
+
+    assert sorted(manifest.pages) == [f"{SITE}/", f"{SITE}/b", f"{SITE}/c"]
+
+
+def test_unlinked_pages_are_pruned_after_a_complete_crawl(tmp_path, monkeypatch):
+    second = Site({f"{SITE}/": page("/a"), f"{SITE}/a": page()})
+
+    manifest = ingest_twice(tmp_path, monkeypatch, full_site(), second)
+
+    assert sorted(manifest.pages) == [f"{SITE}/", f"{SITE}/a"]
+
+
+def test_pages_beyond_the_page_limit_keep_their_chunks(tmp_path, monkeypatch):
+    manifest = ingest_twice(tmp_path, monkeypatch, full_site(), full_site(), max_pages=2)
+
+    assert sorted(manifest.pages) == [f"{SITE}/", f"{SITE}/a", f"{SITE}/b", f"{SITE}/c"]
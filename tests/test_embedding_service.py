@@ -0,0 +1,73 @@
+from typing import List
+from langchain_core.embeddings import Embeddings
+from embedding_service import BatchingEmbeddings
+import asyncio
+import threading
+import time
+
+
+class SlowEmbeddings(Embeddings):
+    """
+    Local stand-in for the embedding model: every call takes `latency_s` and is recorded.
+    """
+
+    def __init__(self, latency_s: float = 0.1):
+        self.latency_s = latency_s
+        self.calls: List[List[str]] = []
+        self.started = threading.Event()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls.append(list(texts))
+        self.started.set()
+        time.sleep(self.latency_s)
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def test_concurrent_queries_share_a_batch_and_the_cache():
+    model = SlowEmbeddings(latency_s=0.05)
+    embeddings = BatchingEmbeddings(model, max_wait=0.05)
+
+    async def run():
+        return await embeddings.aembed_queries(["a", "bb", "a"])
+
+    vectors = asyncio.run(run())
+
+    assert vectors == [[1.0, 1.0], [2.0, 1.0], [1.0, 1.0]]
+    assert embeddings.embed_query("bb") == [2.0, 1.0]
+    assert embeddings.hits == 1
+
+
+def test_caller_cancelled_while_queued_does_not_stop_the_batcher():
+    model = SlowEmbeddings(latency_s=0.01)
+    embeddings = BatchingEmbeddings(model, max_wait=0.2)
+
+    async def run():
+        query = asyncio.create_task(embeddings.aembed_query("cancelled"))
+        await asyncio.sleep(0.05)  # queued, the batch is still filling
+        query.cancel()
+        await asyncio.sleep(0.3)
+        return await asyncio.wait_for(embeddings.aembed_query("next"), timeout=2)
+
+    assert asyncio.run(run()) == [4.0, 1.0]
+    assert embeddings._worker.is_alive()
+    assert ["cancelled"] not in model.calls
+
+
+def test_caller_cancelled_during_embedding_does_not_stop_the_batcher():
+    model = SlowEmbeddings(latency_s=0.2)
+    embeddings = BatchingEmbeddings(model, max_wait=0.0)
+
+    async def run():
+        query = asyncio.create_task(embeddings.aembed_query("cancelled"))
+        await asyncio.to_thread(model.started.wait, 2)  # the model is working on the batch
+        query.cancel()
+        await asyncio.sleep(0.3)
+        return await asyncio.wait_for(embeddings.aembed_query("next"), timeout=2)
+
+    assert asyncio.run(run()) == [4.0, 1.0]
+    assert embeddings._worker.is_alive()
+    # The finished vector still went to the cache.
+    assert embeddings.embed_query("cancelled") == [9.0, 1.0]
@@ -0,0 +1,149 @@
+from concurrent.futures import ThreadPoolExecutor
+from disk_cache import DiskCache
+from web_search_cache import CachedWebSearch
+import asyncio
+import threading
+import time
+import pytest
+
+
+class FakeSearch:
+    """
+    Local stand-in for the search backend: counts its calls, can be slow and can fail.
+    """
+
+    def __init__(self, latency_s: float = 0.0, error: Exception = None, answer=None):
+        self.latency_s = latency_s
+        self.error = error
+        self.answer = answer
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _result(self, query: str):
+        with self._lock:
+            self.calls += 1
+        if self.error is not None:
+            raise self.error
+        if self.answer is not None:
+            return self.answer
+        return [{"url": "https://example.com", "content": f"result for {query}"}]
+
+    def invoke(self, query: str):
+        time.sleep(self.latency_s)
+        return self._result(query)
+
+    async def ainvoke(self, query: str):
+        await asyncio.sleep(self.latency_s)
+        return self._result(query)
+
+
+def searcher(tmp_path, backend, ttl=None, max_attempts=3) -> CachedWebSearch:
+    search = CachedWebSearch(backend, DiskCache(str(tmp_path / "search.sqlite"), ttl=ttl), max_attempts=max_attempts)
+    search._backoff = lambda attempt: 0
+    return search
+
+
+def test_miss_then_hit(tmp_path):
+    backend = FakeSearch()
+    search = searcher(tmp_path, backend)
+
+    first = search.search("What is SalarySe?")
+    second = search.search("  what is salaryse ")
+
+    assert first == second
+    assert backend.calls == 1
+    assert (search.hits, search.misses) == (1, 1)
+
+
+def test_async_miss_then_hit(tmp_path):
+    backend = FakeSearch()
+    search = searcher(tmp_path, backend)
+
+    async def run():
+        return await search.asearch("salary advance"), await search.asearch("Salary advance?")
+
+    first, second = asyncio.run(run())
+
+    assert first == second
+    assert backend.calls == 1
+
+
+def test_ttl_expiry(tmp_path):
+    backend = FakeSearch()
+    search = searcher(tmp_path, backend, ttl=0.05)
+
+    search.search("salary advance")
+    time.sleep(0.1)
+    search.search("salary advance")
+
+    assert backend.calls == 2
+
+
+def test_concurrent_searches_share_one_call(tmp_path):
+    backend = FakeSearch(latency_s=0.2)
+    search = searcher(tmp_path, backend)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(search.search, ["salary advance"] * 8))
+
+    assert backend.calls == 1
+    assert all(result == results[0] for result in results)
+
+
+def test_concurrent_async_searches_share_one_call(tmp_path):
+    backend = FakeSearch(latency_s=0.2)
+    search = searcher(tmp_path, backend)
+
+    async def run():
+        return await asyncio.gather(*(search.asearch("salary advance") for _ in range(8)))
+
+    results = asyncio.run(run())
+
+    assert backend.calls == 1
+    assert all(result == results[0] for result in results)
+
+
+def test_backend_error_reaches_every_waiting_caller(tmp_path):
+    backend = FakeSearch(latency_s=0.1, error=ValueError("search failed"))
+    search = searcher(tmp_path, backend, max_attempts=2)
+
+    async def run():
+        return await asyncio.gather(*(search.asearch("salary advance") for _ in range(4)), return_exceptions=True)
+
+    results = asyncio.run(run())
+
+    assert all(isinstance(result, ValueError) for result in results)
+    assert backend.calls == 2  # one search, retried once
+    with pytest.raises(ValueError):
+        search.search("salary advance")
+    assert backend.calls == 4  # failures are not cached
+
+
+def test_error_string_is_not_cached(tmp_path):
+    backend = FakeSearch(answer="HTTPError('429 Too Many Requests')")
+    search = searcher(tmp_path, backend, max_attempts=1)
+
+    assert search.search("salary advance") == backend.answer
+    search.search("salary advance")
+
+    assert backend.calls == 2
+
+
+def test_cancelled_leader_hands_over_to_waiting_caller(tmp_path):
+    backend = FakeSearch(latency_s=0.2)
+    search = searcher(tmp_path, backend)
+
+    async def run():
+        leader = asyncio.create_task(search.asearch("salary advance"))
+        await asyncio.sleep(0.05)
+        follower = asyncio.create_task(search.asearch("salary advance"))
+        await asyncio.sleep(0.05)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    result = asyncio.run(run())
+
+    assert result == [{"url": "https://example.com", "content": "result for salary advance"}]
+    assert backend.calls == 1  # the cancelled search never finished; the follower ran its own
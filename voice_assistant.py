@@ -1,6 +1,10 @@
-from graphbuilder import agent
+from graphbuilder import agent, init_checkpointer
+import state_functions
+from budget import Budget, BudgetTracker, budget_config
+from streaming import ANSWER_NODES, SentenceChunker, stream_agent_events
 import asyncio
-from livekit.agents import AutoSubscribe, JobContext, WorkerOptions, cli, llm
+import uuid
+from livekit.agents import AutoSubscribe, JobContext, JobProcess, WorkerOptions, cli, llm
 from livekit.agents.voice_assistant import VoiceAssistant
 from livekit.plugins import silero, deepgram, cartesia
 from langchain_ollama import ChatOllama
@@ -8,49 +12,141 @@ from langchain_ollama import ChatOllama
 # Initialize LangChain Ollama model
 llama_model = ChatOllama(model="llama3.1", temperature=0.6)
 
+# Spoken answers have to start quickly; a voice turn gets less time than an API request.
+voice_budget = Budget(max_llm_calls=8, max_tokens=20_000, deadline_s=15.0, max_steps=12)
 
-class AssistantLogic:
-    def __init__(self):
+
+def last_user_text(chat_ctx: llm.ChatContext) -> str:
+    for message in reversed(chat_ctx.messages):
+        if message.role == "user":
+            content = message.content
+            if isinstance(content, list):
+                content = " ".join(part for part in content if isinstance(part, str))
+            return (content or "").strip()
+    return ""
+
+
+class AssistantLogic(llm.LLM):
+    """
+    LiveKit LLM answering with the agent graph.
+
+    The graph runs on the worker's event loop (no blocking call), and its answer is
+    streamed to TTS sentence by sentence as the tokens arrive.
+
+    Args:
+        thread_id (str): Conversation thread of the graph checkpointer.
+    """
+
+    def __init__(self, thread_id: str = "voice"):
+        super().__init__()
+        self.thread_id = thread_id
         self._llama_model = llama_model
 
-    def invoke(self, user_input: str):
-        response = agent.invoke({"question": user_input, "thread_id": "1"})
-        if response:
-            return response
-        else:
-            return self._llama_model.generate(user_input)
-
-    def on(self, event_name, callback=None):
-        def metrics_callback(metrics=None):
-            print("Metrics collected:", metrics)
-            if callback:
-                if metrics is not None:
-                    callback(metrics)
-                else:
-                    callback()
-        return metrics_callback
+    def chat(self, *, chat_ctx: llm.ChatContext, fnc_ctx=None, temperature=None, n=None, parallel_tool_calls=None) -> "AssistantStream":
+        return AssistantStream(self, chat_ctx=chat_ctx, fnc_ctx=fnc_ctx)
+
+
+class AssistantStream(llm.LLMStream):
+    """
+    One answer of `AssistantLogic`.
+
+    Every complete sentence of the generation is sent as a `ChatChunk` right away, so
+    speaking starts after the first sentence. When the user barges in, the voice assistant
+    closes the stream, which cancels the task running the graph and with it the graph run.
+
+    A spoken sentence cannot be taken back, so the run stops once the first answer has
+    been generated instead of going through the grading and regeneration loop.
+    """
+
+    def __init__(self, assistant: AssistantLogic, *, chat_ctx: llm.ChatContext, fnc_ctx=None):
+        super().__init__(assistant, chat_ctx=chat_ctx, fnc_ctx=fnc_ctx)
+        self._assistant = assistant
+        self._request_id = uuid.uuid4().hex
+        self._chunker = SentenceChunker()
+        self._spoken = False
+
+    def _send(self, text: str) -> None:
+        self._spoken = True
+        delta = llm.ChoiceDelta(role="assistant", content=f"{text} ")
+        self._event_ch.send_nowait(llm.ChatChunk(request_id=self._request_id, choices=[llm.Choice(delta=delta, index=0)]))
+
+    def _push(self, text: str) -> None:
+        for sentence in self._chunker.push(text):
+            self._send(sentence)
+
+    def _flush(self) -> None:
+        rest = self._chunker.flush()
+        if rest:
+            self._send(rest)
+
+    async def _main_task(self) -> None:
+        question = last_user_text(self._chat_ctx)
+        if not question:
+            return
+
+        config = {"configurable": {"thread_id": self._assistant.thread_id}}
+        tracker = BudgetTracker(voice_budget)
+        events = stream_agent_events(agent, {"question": question}, budget_config(config, tracker), deadline_s=voice_budget.deadline_s)
+        generation = None
+        try:
+            async for event in events:
+                if event["event"] == "token":
+                    self._push(event["data"]["text"])
+                elif event["event"] == "node" and event["data"]["status"] == "end" and event["data"]["node"] in ANSWER_NODES:
+                    break
+                elif event["event"] == "done":
+                    generation = event["data"]["generation"]
+        finally:
+            # Also reached when the stream is closed on barge-in: stops the graph run.
+            await events.aclose()
+
+        self._flush()
+        if not self._spoken and generation and generation != "No output was generated.":
+            # The answer did not stream (e.g. the request ran out of budget first).
+            self._push(generation)
+            self._flush()
+
+        if not self._spoken:
+            async for chunk in self._assistant._llama_model.astream(question):
+                self._push(chunk.content)
+            self._flush()
+
+
+def prewarm(proc: JobProcess):
+    """
+    Runs in every worker process before it takes a job: open the checkpointer, load the models,
+    the vector store and the VAD, so the first question of a call does not wait for them.
+    """
+    init_checkpointer()
+    state_functions.init()
+    proc.userdata["vad"] = silero.VAD.load()
+
 
 async def entrypoint(ctx: JobContext):
+    # Warm the LLM backends and the embedding model while the room connects.
+    warm_up = asyncio.create_task(state_functions.awarm_up())
     await ctx.connect(auto_subscribe=AutoSubscribe.AUDIO_ONLY)
-    
+
     initial_ctx = llm.ChatContext().append(
         role="system",
         text=("You are an AI assistant representing SalarySe, specializing in answering questions about our company, \
             products, and services from our perspective. Speak as if you are part of the company, using 'we' to represent SalarySe."),
     )
-    assistant_logic = AssistantLogic()
-    
+    assistant_logic = AssistantLogic(thread_id=f"voice-{ctx.room.name}")
+
     assistant = VoiceAssistant(
-        vad=silero.VAD.load(),                # Optional, if not using VAD
+        vad=ctx.proc.userdata["vad"],         # Loaded in prewarm
         stt=deepgram.STT(),                   # Use custom STT object
         llm=assistant_logic,                  # Your custom logic
         tts=cartesia.TTS(),                   # Use custom TTS object
-        chat_ctx=initial_ctx                  # Use the initial context dictionary
+        chat_ctx=initial_ctx,                 # Use the initial context dictionary
+        allow_interruptions=True,             # Barge-in cancels the running answer
     )
-    
+
     assistant.start(ctx.room)
     await asyncio.sleep(1)
     await assistant.say("How can I help you today?", allow_interruptions=True)
+    await warm_up
 
 if __name__ == "__main__":
-    cli.run_app(WorkerOptions(entrypoint_fnc=entrypoint))
\ No newline at end of file
+    cli.run_app(WorkerOptions(entrypoint_fnc=entrypoint, prewarm_fnc=prewarm))
@@ -0,0 +1,165 @@
+from concurrent.futures import Future
+from typing import Dict, List
+from answer_cache import normalize_question
+from disk_cache import DiskCache
+import asyncio
+import random
+import threading
+import time
+
+
+class _Abandoned(Exception):
+    """
+    The caller running a search was cancelled; one of the callers waiting for it takes over.
+    """
+
+
+class CachedWebSearch:
+    """
+    Web search front-end with a disk cache and single-flight request coalescing.
+
+    Queries are normalized (case, whitespace, trailing punctuation) before lookup. Results
+    are cached on disk for the cache's TTL. While a search for a query is in flight, other
+    callers asking the same thing wait for that one call instead of issuing their own,
+    whether they come from threads or from the event loop. If the caller running the search
+    is cancelled (e.g. its client went away), a waiting caller runs it instead; only real
+    backend errors are passed on to everyone waiting.
+
+    Calls that reach the backend first take a token from `rate_limiter`, and failed calls
+    (an exception, or the error string Tavily returns instead of raising) are retried with
+    jittered exponential backoff.
+
+    Args:
+        backend: Search tool with `invoke(query)` / `ainvoke(query)` returning a list of
+            result dicts, e.g. `TavilySearchResults`, or a local stand-in for tests.
+        cache (DiskCache): Where results are stored; its `ttl` bounds their age.
+        rate_limiter: Token bucket with `acquire()` / `aacquire()`, e.g. `InMemoryRateLimiter`, or None.
+        max_attempts (int): Backend calls per search before giving up.
+    """
+
+    def __init__(self, backend, cache: DiskCache, rate_limiter=None, max_attempts: int = 3):
+        self.backend = backend
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self.max_attempts = max_attempts
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _claim(self, key: str):
+        """
+        Return (future, is_leader): the leader runs the search, everyone else waits on the future.
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future, False
+            future = Future()
+            self._inflight[key] = future
+            return future, True
+
+    def _store(self, key: str, results) -> None:
+        # Tavily reports failures as a string instead of raising; those are not cached.
+        if isinstance(results, list):
+            self.cache.set(key, results)
+
+    def _settle(self, key: str, future: Future, results=None, error: BaseException = None) -> None:
+        # Called after `_store`, so late callers hit either the cache or the in-flight search.
+        with self._lock:
+            self._inflight.pop(key, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(results)
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter, so retries of concurrent searches do not line up.
+        return random.uniform(0, min(8.0, 0.5 * 2 ** attempt))
+
+    def _call(self, query: str):
+        for attempt in range(self.max_attempts):
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            try:
+                results = self.backend.invoke(query)
+            except Exception:
+                if attempt + 1 == self.max_attempts:
+                    raise
+                results = None
+            if isinstance(results, list) or attempt + 1 == self.max_attempts:
+                return results
+            time.sleep(self._backoff(attempt))
+
+    async def _acall(self, query: str):
+        for attempt in range(self.max_attempts):
+            if self.rate_limiter is not None:
+                await self.rate_limiter.aacquire()
+            try:
+                results = await self.backend.ainvoke(query)
+            except Exception:
+                if attempt + 1 == self.max_attempts:
+                    raise
+                results = None
+            if isinstance(results, list) or attempt + 1 == self.max_attempts:
+                return results
+            await asyncio.sleep(self._backoff(attempt))
+
+    def _abandon(self, key: str, future: Future) -> None:
+        with self._lock:
+            self._inflight.pop(key, None)
+        future.set_exception(_Abandoned())
+
+    def search(self, query: str) -> List[dict]:
+        key = normalize_question(query)
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        self.misses += 1
+        while True:
+            future, leader = self._claim(key)
+            if not leader:
+                try:
+                    return future.result()
+                except _Abandoned:
+                    continue
+            try:
+                results = self._call(query)
+                self._store(key, results)
+            except Exception as e:
+                self._settle(key, future, error=e)
+                raise
+            except BaseException:
+                self._abandon(key, future)
+                raise
+            self._settle(key, future, results)
+            return results
+
+    async def asearch(self, query: str) -> List[dict]:
+        key = normalize_question(query)
+        # SQLite calls block; keep them off the event loop.
+        cached = await asyncio.to_thread(self.cache.get, key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        self.misses += 1
+        while True:
+            future, leader = self._claim(key)
+            if not leader:
+                try:
+                    # Shielded: a waiting caller that is cancelled must not cancel the shared search.
+                    return await asyncio.shield(asyncio.wrap_future(future))
+                except _Abandoned:
+                    continue
+            try:
+                results = await self._acall(query)
+                await asyncio.to_thread(self._store, key, results)
+            except Exception as e:
+                self._settle(key, future, error=e)
+                raise
+            except BaseException:
+                self._abandon(key, future)
+                raise
+            self._settle(key, future, results)
+            return results